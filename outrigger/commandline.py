@@ -6,9 +6,11 @@ import os
 import pdb
 import shutil
 import sys
+import tempfile
 import traceback
 
 import gffutils
+import joblib
 import numpy as np
 import pandas as pd
 
@@ -16,7 +18,7 @@ from outrigger import __version__
 import outrigger.common
 from outrigger import util, common
 from outrigger.index import events, adjacencies
-from outrigger.io import star, gtf, bam
+from outrigger.io import star, gtf, bam, core, store, tables
 from outrigger.psi import compute
 from outrigger.validate import check_splice_sites
 
@@ -28,6 +30,27 @@ JUNCTION_METADATA_PATH = os.path.join(JUNCTION_PATH, 'metadata.csv')
 INDEX = os.path.join(OUTPUT, 'index')
 EVENTS_CSV = 'events.csv'
 METADATA_CSV = 'metadata.csv'
+SAMPLES_PER_BATCH = 100
+CHECKPOINT_MANIFEST = 'manifest.npz'
+
+
+def comma_separated(converter):
+    """Make an argparse type which can also take comma-separated values
+
+    Parameters
+    ----------
+    converter : function
+        Converts each value from a string, e.g. ``int``
+
+    Returns
+    -------
+    parse : function
+        Converts "5" to 5 and "5,10" to [5, 10]
+    """
+    def parse(value):
+        values = [converter(x) for x in value.split(',')]
+        return values if len(values) > 1 else values[0]
+    return parse
 
 
 class CommandLine(object):
@@ -138,11 +161,29 @@ class CommandLine(object):
                                        'reading. Default is -1, which means '
                                        'to use as many threads as are '
                                        'available.')
+        index_parser.add_argument('--bam-threads', required=False, default=1,
+                                  action='store', type=int,
+                                  help='Number of threads each process uses '
+                                       'to decompress the --bam file it is '
+                                       'reading. Default is 1.')
         index_parser.add_argument('--low-memory', required=False,
                                   default=False,
                                   action='store_true',
                                   help='If set, then use a smaller memory '
                                        'footprint. By default, this is off.')
+        index_parser.add_argument('--output-format', required=False,
+                                  default='csv', choices=tables.FORMATS,
+                                  help='Format of the junction reads, '
+                                       'junction metadata and event tables. '
+                                       '"parquet" and "feather" are '
+                                       'compressed binary files which are '
+                                       'much faster to write and read back '
+                                       'in, e.g. with --resume or "outrigger '
+                                       'psi", and need pyarrow. "npz" is '
+                                       'used instead if pyarrow is not '
+                                       'installed. Every later step reads '
+                                       'any of these formats. '
+                                       '(default="csv")')
         index_parser.add_argument('--splice-types', required=False,
                                   default='all',
                                   action='store',
@@ -269,22 +310,134 @@ class CommandLine(object):
             '-b', '--bam', required=False,
             type=str, action='store', nargs='*',
             help='Bam files to use to calculate psi on')
-        psi_parser.add_argument('-m', '--min-reads', type=int, action='store',
+        psi_parser.add_argument('-m', '--min-reads',
+                                type=comma_separated(int), action='store',
                                 required=False, default=10,
                                 help='Minimum number of reads per junction for'
-                                     ' calculating Psi (default=10)')
-        psi_parser.add_argument('-e', '--method', type=str, action='store',
+                                     ' calculating Psi (default=10). Several '
+                                     'values can be given separated by '
+                                     'commas, e.g. "5,10,20", and then Psi '
+                                     'is calculated with each of them (and '
+                                     'each --method and '
+                                     '--uneven-coverage-multiplier) from one '
+                                     'read of the data, into a separate '
+                                     'folder of psi/ for each combination')
+        psi_parser.add_argument('-e', '--method',
+                                type=comma_separated(str), action='store',
                                 required=False, default='mean',
                                 help='How to deal with multiple junctions on '
                                      'an event - take the mean (default) or '
-                                     'the min? (the other option)')
+                                     'the min? (the other option). Both can '
+                                     'be given as "mean,min"')
         psi_parser.add_argument('-u', '--uneven-coverage-multiplier',
-                                type=int, action='store',
+                                type=comma_separated(int), action='store',
                                 required=False, default=10,
                                 help='If a junction one one side of an exon is'
                                      ' bigger than the other side of the exon '
                                      'by this amount, (default is 10, so 10x '
-                                     'bigger), then do not use this event')
+                                     'bigger), then do not use this event. '
+                                     'Several values can be given separated '
+                                     'by commas')
+        psi_parser.add_argument('--engine', type=str, action='store',
+                                required=False, default='pandas',
+                                choices=compute.ENGINES,
+                                help='How to find whether each sample of an '
+                                     'event has enough reads for Psi. '
+                                     '"pandas" (default) checks one sample at'
+                                     ' a time, "numpy" checks all samples of '
+                                     'an event at once, which is much faster '
+                                     'on datasets with many samples, and '
+                                     '"batched" checks all samples of '
+                                     '--batch-size events at once. All give '
+                                     'the same results.')
+        psi_parser.add_argument('--batch-size', type=int, action='store',
+                                required=False, default=compute.BATCH_SIZE,
+                                help='Number of events to calculate Psi on at'
+                                     ' once with "--engine batched". Larger '
+                                     'batches are faster but use more memory.'
+                                     ' (default={})'.format(
+                                        compute.BATCH_SIZE))
+        psi_parser.add_argument('--compact-summary', action='store_true',
+                                required=False, default=False,
+                                help='If this flag is used, then leave the '
+                                     'samples with zero reads on all of an '
+                                     "event's junctions out of the summary "
+                                     'tables, and write only the number of '
+                                     'these samples for each event to '
+                                     '"zero_reads.csv" files. Most samples '
+                                     'are like this in single-cell data, so '
+                                     'the summaries become much smaller. By '
+                                     'default, this is off.')
+        psi_parser.add_argument('--no-summary', action='store_true',
+                                required=False, default=False,
+                                help='If this flag is used, then only write '
+                                     'the Psi matrices and not the summary '
+                                     'tables of junction reads and notes on '
+                                     'each event in each sample. Making the '
+                                     'summaries takes much more time and '
+                                     'memory than Psi itself. By default, '
+                                     'this is off.')
+        psi_partitions = psi_parser.add_mutually_exclusive_group(
+            required=False)
+        psi_partitions.add_argument(
+            '--stream', action='store_true', required=False, default=False,
+            help='If this flag is used, then read the junction reads of only '
+                 '--samples-per-batch samples at a time, from the junction '
+                 'reads csv or the --bam files, and append their Psi to the '
+                 'output files before reading the next samples. Then the '
+                 'memory used depends on the size of the index and not the '
+                 'number of samples. The samples are written in the order '
+                 'they are read. By default, this is off.')
+        psi_parser.add_argument('--samples-per-batch', type=int,
+                                action='store', required=False,
+                                default=SAMPLES_PER_BATCH,
+                                help='Number of samples to read at once with'
+                                     ' "--stream". (default={})'.format(
+                                        SAMPLES_PER_BATCH))
+        psi_partitions.add_argument(
+            '--by-chromosome', action='store_true', required=False,
+            default=False,
+            help='If this flag is used, then split the junction reads csv '
+                 'by chromosome, and calculate Psi on the events of one '
+                 'chromosome at a time, with only the reads of that '
+                 'chromosome in memory. Chromosomes are calculated in '
+                 'parallel with --n-jobs, and with --max-memory, only as '
+                 'many at once as are estimated to fit. By default, this is '
+                 'off.')
+        psi_parser.add_argument('--max-memory', type=float, action='store',
+                                required=False, default=None,
+                                help='Approximate number of gigabytes of '
+                                     'memory to use at once for the '
+                                     'chromosomes with "--by-chromosome". '
+                                     'By default, there is no limit.')
+        psi_parser.add_argument('--groups', type=str, action='store',
+                                required=False, default=None,
+                                help='Csv file of the group of each sample, '
+                                     'e.g. the cluster of each cell, with the'
+                                     ' columns --sample-id-col and '
+                                     '--group-col. If this is given, then the'
+                                     ' junction reads of the samples in each '
+                                     'group are added up, and Psi is '
+                                     'calculated on the groups instead of '
+                                     'the samples. Samples which are not in '
+                                     'any group are left out. By default, '
+                                     'Psi is calculated on every sample.')
+        psi_parser.add_argument('--group-col', default='group',
+                                help="Name of column in --groups containing "
+                                     "the group of each sample. "
+                                     "(default='group')")
+        psi_parser.add_argument('--n-bootstraps', type=int, action='store',
+                                required=False, default=0,
+                                help='With --groups, also resample the '
+                                     'samples of each group with replacement'
+                                     ' this many times, and calculate Psi on'
+                                     ' each resampling as '
+                                     '"<group>_bootstrap<i>". (default=0)')
+        psi_parser.add_argument('--seed', type=int, action='store',
+                                required=False, default=None,
+                                help='Seed of the random resampling of '
+                                     '--n-bootstraps, to get the same '
+                                     'bootstraps every time')
         psi_parser.add_argument('--ignore-multimapping', action='store_true',
                                 help='Applies to STAR SJ.out.tab files only.'
                                      ' If this flag is used, then do not '
@@ -323,11 +476,108 @@ class CommandLine(object):
                                      'reading. Default is -1, which means '
                                      'to use as many threads as are '
                                      'available.')
+        psi_parser.add_argument('--bam-threads', required=False, default=1,
+                                action='store', type=int,
+                                help='Number of threads each process uses '
+                                     'to decompress the --bam file it is '
+                                     'reading. Default is 1.')
         psi_parser.add_argument('--low-memory', required=False,
                                 default=False,
                                 action='store_true',
                                 help='If set, then use a smaller memory '
                                      'footprint. By default, this is off.')
+        psi_parser.add_argument('--output-format', required=False,
+                                default='csv', choices=tables.FORMATS,
+                                help='Format of the Psi and summary tables, '
+                                     'and of the junction reads if they are '
+                                     'made from --sj-out-tab or --bam files.'
+                                     ' "parquet" and "feather" are '
+                                     'compressed binary files which are '
+                                     'much faster to write and read, and '
+                                     'need pyarrow. "npz" is used instead if'
+                                     ' pyarrow is not installed. Only "csv" '
+                                     'can be used with --stream or '
+                                     '--by-chromosome. (default="csv")')
+        psi_parser.add_argument('--sparse-psi', required=False,
+                                default=False, action='store_true',
+                                help='If set, write only the Psi values '
+                                     'which are not NaN, as a sparse '
+                                     'matrix in a "_sparse.npz" file instead'
+                                     ' of the Psi tables. Most Psi are NaN '
+                                     'in single-cell data, so this is many '
+                                     'times smaller. Cannot be used with '
+                                     '--stream or --by-chromosome.')
+        psi_parser.add_argument('--quantize-psi', required=False,
+                                default=False, action='store_true',
+                                help='If set, store sparse Psi as 8-bit '
+                                     'codes within 1/500 (plus 32-bit '
+                                     'float rounding) instead of '
+                                     'exact 32-bit floats. Implies '
+                                     '--sparse-psi.')
+        psi_parser.add_argument('--psi-store', required=False,
+                                default=False, action='store_true',
+                                help='If set, also write the Psi in chunks '
+                                     'sorted by genomic position to '
+                                     '"outrigger_psi_store", indexed by '
+                                     'event coordinates and gene names and '
+                                     'ids, so the Psi of one gene or region '
+                                     'can be read with '
+                                     'outrigger.io.store.PsiStore without '
+                                     'reading the whole table. Cannot be '
+                                     'used with --stream or '
+                                     '--by-chromosome.')
+        psi_parser.add_argument('--checkpoint-size', type=int,
+                                required=False, default=None,
+                                help='If given, calculate Psi on chunks of '
+                                     'this many events, and save each '
+                                     'finished chunk to "psi/checkpoints", '
+                                     'so that an interrupted run can be '
+                                     'continued with --resume. Cannot be '
+                                     'used with --stream, --by-chromosome '
+                                     'or several --min-reads, --method or '
+                                     '--uneven-coverage-multiplier values.')
+        psi_parser.add_argument('--resume', action='store_true',
+                                required=False, default=False,
+                                help='If set, skip the chunks of events '
+                                     'which were finished by an interrupted'
+                                     ' run with the same --checkpoint-size '
+                                     'and other options. Otherwise, old '
+                                     'checkpoints are removed.')
+        psi_parser.add_argument('--targeted', action='store_true',
+                                required=False, default=False,
+                                help='If set, with --bam, only read the '
+                                     'parts of the genome with the '
+                                     'junctions of the index\'s events, '
+                                     'and only count the reads of these '
+                                     'junctions. This is much faster than '
+                                     'counting every junction, and gives '
+                                     'the same Psi, but no junction reads '
+                                     'file is written. Cannot be used with '
+                                     '--stream or --by-chromosome.')
+        psi_parser.add_argument('--barcode-tag', type=str, required=False,
+                                default=None,
+                                help='If given, the --bam files are '
+                                     'multiplexed single-cell data, and '
+                                     'the reads of each cell barcode in '
+                                     'this tag (e.g. "CB") are counted as '
+                                     'a sample, in one pass over the file. '
+                                     'With several files, the barcodes are '
+                                     'prefixed by the file name. Cannot be '
+                                     'used with --stream, --by-chromosome '
+                                     'or --targeted.')
+        psi_parser.add_argument('--umi-tag', type=str, required=False,
+                                default=None,
+                                help='If given with --barcode-tag, the reads '
+                                     'of the same barcode, UMI in this tag '
+                                     '(e.g. "UB") and junction are counted '
+                                     'once.')
+        psi_parser.add_argument('--barcode-whitelist', type=str,
+                                required=False, default=None,
+                                help='File with one cell barcode per line, '
+                                     'e.g. the "barcodes.tsv.gz" of a cell '
+                                     'caller. If given with --barcode-tag, '
+                                     'only the reads of these barcodes are '
+                                     'counted.')
         psi_parser.set_defaults(func=self.psi)
 
         if input_options is None or len(input_options) == 0:
@@ -400,12 +650,15 @@ class Subcommand(object):
     debug = False
     force = False
     resume = False
+    output_format = 'csv'
+    bam_threads = 1
 
     def __init__(self, **kwargs):
 
         # Read all arguments and set as attributes of this class
         for key, value in kwargs.items():
             setattr(self, key, value)
+        self.output_format = tables.resolve_format(self.output_format)
 
         for folder in self.folders:
             self.maybe_make_folder(folder)
@@ -445,7 +698,15 @@ class Subcommand(object):
         if self.junction_reads_csv is not None:
             return self.junction_reads_csv
         else:
-            return os.path.join(self.junctions_folder, 'reads.csv')
+            return tables.find_table(
+                os.path.join(self.junctions_folder, 'reads.csv'),
+                self.output_format)
+
+    @property
+    def junction_metadata_filename(self):
+        return tables.find_table(
+            os.path.join(self.junctions_folder, METADATA_CSV),
+            self.output_format)
 
     def make_junction_reads_file(self):
         if self.bam is None:
@@ -460,12 +721,14 @@ class Subcommand(object):
                           'junction table of reads spanning exon-exon '
                           'junctions')
             splice_junctions = bam.read_multiple_bams(
-                self.bam, self.ignore_multimapping, self.n_jobs)
+                self.bam, self.ignore_multimapping, self.n_jobs,
+                self.bam_threads)
         dirname = os.path.dirname(self.junction_reads_filename)
         if not os.path.exists(dirname):
             os.makedirs(dirname)
         util.progress('Writing {} ...\n'.format(self.junction_reads_filename))
-        splice_junctions.to_csv(self.junction_reads_filename, index=False)
+        tables.write_table(splice_junctions, self.junction_reads_filename,
+                           self.output_format, index=False)
         util.done()
         return splice_junctions
 
@@ -477,14 +740,13 @@ class Subcommand(object):
             util.progress('Found compiled junction reads file in {} and '
                           'reading it in '
                           '...'.format(self.junction_reads_filename))
-            splice_junctions = pd.read_csv(self.junction_reads_filename,
-                                           low_memory=self.low_memory)
+            splice_junctions = tables.read_table(
+                self.junction_reads_filename, low_memory=self.low_memory)
             util.done()
 
         return splice_junctions
 
-    @staticmethod
-    def junction_metadata(spliced_reads, csv):
+    def junction_metadata(self, spliced_reads, csv):
         """Get just the junction info from the concatenated read files"""
         util.progress('Creating splice junction metadata of merely where '
                       'junctions start and stop')
@@ -495,7 +757,8 @@ class Subcommand(object):
         if not os.path.exists(csv):
             util.progress('Writing metadata of junctions to {csv}'
                           ' ...'.format(csv=csv))
-            metadata.to_csv(csv, index=False)
+            tables.write_table(metadata, csv, self.output_format,
+                               index=False)
 
         return metadata
 
@@ -628,8 +891,9 @@ class Index(Subcommand):
         exon_junction_adjacencies.write_de_novo_exons(novel_exons_gtf)
         util.done()
 
-        csv = os.path.join(self.index_folder,
-                           'exon_direction_junction.csv')
+        csv = tables.find_table(
+            os.path.join(self.index_folder, 'exon_direction_junction.csv'),
+            self.output_format)
         if not os.path.exists(csv) or self.force:
             util.progress('Getting junction-direction-exon triples for graph '
                           'database ...')
@@ -639,11 +903,12 @@ class Index(Subcommand):
 
             util.progress('Writing junction-exon-direction triples'
                           ' to {}...'.format(csv))
-            junction_exon_triples.to_csv(csv, index=False)
+            tables.write_table(junction_exon_triples, csv,
+                               self.output_format, index=False)
             util.done()
         elif self.resume:
-            junction_exon_triples = pd.read_csv(csv,
-                                                low_memory=self.low_memory)
+            junction_exon_triples = tables.read_table(
+                csv, low_memory=self.low_memory)
         else:
             raise ValueError("Found existing junction-exon-triples file "
                              "({csv}) but don't "
@@ -665,8 +930,8 @@ class Index(Subcommand):
         return event_maker
 
     def _exists_event_csv(self, splice_abbrev):
-        return os.path.exists(
-                os.path.join(self.index_folder, splice_abbrev, EVENTS_CSV))
+        return os.path.exists(tables.find_table(
+            os.path.join(self.index_folder, splice_abbrev, EVENTS_CSV)))
 
     def make_events_by_traversing_graph(self, event_maker, db):
         """Search the splice graph for alternative exons"""
@@ -720,11 +985,13 @@ class Index(Subcommand):
         util.done()
 
         # Write to a file
-        csv = os.path.join(self.index_folder, splice_type, EVENTS_CSV)
+        csv = tables.table_filename(
+            os.path.join(self.index_folder, splice_type, EVENTS_CSV),
+            self.output_format)
         util.progress('Writing {splice_type} events to {csv} '
                       '...'.format(splice_type=splice_type.upper(), csv=csv))
-        attributes.to_csv(csv, index=True,
-                          index_label=outrigger.common.EVENT_ID)
+        tables.write_table(attributes.rename_axis(outrigger.common.EVENT_ID),
+                           csv, self.output_format)
         util.done()
 
     def write_new_gtf(self, db):
@@ -746,8 +1013,8 @@ class Index(Subcommand):
         spliced_reads = self.csv()
 
         spliced_reads = self.filter_junctions_on_reads(spliced_reads)
-        metadata_csv = os.path.join(self.junctions_folder, METADATA_CSV)
-        metadata = self.junction_metadata(spliced_reads, metadata_csv)
+        metadata = self.junction_metadata(spliced_reads,
+                                          self.junction_metadata_filename)
 
         db = self.maybe_make_db()
 
@@ -856,12 +1123,25 @@ class Validate(SubcommandAfterIndex):
                                     splice_name=splice_name_spaces,
                                     splice_abbrev=splice_abbrev.upper()))
 
-            original_events_csv = os.path.join(self.input_index,
-                                               splice_abbrev, EVENTS_CSV)
-            validated_events_csv = os.path.join(validated_folder, EVENTS_CSV)
+            original_events_csv = tables.find_table(os.path.join(
+                self.input_index, splice_abbrev, EVENTS_CSV))
+            events_format = tables.table_format(original_events_csv)
+            validated_events_csv = tables.table_filename(
+                os.path.join(validated_folder, EVENTS_CSV), events_format)
             util.progress('\tWriting validated events to {csv} ...'.format(
                 csv=validated_events_csv))
 
+            if events_format != 'csv':
+                # Binary tables can't be copied a line at a time
+                events_df = tables.read_table(original_events_csv,
+                                              index_col=0)
+                tables.write_table(
+                    events_df.loc[events_df.index.isin(
+                        splice_sites_validated.index)],
+                    validated_events_csv, events_format)
+                util.done(3)
+                continue
+
             with open(validated_events_csv, 'w') as f_validated:
                 with open(original_events_csv) as f_original:
                     for i, line in enumerate(f_original):
@@ -875,6 +1155,27 @@ class Validate(SubcommandAfterIndex):
 
 class Psi(SubcommandAfterIndex):
 
+    engine = 'pandas'
+    batch_size = compute.BATCH_SIZE
+    compact_summary = False
+    no_summary = False
+    stream = False
+    samples_per_batch = SAMPLES_PER_BATCH
+    by_chromosome = False
+    max_memory = None
+    groups = None
+    group_col = 'group'
+    n_bootstraps = 0
+    seed = None
+    sparse_psi = False
+    quantize_psi = False
+    psi_store = False
+    checkpoint_size = None
+    targeted = False
+    barcode_tag = None
+    umi_tag = None
+    barcode_whitelist = None
+
     # Instantiate empty variables here so PyCharm doesn't get mad at me
     reads_col = None
     sample_id_col = None
@@ -888,6 +1189,16 @@ class Psi(SubcommandAfterIndex):
     def psi_folder(self):
         return os.path.join(self.output_folder, 'psi')
 
+    @property
+    def checkpoint_folder(self):
+        return os.path.join(self.psi_folder, 'checkpoints')
+
+    @property
+    def sweep(self):
+        """Whether Psi is calculated with several settings at once"""
+        return any(isinstance(x, list) for x in (
+            self.min_reads, self.method, self.uneven_coverage_multiplier))
+
     @property
     def splice_type_folders(self):
         return dict((splice_name, os.path.join(self.input_index,
@@ -934,7 +1245,7 @@ class Psi(SubcommandAfterIndex):
             util.progress(
                 'Reading splice junction reads from {} ...'.format(
                     self.junction_reads_filename))
-            junction_reads = pd.read_csv(
+            junction_reads = tables.read_table(
                 self.junction_reads_filename, dtype=dtype,
                 low_memory=self.low_memory)
             util.done()
@@ -956,36 +1267,305 @@ class Psi(SubcommandAfterIndex):
 
     def maybe_get_validated_events(self, splice_abbrev):
         splice_folder = os.path.join(self.input_index, splice_abbrev)
-        events = os.path.join(splice_folder, EVENTS_CSV)
-        validated_events = os.path.join(splice_folder, 'validated', EVENTS_CSV)
+        events = tables.find_table(os.path.join(splice_folder, EVENTS_CSV))
+        validated_events = tables.find_table(
+            os.path.join(splice_folder, 'validated', EVENTS_CSV))
         if os.path.exists(validated_events):
             return validated_events
         else:
             return events
 
+    def junction_reads_matrix(self):
+        """Get a sparse samples x junctions matrix of junction reads
+
+        Most junctions have no reads in most samples, so only the nonzero
+        reads are kept instead of the full samples x junctions table. If the
+        junction reads csv already exists, it is streamed in chunks instead
+        of read all at once.
+
+        Returns
+        -------
+        junction_reads_2d : scipy.sparse.csc_matrix
+            A (n_samples, n_junctions) matrix of junction reads
+        samples, junctions : pandas.Index
+            Sample ids of the rows and junction ids of the columns of
+            ``junction_reads_2d``
+        """
+        metadata_csv = self.junction_metadata_filename
+
+        # The reads are counted again even if a junction reads file exists,
+        # e.g. from "outrigger index --bam", which doesn't have only the
+        # index's junctions or the reads of each cell barcode
+        if self.targeted:
+            return self.targeted_junction_reads_matrix()
+        if self.barcode_tag is not None:
+            return self.barcoded_junction_reads_matrix()
+
+        if os.path.exists(self.junction_reads_filename) and \
+                os.path.exists(metadata_csv):
+            util.progress('Found compiled junction reads file in {} and '
+                          'reading it in chunks ...'.format(
+                            self.junction_reads_filename))
+            matrix = core.read_junction_reads_sparse(
+                self.junction_reads_filename,
+                sample_id_col=self.sample_id_col,
+                junction_id_col=self.junction_id_col,
+                reads_col=self.reads_col)
+            util.done()
+            return matrix
+
+        # The junction reads need to be made, or the whole table is needed
+        # anyway to make the junction metadata
+        junction_reads = self.csv()
+        self.junction_metadata(junction_reads, metadata_csv)
+        return core.junction_reads_to_sparse(
+            junction_reads, sample_id_col=self.sample_id_col,
+            junction_id_col=self.junction_id_col, reads_col=self.reads_col)
+
+    def targeted_junction_reads_matrix(self):
+        """Count the --bam reads of only the junctions of the index's events
+
+        Returns
+        -------
+        junction_reads_2d, samples, junctions
+            Same as ``junction_reads_matrix``, with only the junctions of
+            the index which have reads in any sample
+        """
+        junctions = set()
+        for splice_name, splice_abbrev in outrigger.common.SPLICE_TYPES:
+            filename = self.maybe_get_validated_events(splice_abbrev)
+            if not os.path.exists(filename):
+                continue
+            event_annotation = tables.read_table(
+                filename, index_col=0, low_memory=self.low_memory)
+            junctions.update(compute.index_junctions(
+                event_annotation,
+                **outrigger.common.ISOFORM_JUNCTIONS[splice_abbrev]))
+        util.progress('Counting reads on the {} junctions of the index in '
+                      '{} bam files ...'.format(len(junctions), len(self.bam)))
+        matrix = bam.read_multiple_bams_targeted(
+            self.bam, junctions, self.ignore_multimapping, self.n_jobs,
+            self.bam_threads)
+        util.done()
+        return matrix
+
+    def barcoded_junction_reads_matrix(self):
+        """Count the --bam reads of each cell barcode as a sample
+
+        Returns
+        -------
+        junction_reads_2d, samples, junctions
+            Same as ``junction_reads_matrix``, with the barcodes as samples
+        """
+        whitelist = None
+        if self.barcode_whitelist is not None:
+            whitelist = pd.read_csv(self.barcode_whitelist, header=None,
+                                    sep='\t', usecols=[0], dtype=str)[0]
+        util.progress('Counting junction reads of each cell barcode in '
+                      'the "{}" tag of {} bam files ...'.format(
+                        self.barcode_tag, len(self.bam)))
+        matrix = bam.read_barcoded_bams(
+            self.bam, self.barcode_tag, self.umi_tag, whitelist,
+            self.ignore_multimapping, self.n_jobs, self.bam_threads)
+        util.done()
+        return matrix
+
+    def sample_groups(self):
+        """Read the group of each sample from the --groups csv
+
+        Returns
+        -------
+        groups : pandas.Series
+            Group of each sample, indexed by sample id
+        """
+        util.progress('Reading groups of samples from {} ...'.format(
+            self.groups))
+        groups = tables.read_table(self.groups, dtype=str,
+                                   low_memory=self.low_memory)
+        for flag, col in (('--sample-id-col', self.sample_id_col),
+                          ('--group-col', self.group_col)):
+            if col not in groups:
+                raise ValueError(
+                    "The required column name {col} does not exist in {csv}. "
+                    "You can change this with the command line flag, "
+                    "{flag}".format(col=col, csv=self.groups, flag=flag))
+        util.done()
+        return groups.set_index(self.sample_id_col)[self.group_col]
+
+    def group_junction_reads(self, junction_reads_2d, samples, junctions):
+        """Add up the junction reads of the samples in each of --groups
+
+        Parameters
+        ----------
+        junction_reads_2d : scipy.sparse.csc_matrix
+            A (n_samples, n_junctions) matrix of junction reads
+        samples, junctions : pandas.Index
+            Sample ids of the rows and junction ids of the columns of
+            ``junction_reads_2d``
+
+        Returns
+        -------
+        group_reads_2d : scipy.sparse.csc_matrix
+            A (n_groups, n_junctions) matrix of the junction reads of each
+            group, followed by the --n-bootstraps of each group
+        groups, junctions : pandas.Index
+            Group ids of the rows and junction ids of the columns of
+            ``group_reads_2d``
+        """
+        groups = self.sample_groups()
+        util.progress('Adding up the junction reads of {} samples in {} '
+                      'groups, with {} bootstraps of each group ...'.format(
+                        len(samples), groups.nunique(), self.n_bootstraps))
+        matrix = compute.group_junction_reads(
+            junction_reads_2d, groups, samples=samples, junctions=junctions,
+            n_bootstraps=self.n_bootstraps, random_state=self.seed)
+        util.done()
+        return matrix
+
+    def sample_batches(self, junctions):
+        """Read the junction reads of a few samples at a time
+
+        If the junction reads csv doesn't exist yet, it is made from the
+        --bam or --sj-out-tab files as they are read.
+
+        Parameters
+        ----------
+        junctions : pandas.Index
+            Junction ids to use as the columns of every matrix
+
+        Yields
+        ------
+        junction_reads_2d : scipy.sparse.csc_matrix
+            A (n_samples, n_junctions) matrix of the junction reads of at
+            most --samples-per-batch samples
+        samples, junctions : pandas.Index
+            Sample ids of the rows and junction ids of the columns of
+            ``junction_reads_2d``
+        """
+        kwargs = dict(sample_id_col=self.sample_id_col,
+                      junction_id_col=self.junction_id_col,
+                      reads_col=self.reads_col)
+
+        if os.path.exists(self.junction_reads_filename):
+            util.progress('Found compiled junction reads file in {} and '
+                          'reading it {} samples at a time ...'.format(
+                            self.junction_reads_filename,
+                            self.samples_per_batch))
+            batches = core.iter_junction_reads_samples(
+                self.junction_reads_filename,
+                n_samples=self.samples_per_batch, **kwargs)
+            for junction_reads in batches:
+                yield core.junction_reads_to_sparse(
+                    junction_reads, junctions=junctions, **kwargs)
+            return
+
+        filenames = self.sj_out_tab if self.bam is None else self.bam
+        dirname = os.path.dirname(self.junction_reads_filename)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        # Only give the junction reads file its real name once it has every
+        # sample, so an interrupted run doesn't leave an incomplete one
+        unfinished = self.junction_reads_filename + '.unfinished'
+        for start in range(0, len(filenames), self.samples_per_batch):
+            batch = filenames[start:start + self.samples_per_batch]
+            if self.bam is None:
+                junction_reads = star.read_multiple_sj_out_tab(
+                    batch, ignore_multimapping=self.ignore_multimapping)
+            else:
+                junction_reads = bam.read_multiple_bams(
+                    batch, self.ignore_multimapping, self.n_jobs,
+                    self.bam_threads)
+            junction_reads.to_csv(unfinished, index=False,
+                                  mode='w' if start == 0 else 'a',
+                                  header=start == 0)
+            yield core.junction_reads_to_sparse(
+                junction_reads, junctions=junctions, **kwargs)
+        util.progress('Writing {} ...'.format(self.junction_reads_filename))
+        os.rename(unfinished, self.junction_reads_filename)
+        util.done()
+
     def execute(self):
         """Calculate percent spliced in (psi) of splicing events"""
+        if self.sweep and (self.stream or self.by_chromosome):
+            raise ValueError(
+                "Psi can only be calculated with several --min-reads, "
+                "--method or --uneven-coverage-multiplier values at once "
+                "when all samples are read together, not with --stream or "
+                "--by-chromosome")
+        if self.groups is not None and (self.stream or self.by_chromosome):
+            raise ValueError(
+                "Psi can only be calculated on --groups when all samples are "
+                "read together, not with --stream or --by-chromosome")
+        if (self.sparse_psi or self.quantize_psi) and (
+                self.stream or self.by_chromosome):
+            raise ValueError(
+                "Sparse Psi can only be written when all samples are read "
+                "together, not with --stream or --by-chromosome")
+        if self.psi_store and (self.stream or self.by_chromosome):
+            raise ValueError(
+                "The Psi store can only be written when all samples are read "
+                "together, not with --stream or --by-chromosome")
+        if self.targeted and (self.bam is None or self.stream
+                              or self.by_chromosome):
+            raise ValueError(
+                "Only the junctions of the index can be counted (--targeted) "
+                "in --bam files, when all samples are read together, not "
+                "with --stream or --by-chromosome")
+        if self.barcode_tag is not None and (
+                self.bam is None or self.stream or self.by_chromosome
+                or self.targeted):
+            raise ValueError(
+                "The reads of each cell barcode (--barcode-tag) can only be "
+                "counted in --bam files, when all samples are read together, "
+                "not with --stream, --by-chromosome or --targeted")
+        if self.barcode_tag is None and (self.umi_tag is not None or
+                                         self.barcode_whitelist is not None):
+            raise ValueError(
+                "--umi-tag and --barcode-whitelist can only be used with "
+                "--barcode-tag")
+        if self.checkpoint_size is not None and (
+                self.sweep or self.stream or self.by_chromosome):
+            raise ValueError(
+                "Psi can only be calculated with --checkpoint-size when all "
+                "samples are read together with one setting, not with "
+                "--stream, --by-chromosome or several --min-reads, --method "
+                "or --uneven-coverage-multiplier values")
+        if (self.stream or self.by_chromosome) and (
+                self.output_format != 'csv' or tables.table_format(
+                    self.junction_reads_filename) != 'csv'):
+            raise ValueError(
+                "With --stream or --by-chromosome, the tables are read and "
+                "written a piece at a time, so the junction reads and "
+                "--output-format must both be csv")
+        if self.stream:
+            return self.execute_streaming()
+        if self.by_chromosome:
+            return self.execute_by_chromosome()
 
         logger = logging.getLogger('outrigger.psi')
         if self.debug:
             logger.setLevel(10)
 
-        junction_reads = self.csv()
-
-        metadata_csv = os.path.join(self.junctions_folder, METADATA_CSV)
-        self.junction_metadata(junction_reads, metadata_csv)
-
-        junction_reads_2d = junction_reads.pivot(index=self.sample_id_col,
-                                                 columns=self.junction_id_col,
-                                                 values=self.reads_col)
-        junction_reads_2d.fillna(0, inplace=True)
-        junction_reads_2d = junction_reads_2d.astype(int)
+        junction_reads_2d, samples, junctions = self.junction_reads_matrix()
+        if self.groups is not None:
+            junction_reads_2d, samples, junctions = \
+                self.group_junction_reads(junction_reads_2d, samples,
+                                          junctions)
 
         logger.debug('\n--- Splice Junction reads ---')
-        logger.debug(repr(junction_reads.head()))
+        logger.debug(repr(junction_reads_2d))
 
-        psis = []
-        summaries = []
+        if os.path.exists(self.checkpoint_folder) and not (
+                self.checkpoint_size is not None and self.resume):
+            util.progress('Removing old checkpoints in {} ...'.format(
+                self.checkpoint_folder))
+            shutil.rmtree(self.checkpoint_folder)
+            util.done()
+
+        # Psi, summaries and zero read counts of every splice type, for each
+        # setting of the thresholds
+        outputs = {}
+        annotations = []
         for splice_name, splice_abbrev in outrigger.common.SPLICE_TYPES:
             filename = self.maybe_get_validated_events(splice_abbrev)
             if not os.path.exists(filename):
@@ -998,12 +1578,15 @@ class Psi(SubcommandAfterIndex):
                           ' ...'.format(name=splice_name, abbrev=splice_abbrev,
                                         filename=filename))
 
-            event_annotation = pd.read_csv(filename, index_col=0,
-                                           low_memory=self.low_memory)
+            event_annotation = tables.read_table(
+                filename, index_col=0, low_memory=self.low_memory)
             util.done()
+            if self.psi_store:
+                annotations.append(event_annotation[
+                    [store.EVENT_LOCATION] + [
+                        column for column in store.GENE_COLUMNS
+                        if column in event_annotation]])
 
-            isoform_junctions = outrigger.common.ISOFORM_JUNCTIONS[
-                splice_abbrev]
             logger.debug('\n--- Splicing event annotation ---')
             logger.debug(repr(event_annotation.head()))
 
@@ -1012,59 +1595,804 @@ class Psi(SubcommandAfterIndex):
                 '{name} ({abbrev}) events ...'.format(
                     name=splice_name, abbrev=splice_abbrev))
             # Splice type percent spliced-in (psi) and summary
-            type_psi, summary = compute.calculate_psi(
-                event_annotation, junction_reads_2d,
-                min_reads=self.min_reads, n_jobs=self.n_jobs,
-                method=self.method,
-                uneven_coverage_multiplier=self.uneven_coverage_multiplier,
-                **isoform_junctions)
+            if self.sweep:
+                results = compute.calculate_psi_sweep(
+                    event_annotation, junction_reads_2d,
+                    **self.psi_kwargs(splice_abbrev, samples, junctions))
+            else:
+                results = {None: self.calculate_psi(
+                    event_annotation, splice_abbrev, junction_reads_2d,
+                    samples, junctions)}
 
-            # Write this event's percent spliced-in matrix
-            csv = os.path.join(self.psi_folder, splice_abbrev,
-                               'psi.csv'.format(splice_abbrev))
-            util.progress('Writing {name} ({abbrev}) Psi values to {filename}'
-                          ' ...'.format(name=splice_name, abbrev=splice_abbrev,
-                                        filename=csv))
-            self.maybe_make_folder(os.path.dirname(csv))
-            type_psi.to_csv(csv, na_rep='NA')
-
-            # Write this event's summary of events and why they weren't or were
-            # calculated Psi on
-            csv = os.path.join(self.psi_folder, splice_abbrev,
-                               'summary.csv'.format(splice_abbrev))
-            util.progress('Writing {name} ({abbrev}) event summaries (e.g. '
-                          'number of reads, why an event does not have a Psi '
-                          'score) to {filename} ...'
-                          ''.format(name=splice_name, abbrev=splice_abbrev,
+            for setting, setting_results in results.items():
+                self.write_splice_type_psi(
+                    self.setting_folder(setting), splice_name, splice_abbrev,
+                    setting_results,
+                    *outputs.setdefault(setting, ([], [], [])))
+
+        for setting, (psis, summaries, zero_reads) in outputs.items():
+            self.write_psi(self.setting_folder(setting), psis, summaries,
+                           zero_reads, annotations)
+
+        # Everything is written, so the checkpoints aren't needed anymore
+        if os.path.exists(self.checkpoint_folder):
+            shutil.rmtree(self.checkpoint_folder)
+
+    def psi_kwargs(self, splice_abbrev, samples, junctions):
+        """Keyword arguments to ``compute.calculate_psi`` of a splice type
+
+        Parameters
+        ----------
+        splice_abbrev : str
+            Abbreviation of the splice type, e.g. "se"
+        samples, junctions : pandas.Index
+            Sample ids and junction ids of the junction reads matrix
+
+        Returns
+        -------
+        kwargs : dict
+            The settings, isoform junctions, samples and junctions
+        """
+        kwargs = dict(
+            min_reads=self.min_reads, n_jobs=self.n_jobs, method=self.method,
+            uneven_coverage_multiplier=self.uneven_coverage_multiplier,
+            engine=self.engine, batch_size=self.batch_size, samples=samples,
+            junctions=junctions, compact_summary=self.compact_summary,
+            categorical_summary=True, summarize=not self.no_summary)
+        kwargs.update(outrigger.common.ISOFORM_JUNCTIONS[splice_abbrev])
+        return kwargs
+
+    def calculate_psi(self, event_annotation, splice_abbrev, reads2d,
+                      samples, junctions):
+        """Calculate Psi of one splice type, in checkpointed chunks if asked
+
+        With --checkpoint-size, the events are sorted by id and split into
+        chunks, and the results of each chunk are saved in their own folder,
+        which only gets its real name once everything in it is written. With
+        --resume, the chunks which already have a folder are read instead of
+        calculated again.
+
+        Parameters
+        ----------
+        event_annotation : pandas.DataFrame
+            Events of the splice type
+        splice_abbrev : str
+            Abbreviation of the splice type, e.g. "se"
+        reads2d, samples, junctions
+            Output of ``junction_reads_matrix``
+
+        Returns
+        -------
+        psi, summary
+            Same as ``compute.calculate_psi``
+        """
+        kwargs = self.psi_kwargs(splice_abbrev, samples, junctions)
+        if self.checkpoint_size is None:
+            return compute.calculate_psi(event_annotation, reads2d, **kwargs)
+
+        event_ids = event_annotation.index.unique().sort_values()
+        self.check_checkpoints(os.path.join(self.checkpoint_folder,
+                                            splice_abbrev),
+                               event_ids, samples)
+        n_chunks = int(np.ceil(len(event_ids) / float(self.checkpoint_size)))
+        chunks = []
+        for i in range(n_chunks):
+            folder = os.path.join(self.checkpoint_folder, splice_abbrev,
+                                  'chunk{:05d}'.format(i))
+            if os.path.exists(folder):
+                util.progress('\tFound finished chunk {}/{} in {}, not '
+                              're-calculating ...'.format(i + 1, n_chunks,
+                                                          folder))
+                chunks.append(self.read_checkpoint(folder))
+                continue
+            util.progress('\tCalculating Psi on chunk {}/{} ...'.format(
+                i + 1, n_chunks))
+            chunk_ids = event_ids[i * self.checkpoint_size:
+                                  (i + 1) * self.checkpoint_size]
+            results = compute.calculate_psi(event_annotation.loc[chunk_ids],
+                                            reads2d, **kwargs)
+            self.write_checkpoint(results, folder)
+            chunks.append(results)
+
+        # Put the chunks back together, with Psi on the sorted events as if
+        # they were calculated all at once
+        psi = pd.concat([chunk[0] for chunk in chunks], axis=1)
+        if self.no_summary:
+            summary = None
+        else:
+            summary = compute.concat_summaries([chunk[1] for chunk in chunks])
+        return psi, summary
+
+    def checkpoint_manifest(self, event_ids, samples):
+        """Settings, events and samples which checkpoints are made with
+
+        Returns
+        -------
+        manifest : dict
+            Arrays of strings of the settings which change the chunks or
+            their Psi, and of the event ids and sample ids
+        """
+        settings = ['{}={}'.format(name, getattr(self, name)) for name in (
+            'checkpoint_size', 'min_reads', 'method',
+            'uneven_coverage_multiplier', 'engine', 'no_summary',
+            'compact_summary')]
+        return dict(settings=np.array(settings, dtype=str),
+                    event_ids=np.array([str(x) for x in event_ids],
+                                       dtype=str),
+                    samples=np.array([str(x) for x in samples], dtype=str))
+
+    def check_checkpoints(self, folder, event_ids, samples):
+        """Make sure resumed checkpoints were made the same way, or start them
+
+        Parameters
+        ----------
+        folder : str
+            Checkpoints of one splice type
+        event_ids, samples : pandas.Index
+            Sorted ids of the events and samples Psi is calculated on
+
+        Raises
+        ------
+        ValueError
+            If the checkpoints in ``folder`` were made with other settings,
+            events or samples, whose chunks can't be mixed with these
+        """
+        manifest = self.checkpoint_manifest(event_ids, samples)
+        filename = os.path.join(folder, CHECKPOINT_MANIFEST)
+        if os.path.exists(folder):
+            same = os.path.exists(filename)
+            if same:
+                with np.load(filename) as arrays:
+                    same = all(key in arrays.files and
+                               np.array_equal(arrays[key], values)
+                               for key, values in manifest.items())
+            if not same:
+                raise ValueError(
+                    "The checkpoints in {folder} were made with other "
+                    "settings, events or samples, so they can't be resumed. "
+                    "Run again without --resume to remove them and start "
+                    "over".format(folder=folder))
+            return
+
+        # Written under another name first, so it is never incomplete
+        os.makedirs(folder)
+        unfinished = os.path.join(folder, 'unfinished_' + CHECKPOINT_MANIFEST)
+        np.savez(unfinished, **manifest)
+        os.rename(unfinished, filename)
+
+    def write_checkpoint(self, results, folder):
+        """Save the results of a chunk of events, all or nothing
+
+        Parameters
+        ----------
+        results : tuple
+            ``(psi, summary)`` as from ``compute.calculate_psi``
+        folder : str
+            Where to save them. They are written to another folder which is
+            renamed to this one when done, so it is never incomplete
+        """
+        unfinished = folder + '.unfinished'
+        if os.path.exists(unfinished):
+            shutil.rmtree(unfinished)
+        os.makedirs(unfinished)
+        psi, summary = results
+        tables.write_sparse_psi(psi, os.path.join(unfinished, 'psi'))
+        if summary is not None:
+            tables.write_table(summary,
+                               os.path.join(unfinished, 'summary.npz'),
+                               'npz', index=False)
+        if isinstance(summary, compute.CompactSummary):
+            tables.write_table(summary.zero_reads.reset_index(),
+                               os.path.join(unfinished, 'zero_reads.npz'),
+                               'npz', index=False)
+        os.rename(unfinished, folder)
+
+    def read_checkpoint(self, folder):
+        """Read the results of a chunk of events saved by write_checkpoint
+
+        Returns
+        -------
+        psi, summary
+            Same as ``compute.calculate_psi``
+        """
+        psi = tables.read_sparse_psi(
+            tables.sparse_psi_filename(os.path.join(folder, 'psi')))
+        summary = None
+        if not self.no_summary:
+            summary = tables.read_table(os.path.join(folder, 'summary.npz'))
+            # The summaries of the other chunks are categorical
+            for column in summary.columns:
+                if summary[column].dtype == object:
+                    summary[column] = summary[column].astype('category')
+        if self.compact_summary and not self.no_summary:
+            zero_reads = tables.read_table(
+                os.path.join(folder, 'zero_reads.npz'), index_col=0)
+            summary = compute.CompactSummary.from_summary(
+                summary, zero_reads[common.ZERO_READS_SAMPLES])
+        return psi, summary
+
+    def setting_folder(self, setting):
+        """Folder for the Psi of one setting of the thresholds
+
+        Parameters
+        ----------
+        setting : tuple or None
+            (min_reads, method, uneven_coverage_multiplier) when Psi is
+            calculated with several settings at once, otherwise None
+
+        Returns
+        -------
+        folder : str
+            The psi folder, or a subfolder of it labeled with the setting
+        """
+        if setting is None:
+            return self.psi_folder
+        return os.path.join(
+            self.psi_folder,
+            'min_reads={}_method={}_uneven_coverage_multiplier={}'.format(
+                *setting))
+
+    def psi_filename(self, filename):
+        """Name of a Psi matrix in the --output-format, or sparse"""
+        if self.sparse_psi or self.quantize_psi:
+            return tables.sparse_psi_filename(filename)
+        return tables.table_filename(filename, self.output_format)
+
+    def write_psi_matrix(self, psi, filename):
+        """Write a Psi matrix as a table, or only its non-NaN values"""
+        if self.sparse_psi or self.quantize_psi:
+            tables.write_sparse_psi(psi, filename, quantize=self.quantize_psi)
+        else:
+            tables.write_table(psi, filename, self.output_format, na_rep='NA')
+
+    def write_splice_type_psi(self, folder, splice_name, splice_abbrev,
+                              results, psis, summaries, zero_reads):
+        """Write the Psi and summary of one splice type
+
+        Parameters
+        ----------
+        folder : str
+            Where to write them, in a subfolder of the splice type
+        splice_name, splice_abbrev : str
+            Name and abbreviation of the splice type, e.g. "skipped_exon"
+            and "se"
+        results : tuple
+            ``(psi, summary)`` as from ``compute.calculate_psi``
+        psis, summaries, zero_reads : list
+            The Psi, summary and number of samples with zero reads of the
+            splice type are added to these, for ``write_psi``
+        """
+        type_psi, summary = results
+
+        # Write this event's percent spliced-in matrix
+        csv = self.psi_filename(os.path.join(folder, splice_abbrev, 'psi.csv'))
+        util.progress('Writing {name} ({abbrev}) Psi values to {filename}'
+                      ' ...'.format(name=splice_name, abbrev=splice_abbrev,
                                     filename=csv))
-            self.maybe_make_folder(os.path.dirname(csv))
-            summary.to_csv(csv, na_rep='NA', index=False)
-            psis.append(type_psi)
-            summary['splice_type'] = splice_abbrev
-            summaries.append(summary)
+        self.maybe_make_folder(os.path.dirname(csv))
+        self.write_psi_matrix(type_psi, csv)
+        psis.append(type_psi)
+
+        if self.no_summary:
             util.done()
+            return
+
+        # Write this event's summary of events and why they weren't or were
+        # calculated Psi on
+        csv = tables.table_filename(
+            os.path.join(folder, splice_abbrev, 'summary.csv'),
+            self.output_format)
+        util.progress('Writing {name} ({abbrev}) event summaries (e.g. '
+                      'number of reads, why an event does not have a Psi '
+                      'score) to {filename} ...'
+                      ''.format(name=splice_name, abbrev=splice_abbrev,
+                                filename=csv))
+        tables.write_table(summary, csv, self.output_format, index=False,
+                           na_rep='NA')
+
+        if self.compact_summary:
+            type_zero_reads = summary.zero_reads.reset_index()
+            csv = tables.table_filename(
+                os.path.join(folder, splice_abbrev, 'zero_reads.csv'),
+                self.output_format)
+            util.progress('Writing {name} ({abbrev}) number of samples '
+                          'with zero reads on each event to {filename}'
+                          ' ...'.format(name=splice_name,
+                                        abbrev=splice_abbrev,
+                                        filename=csv))
+            tables.write_table(type_zero_reads, csv, self.output_format,
+                               index=False)
+            type_zero_reads['splice_type'] = splice_abbrev
+            zero_reads.append(type_zero_reads)
+        summary['splice_type'] = pd.Categorical.from_codes(
+            np.zeros(len(summary), dtype=np.int8), [splice_abbrev])
+        summaries.append(summary)
+        util.done()
+
+    def write_psi(self, folder, psis, summaries, zero_reads, annotations=None):
+        """Write the Psi and summaries of all splice types together
 
+        Parameters
+        ----------
+        folder : str
+            Where to write them
+        psis, summaries, zero_reads : list
+            Filled in by ``write_splice_type_psi``
+        annotations : list, optional
+            Annotations of the events of each splice type, for the Psi store
+        """
         util.progress('Concatenating all calculated psi scores '
                       'into one big matrix...')
         splicing = pd.concat(psis, axis=1)
         util.done()
         splicing = splicing.T
-        csv = os.path.join(self.psi_folder, 'outrigger_psi.csv')
+        csv = self.psi_filename(os.path.join(folder, 'outrigger_psi.csv'))
         util.progress('Writing a samples x features matrix of Psi '
                       'scores to {} ...'.format(csv))
-        splicing.to_csv(csv, na_rep='NA')
+        self.write_psi_matrix(splicing, csv)
         util.done()
 
+        if self.psi_store:
+            store_folder = os.path.join(folder, 'outrigger_psi_store')
+            util.progress('Writing Psi sorted by genomic position to {} '
+                          '...'.format(store_folder))
+            store.write_psi_store(splicing, pd.concat(annotations),
+                                  store_folder)
+            util.done()
+
+        if self.no_summary:
+            return
+
         util.progress('Concatenating all summaries '
                       'into one big matrix...')
-        summary = pd.concat(summaries, ignore_index=True)
+        summary = compute.concat_summaries(summaries)
         util.done()
+        csv = tables.table_filename(
+            os.path.join(folder, 'outrigger_summary.csv'), self.output_format)
+        util.progress('Writing summary table of Psi scores, junction reads, '
+                      'and cases to {} ...'.format(csv))
+        tables.write_table(summary, csv, self.output_format, na_rep='NA')
+        util.done()
+
+        if self.compact_summary:
+            zero_reads = pd.concat(zero_reads, ignore_index=True)
+            csv = tables.table_filename(
+                os.path.join(folder, 'outrigger_zero_reads.csv'),
+                self.output_format)
+            util.progress('Writing number of samples with zero reads on '
+                          'each event to {} ...'.format(csv))
+            tables.write_table(zero_reads, csv, self.output_format,
+                               index=False)
+            util.done()
+
+    def execute_streaming(self):
+        """Calculate Psi of a few samples at a time and append to outputs
+
+        Only the reads of --samples-per-batch samples are in memory at once.
+        The Psi of every event of the index is calculated on each batch of
+        samples, and appended to the same files as ``execute`` writes. If the
+        junction reads csv doesn't exist yet, the events with junctions that
+        aren't in any sample can't be known in advance, so they are kept.
+        """
+        splice_types = []
+        junctions = set()
+        for splice_name, splice_abbrev in outrigger.common.SPLICE_TYPES:
+            filename = self.maybe_get_validated_events(splice_abbrev)
+            if not os.path.exists(filename):
+                util.progress('No {name} ({abbrev}) events found, '
+                              'skipping.'. format(name=splice_name,
+                                                  abbrev=splice_abbrev))
+                continue
+            util.progress('Reading {name} ({abbrev}) events from {filename}'
+                          ' ...'.format(name=splice_name, abbrev=splice_abbrev,
+                                        filename=filename))
+            event_annotation = tables.read_table(
+                filename, index_col=0, low_memory=self.low_memory)
+            isoform_junctions = outrigger.common.ISOFORM_JUNCTIONS[
+                splice_abbrev]
+            junctions.update(compute.index_junctions(event_annotation,
+                                                     **isoform_junctions))
+            splice_types.append((splice_abbrev, event_annotation,
+                                 isoform_junctions))
+            self.maybe_make_folder(os.path.join(self.psi_folder,
+                                                splice_abbrev))
+            util.done()
+        # Like with all samples at once, events with junctions that aren't in
+        # any sample are skipped, if the junctions of all samples are known
+        if os.path.exists(self.junction_reads_filename):
+            junctions.intersection_update(core.read_junction_ids(
+                self.junction_reads_filename, self.junction_id_col))
+        junctions = pd.Index(sorted(junctions), name=self.junction_id_col)
+
+        # Psi of each batch, as events x samples, to put side by side at the
+        # end
+        blocks_folder = tempfile.mkdtemp(prefix='blocks_',
+                                         dir=self.psi_folder)
+        blocks = []
+        summary_columns = {}
+        zero_reads = {}
+        try:
+            for i, (junction_reads_2d, samples, junctions) in enumerate(
+                    self.sample_batches(junctions)):
+                util.progress('Calculating percent spliced-in (Psi) scores '
+                              'on {} samples of batch {} ...'.format(
+                                len(samples), i + 1))
+                mode = 'w' if i == 0 else 'a'
+                psis = []
+                for splice_abbrev, event_annotation, isoform_junctions in \
+                        splice_types:
+                    results = compute.calculate_psi(
+                        event_annotation, junction_reads_2d,
+                        min_reads=self.min_reads, n_jobs=self.n_jobs,
+                        method=self.method,
+                        uneven_coverage_multiplier=self.
+                        uneven_coverage_multiplier,
+                        engine=self.engine, batch_size=self.batch_size,
+                        samples=samples, junctions=junctions,
+                        compact_summary=self.compact_summary,
+                        categorical_summary=True,
+                        summarize=not self.no_summary, **isoform_junctions)
+                    type_psi, summary = results
+
+                    csv = os.path.join(self.psi_folder, splice_abbrev,
+                                       'psi.csv')
+                    type_psi.to_csv(csv, na_rep='NA', mode=mode,
+                                    header=i == 0)
+                    psis.append(type_psi)
+
+                    if self.no_summary:
+                        continue
+                    # Keep the same columns as the first batch
+                    columns = summary_columns.setdefault(
+                        splice_abbrev, summary.columns)
+                    csv = os.path.join(self.psi_folder, splice_abbrev,
+                                       'summary.csv')
+                    summary.reindex(columns=columns).to_csv(
+                        csv, na_rep='NA', index=False, mode=mode,
+                        header=i == 0)
+                    if self.compact_summary:
+                        type_zero_reads = summary.zero_reads
+                        if splice_abbrev in zero_reads:
+                            type_zero_reads += zero_reads[splice_abbrev]
+                        zero_reads[splice_abbrev] = type_zero_reads
+
+                block = os.path.join(blocks_folder, '{}.csv'.format(i))
+                pd.concat(psis, axis=1).T.to_csv(block, na_rep='NA')
+                blocks.append(block)
+                util.done()
+
+            csv = os.path.join(self.psi_folder, 'outrigger_psi.csv')
+            util.progress('Writing a samples x features matrix of Psi '
+                          'scores to {} ...'.format(csv))
+            core.paste_csv_columns(blocks, csv)
+            util.done()
+        finally:
+            shutil.rmtree(blocks_folder, ignore_errors=True)
+
+        if self.no_summary:
+            return
+
+        self.write_combined_summary([splice_abbrev for splice_abbrev, _, _
+                                     in splice_types])
+
+        if self.compact_summary:
+            for splice_abbrev, type_zero_reads in zero_reads.items():
+                csv = os.path.join(self.psi_folder, splice_abbrev,
+                                   'zero_reads.csv')
+                type_zero_reads.reset_index().to_csv(csv, index=False)
+            zero_reads = pd.concat(
+                [type_zero_reads.reset_index().assign(splice_type=abbrev)
+                 for abbrev, type_zero_reads in zero_reads.items()],
+                ignore_index=True)
+            csv = os.path.join(self.psi_folder, 'outrigger_zero_reads.csv')
+            util.progress('Writing number of samples with zero reads on '
+                          'each event to {} ...'.format(csv))
+            zero_reads.to_csv(csv, index=False)
+            util.done()
+
+    def write_combined_summary(self, splice_abbrevs):
+        """Concatenate the summary files of splice types, a chunk at a time
+
+        Parameters
+        ----------
+        splice_abbrevs : list of str
+            Splice types whose "summary.csv" files to concatenate, in order
+        """
         csv = os.path.join(self.psi_folder, 'outrigger_summary.csv')
         util.progress('Writing summary table of Psi scores, junction reads, '
                       'and cases to {} ...'.format(csv))
-        summary.to_csv(csv, na_rep='NA')
+        filenames = [os.path.join(self.psi_folder, splice_abbrev,
+                                  'summary.csv')
+                     for splice_abbrev in splice_abbrevs]
+        core.append_csv_rows(filenames, csv,
+                             values=[{'splice_type': splice_abbrev}
+                                     for splice_abbrev in splice_abbrevs],
+                             index=True)
+        util.done()
+
+    def execute_by_chromosome(self):
+        """Calculate Psi of one chromosome at a time and write to outputs
+
+        Events and their junctions are always on one chromosome, so the
+        junction reads csv is split into one file per chromosome, and each
+        chromosome's Psi and summaries are calculated with only its reads and
+        events in memory, then written to a temporary folder. At the end, the
+        files of all chromosomes are put together into the same files as
+        ``execute`` writes.
+        """
+        if not os.path.exists(self.junction_reads_filename):
+            self.csv()
+        columns = dict(sample_id_col=self.sample_id_col,
+                       junction_id_col=self.junction_id_col,
+                       reads_col=self.reads_col)
+
+        splice_types = []
+        for splice_name, splice_abbrev in outrigger.common.SPLICE_TYPES:
+            filename = self.maybe_get_validated_events(splice_abbrev)
+            if not os.path.exists(filename):
+                util.progress('No {name} ({abbrev}) events found, '
+                              'skipping.'. format(name=splice_name,
+                                                  abbrev=splice_abbrev))
+                continue
+            util.progress('Reading {name} ({abbrev}) events from {filename}'
+                          ' ...'.format(name=splice_name, abbrev=splice_abbrev,
+                                        filename=filename))
+            event_annotation = tables.read_table(
+                filename, index_col=0, low_memory=self.low_memory)
+            isoform_junctions = outrigger.common.ISOFORM_JUNCTIONS[
+                splice_abbrev]
+            event_chroms = core.junction_chromosome(event_annotation[
+                isoform_junctions['isoform1_junctions'][0]])
+            splice_types.append((splice_abbrev, event_annotation,
+                                 event_chroms, isoform_junctions))
+            util.done()
+
+        folder = tempfile.mkdtemp(prefix='chromosomes_', dir=self.psi_folder)
+        try:
+            util.progress('Splitting junction reads in {} by chromosome '
+                          '...'.format(self.junction_reads_filename))
+            reads_csvs, samples, nonzero = \
+                core.split_junction_reads_by_chromosome(
+                    self.junction_reads_filename, folder, **columns)
+            util.done()
+
+            # Events of each chromosome. Chromosomes without reads are
+            # skipped, like events with junctions that aren't in the data
+            tasks, memory = {}, {}
+            for chrom in reads_csvs:
+                chrom_types = [
+                    (splice_abbrev, event_annotation.loc[
+                        (event_chroms == chrom).values], isoform_junctions)
+                    for splice_abbrev, event_annotation, event_chroms,
+                    isoform_junctions in splice_types
+                    if (event_chroms == chrom).any()]
+                if len(chrom_types) == 0:
+                    continue
+                tasks[chrom] = chrom_types
+                n_events = sum(event_annotation.index.nunique()
+                               for _, event_annotation, _ in chrom_types)
+                memory[chrom] = _chromosome_memory(
+                    len(samples), n_events, nonzero[chrom],
+                    summarize=not self.no_summary)
+            max_memory = None if self.max_memory is None \
+                else self.max_memory * 1e9
+            waves = _memory_waves(memory, max_memory)
+
+            kwargs = dict(
+                min_reads=self.min_reads, method=self.method,
+                uneven_coverage_multiplier=self.uneven_coverage_multiplier,
+                engine=self.engine, batch_size=self.batch_size,
+                compact_summary=self.compact_summary,
+                summarize=not self.no_summary)
+            for wave in waves:
+                util.progress('Calculating percent spliced-in (Psi) scores '
+                              'on chromosome(s) {} ...'.format(
+                                ', '.join(wave)))
+                if self.n_jobs == 1 or len(wave) == 1:
+                    for chrom in wave:
+                        _chromosome_psi(reads_csvs[chrom], samples,
+                                        tasks[chrom],
+                                        os.path.join(folder, chrom), columns,
+                                        n_jobs=self.n_jobs, **kwargs)
+                else:
+                    # Each chromosome gets one process
+                    n_jobs = len(wave) if self.n_jobs < 0 \
+                        else min(self.n_jobs, len(wave))
+                    joblib.Parallel(n_jobs=n_jobs)(
+                        joblib.delayed(_chromosome_psi)(
+                            reads_csvs[chrom], samples, tasks[chrom],
+                            os.path.join(folder, chrom), columns, n_jobs=1,
+                            **kwargs)
+                        for chrom in wave)
+                util.done()
+
+            # The same order as sorting the event ids, which start with
+            # "isoform1=junction:chrom:"
+            chroms = sorted(tasks, key=lambda x: x + ':')
+            self.merge_chromosomes(folder, chroms,
+                                   [x[0] for x in splice_types])
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    def merge_chromosomes(self, folder, chroms, splice_abbrevs):
+        """Put the files of each chromosome together into the output files
+
+        Parameters
+        ----------
+        folder : str
+            Folder with a subfolder of files for each chromosome, made by
+            ``_chromosome_psi``
+        chroms : list of str
+            Chromosomes in the order to write them
+        splice_abbrevs : list of str
+            Splice types to write
+        """
+        written = []
+        events_psis = []
+        zero_reads = []
+        for splice_abbrev in splice_abbrevs:
+            type_folders = [os.path.join(folder, chrom, splice_abbrev)
+                            for chrom in chroms]
+            type_folders = [x for x in type_folders if os.path.exists(x)]
+            if len(type_folders) == 0:
+                continue
+            self.maybe_make_folder(os.path.join(self.psi_folder,
+                                                splice_abbrev))
+
+            csv = os.path.join(self.psi_folder, splice_abbrev, 'psi.csv')
+            util.progress('Writing {abbrev} Psi values to {filename} '
+                          '...'.format(abbrev=splice_abbrev, filename=csv))
+            core.paste_csv_columns(
+                [os.path.join(x, 'psi.csv') for x in type_folders], csv)
+            events_psis.extend(os.path.join(x, 'events_psi.csv')
+                               for x in type_folders)
+            util.done()
+            written.append(splice_abbrev)
+
+            if self.no_summary:
+                continue
+            csv = os.path.join(self.psi_folder, splice_abbrev, 'summary.csv')
+            util.progress('Writing {abbrev} event summaries to {filename} '
+                          '...'.format(abbrev=splice_abbrev, filename=csv))
+            core.append_csv_rows(
+                [os.path.join(x, 'summary.csv') for x in type_folders], csv)
+            util.done()
+
+            if self.compact_summary:
+                csv = os.path.join(self.psi_folder, splice_abbrev,
+                                   'zero_reads.csv')
+                core.append_csv_rows(
+                    [os.path.join(x, 'zero_reads.csv') for x in type_folders],
+                    csv)
+                zero_reads.append(csv)
+
+        csv = os.path.join(self.psi_folder, 'outrigger_psi.csv')
+        util.progress('Writing a samples x features matrix of Psi '
+                      'scores to {} ...'.format(csv))
+        core.append_csv_rows(events_psis, csv)
         util.done()
 
+        if self.no_summary:
+            return
+        self.write_combined_summary(written)
+
+        if self.compact_summary:
+            csv = os.path.join(self.psi_folder, 'outrigger_zero_reads.csv')
+            util.progress('Writing number of samples with zero reads on '
+                          'each event to {} ...'.format(csv))
+            core.append_csv_rows(zero_reads, csv,
+                                 values=[{'splice_type': splice_abbrev}
+                                         for splice_abbrev in written])
+            util.done()
+
+
+# Rough number of bytes of each row of a summary, to estimate how much memory
+# calculating Psi on a chromosome takes
+SUMMARY_ROW_BYTES = 100
+
+
+def _chromosome_memory(n_samples, n_events, n_nonzero, summarize=True):
+    """Estimate the bytes of memory to calculate Psi on a chromosome
+
+    Parameters
+    ----------
+    n_samples : int
+        Number of samples
+    n_events : int
+        Number of events on the chromosome
+    n_nonzero : int
+        Number of nonzero junction reads on the chromosome
+    summarize : bool, optional
+        Whether the summary is made too
+
+    Returns
+    -------
+    memory : float
+        Estimated bytes for the sparse reads matrix, the single precision Psi
+        matrix and the summary
+    """
+    per_value = 4 + (SUMMARY_ROW_BYTES if summarize else 0)
+    return float(n_nonzero * 16 + n_samples * n_events * per_value)
+
+
+def _memory_waves(memory, max_memory=None):
+    """Group chromosomes to calculate at once, staying under a memory limit
+
+    Parameters
+    ----------
+    memory : dict
+        Mapping of each chromosome to its estimated memory
+    max_memory : float, optional
+        Maximum total memory of the chromosomes in a group. A chromosome
+        which needs more than this is in a group on its own. If None, all
+        chromosomes are in one group
+
+    Returns
+    -------
+    waves : list of list
+        Groups of chromosomes, the biggest ones first
+    """
+    chroms = sorted(memory, key=lambda x: (-memory[x], x))
+    if max_memory is None:
+        return [chroms] if chroms else []
+
+    # First fit decreasing
+    waves, totals = [], []
+    for chrom in chroms:
+        for i, total in enumerate(totals):
+            if total + memory[chrom] <= max_memory:
+                waves[i].append(chrom)
+                totals[i] += memory[chrom]
+                break
+        else:
+            waves.append([chrom])
+            totals.append(memory[chrom])
+    return waves
+
+
+def _chromosome_psi(reads_csv, samples, splice_types, folder, columns,
+                    **kwargs):
+    """Calculate Psi of the events on one chromosome and write it to files
+
+    Parameters
+    ----------
+    reads_csv : str
+        Tidy csv of the junction reads of only this chromosome
+    samples : pandas.Index
+        Ids of all samples, to use as the rows of the reads matrix
+    splice_types : list of tuples
+        Abbreviation, events on this chromosome and isoform junction numbers
+        of each splice type
+    folder : str
+        Folder to make, with a subfolder for each splice type with its
+        "psi.csv", "events_psi.csv" (events x samples), "summary.csv" and
+        "zero_reads.csv"
+    columns : dict
+        Column names of the sample ids, junction ids and reads in the csv
+    kwargs
+        Other keyword arguments to ``compute.calculate_psi``
+    """
+    reads2d, samples, junctions = core.read_junction_reads_sparse(
+        reads_csv, samples=samples, **columns)
+    for splice_abbrev, event_annotation, isoform_junctions in splice_types:
+        type_kwargs = dict(kwargs, **isoform_junctions)
+        results = compute.calculate_psi(
+            event_annotation, reads2d, samples=samples, junctions=junctions,
+            categorical_summary=True, **type_kwargs)
+        type_psi, summary = results
+
+        type_folder = os.path.join(folder, splice_abbrev)
+        os.makedirs(type_folder)
+        type_psi.to_csv(os.path.join(type_folder, 'psi.csv'), na_rep='NA')
+        type_psi.T.to_csv(os.path.join(type_folder, 'events_psi.csv'),
+                          na_rep='NA')
+        if summary is not None:
+            summary.to_csv(os.path.join(type_folder, 'summary.csv'),
+                           na_rep='NA', index=False)
+        if kwargs.get('compact_summary') and summary is not None:
+            summary.zero_reads.reset_index().to_csv(
+                os.path.join(type_folder, 'zero_reads.csv'), index=False)
+
 
 def main():
     try:
@@ -64,6 +64,7 @@ UNEVEN_COVERAGE_MULTIPLIER = 10
 # --- Outrigger Psi --- #
 NOTES = 'notes'
 PSI = 'psi'
+ZERO_READS_SAMPLES = 'n_samples_zero_reads'
 UPSTREAM = 'upstream'
 DOWNSTREAM = 'downstream'
 DIRECTIONS = UPSTREAM, DOWNSTREAM
@@ -1,70 +1,339 @@
-import collections
+import itertools
 import os
 
 import joblib
 import numpy as np
 import pandas as pd
 import pysam
+from scipy import sparse
 
 from ..common import UNIQUE_READS, MULTIMAP_READS, READS, CHROM, \
-    JUNCTION_START, JUNCTION_STOP, STRAND
-from .core import add_exons_and_junction_ids
+    JUNCTION_START, JUNCTION_STOP, STRAND, SAMPLE_ID, JUNCTION_ID
+from ..region import Region
+from .core import add_exons_and_junction_ids, compact_counts, \
+    junction_reads_to_sparse
+
+
+# Numbers of the CIGAR operations in pysam's cigartuples
+BAM_CMATCH, BAM_CINS, BAM_CDEL, BAM_CREF_SKIP = 0, 1, 2, 3
+BAM_CEQUAL, BAM_CDIFF = 7, 8
+
+# Operations which move along the reference
+REFERENCE_OPERATIONS = (BAM_CMATCH, BAM_CDEL, BAM_CREF_SKIP, BAM_CEQUAL,
+                        BAM_CDIFF)
+
+# Operations where the read skips over the reference, which are reported as
+# junctions when the read is spliced
+GAP_OPERATIONS = (BAM_CDEL, BAM_CREF_SKIP)
+
+# Number of spliced reads whose junctions are found together
+READS_PER_BATCH = 100000
+
+# Largest number of bases of a chromosome read by one process
+SHARD_LENGTH = 50000000
+
+# Tag of the cell barcode of each read in a multiplexed bam file
+BARCODE_TAG = 'CB'
+
+
+def _is_spliced(cigartuples):
+    """Whether an alignment has an intron ("N") in its CIGAR"""
+    if cigartuples is None or len(cigartuples) < 3:
+        return False
+    for operation, length in cigartuples:
+        if operation == BAM_CREF_SKIP:
+            return True
+    return False
+
+
+def _cigar_junctions(reference_starts, n_operations, cigars):
+    """Find the junctions of many alignments at once from their CIGARs
+
+    A junction is every stretch of the reference which the read skips over,
+    i.e. consecutive "N" and "D" operations, like walking along the aligned
+    pairs of the read, but without making a tuple for every aligned base.
+
+    Parameters
+    ----------
+    reference_starts : numpy.ndarray
+        (n_reads,) 0-based start of each alignment on the reference
+    n_operations : numpy.ndarray
+        (n_reads,) number of CIGAR operations of each alignment
+    cigars : numpy.ndarray
+        (sum(n_operations), 2) (operation, length) of the CIGARs of all the
+        alignments, one after the other
+
+    Returns
+    -------
+    reads : numpy.ndarray
+        (n_junctions,) position of the alignment of each junction
+    starts, stops : numpy.ndarray
+        (n_junctions,) 1-based first and last base of each junction, like
+        STAR's SJ.out.tab files
+    """
+    operations = cigars[:, 0]
+    lengths = cigars[:, 1].astype(np.int64)
+    reads = np.repeat(np.arange(len(n_operations)), n_operations)
+
+    # Position of each operation on the reference
+    consumed = np.where(np.isin(operations, REFERENCE_OPERATIONS), lengths, 0)
+    cumulative = np.concatenate([[0], np.cumsum(consumed)])
+    read_offsets = cumulative[np.cumsum(n_operations) - n_operations]
+    positions = reference_starts[reads] + cumulative[:-1] - np.repeat(
+        read_offsets, n_operations)
+
+    # Junctions start at the first of consecutive gaps in the same read
+    gaps = np.isin(operations, GAP_OPERATIONS)
+    continued = np.zeros(len(gaps), dtype=bool)
+    continued[1:] = gaps[:-1] & (reads[1:] == reads[:-1])
+    first = gaps & ~continued
+    if not first.any():
+        empty = np.array([], dtype=np.int64)
+        return empty, empty, empty
+    lengths = np.add.reduceat(lengths[gaps], np.flatnonzero(first[gaps]))
+    return reads[first], positions[first] + 1, positions[first] + lengths
+
+
+class JunctionCounts(object):
+
+    __slots__ = ('references', 'chrom', 'start', 'stop', 'reverse',
+                 'uniquely', 'multi')
+
+    def __init__(self, references):
+        """Numbers of uniquely and multi-mapped reads on each junction
+
+        Instead of a dictionary keyed by (chrom, start, stop, strand)
+        tuples, the junctions are kept in arrays of chromosome codes, int32
+        coordinates and a strand bit, and the reads of the same junction are
+        added up by sorting.
+
+        Parameters
+        ----------
+        references : list of str
+            Names of the chromosomes, e.g. of a bam file. The chromosome
+            codes are positions in this list
+        """
+        self.references = list(references)
+        self.chrom = np.zeros(0, dtype=np.int32)
+        self.start = np.zeros(0, dtype=np.int32)
+        self.stop = np.zeros(0, dtype=np.int32)
+        self.reverse = np.zeros(0, dtype=bool)
+        self.uniquely = np.zeros(0, dtype=np.int64)
+        self.multi = np.zeros(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.chrom)
+
+    def __repr__(self):
+        return 'outrigger.JunctionCounts ({0} junctions)'.format(len(self))
+
+    def add(self, chrom, start, stop, reverse, uniquely, multi):
+        """Add reads on junctions, e.g. one for each read
+
+        Parameters
+        ----------
+        chrom, start, stop, reverse : numpy.ndarray
+            Chromosome code, 1-based first and last base of the intron and
+            whether it is on the minus strand, of each junction
+        uniquely, multi : numpy.ndarray
+            Number of uniquely and multi-mapped reads on each junction
+        """
+        columns = [np.concatenate([getattr(self, name), values]).astype(
+            getattr(self, name).dtype) for name, values in zip(
+            self.__slots__[1:], (chrom, start, stop, reverse, uniquely,
+                                 multi))]
+        (self.chrom, self.start, self.stop, self.reverse, self.uniquely,
+         self.multi) = _sum_junctions(*columns)
+
+    def update(self, other):
+        """Add the reads of counts with the same chromosomes"""
+        self.add(other.chrom, other.start, other.stop, other.reverse,
+                 other.uniquely, other.multi)
+
+    @classmethod
+    def from_dicts(cls, uniquely, multi):
+        """Make counts from {(chrom, start, stop, strand): n_reads} dicts"""
+        keys = list(uniquely) + list(multi)
+        counts = cls(sorted(set(key[0] for key in keys)))
+        codes = dict((chrom, i) for i, chrom in enumerate(counts.references))
+        uniquely_reads = np.zeros(len(keys), dtype=np.int64)
+        uniquely_reads[:len(uniquely)] = list(uniquely.values())
+        multi_reads = np.zeros(len(keys), dtype=np.int64)
+        multi_reads[len(uniquely):] = list(multi.values())
+        counts.add(np.array([codes[key[0]] for key in keys], dtype=np.int32),
+                   np.array([key[1] for key in keys], dtype=np.int32),
+                   np.array([key[2] for key in keys], dtype=np.int32),
+                   np.array([key[3] == '-' for key in keys], dtype=bool),
+                   uniquely_reads, multi_reads)
+        return counts
+
+    def to_dicts(self):
+        """Make {(chrom, start, stop, strand): n_reads} dicts of the uniquely
+        and multi-mapped reads, leaving out the junctions without any"""
+        chroms = np.array(self.references, dtype=object)[self.chrom]
+        strands = np.where(self.reverse, '-', '+')
+        keys = zip(chroms.tolist(), self.start.tolist(), self.stop.tolist(),
+                   strands.tolist())
+        uniquely, multi = {}, {}
+        for key, u, m in zip(keys, self.uniquely.tolist(),
+                             self.multi.tolist()):
+            if u > 0:
+                uniquely[key] = u
+            if m > 0:
+                multi[key] = m
+        return uniquely, multi
+
+
+def _group_starts(keys):
+    """Positions where any of the sorted keys changes"""
+    if len(keys[0]) == 0:
+        return np.zeros(0, dtype=np.int64)
+    changed = np.zeros(len(keys[0]), dtype=bool)
+    changed[0] = True
+    for key in keys:
+        changed[1:] |= key[1:] != key[:-1]
+    return np.flatnonzero(changed)
+
+
+def _sum_keys(keys, counts):
+    """Add up the counts of the same keys, sorted by the first key first"""
+    order = np.lexsort(keys[::-1])
+    keys = [key[order] for key in keys]
+    firsts = _group_starts(keys)
+    if len(firsts) == 0:
+        return keys, [count[order] for count in counts]
+    return [key[firsts] for key in keys], [
+        np.add.reduceat(count[order], firsts) for count in counts]
+
+
+def _sum_junctions(chrom, start, stop, reverse, *counts):
+    """Add up the counts of the same junction, sorted by position"""
+    keys, counts = _sum_keys([chrom, start, stop, reverse], list(counts))
+    return keys + counts
+
+
+def _count_junctions(reads, counts, batch_size=READS_PER_BATCH, tags=()):
+    """Count the junctions of spliced reads, a batch of reads at a time
+
+    Parameters
+    ----------
+    reads : iterable of pysam.AlignedSegment
+        Alignments to count the junctions of. Only the spliced ones are used
+    counts : JunctionCounts
+        Counts of the uniquely mapped (mapping quality 255) and multi-mapped
+        reads, which are added to. The chromosome codes are the reads'
+        reference ids
+    batch_size : int, optional
+        Number of spliced reads whose junctions are found together
+    tags : tuple of str, optional
+        Tags of the reads, e.g. the cell barcode "CB", whose values are
+        given to ``counts.add`` too, after the counts. Reads without all of
+        them are skipped
+    """
+    batch = []
+    for read in reads:
+        cigartuples = read.cigartuples
+        if not _is_spliced(cigartuples):
+            continue
+        if tags and not all(read.has_tag(tag) for tag in tags):
+            continue
+        batch.append((read.reference_id, read.is_reverse,
+                      read.mapping_quality, read.reference_start,
+                      cigartuples) + tuple(read.get_tag(tag) for tag in tags))
+        if len(batch) == batch_size:
+            _count_batch_junctions(batch, counts)
+            batch = []
+    if batch:
+        _count_batch_junctions(batch, counts)
+
+
+def _count_batch_junctions(batch, counts):
+    """Add the junctions of a batch of reads to the counts"""
+    columns = list(zip(*batch))
+    chroms, reverse, quality, starts, cigartuples = columns[:5]
+    n_operations = np.array([len(cigar) for cigar in cigartuples])
+    cigars = np.array([operation for cigar in cigartuples
+                       for operation in cigar], dtype=np.int64)
+    reads, junction_starts, junction_stops = _cigar_junctions(
+        np.array(starts, dtype=np.int64), n_operations, cigars)
+
+    unique = np.array(quality)[reads] >= 255
+    tags = [np.array(column, dtype=object)[reads] for column in columns[5:]]
+    counts.add(np.array(chroms, dtype=np.int32)[reads], junction_starts,
+               junction_stops, np.array(reverse, dtype=bool)[reads],
+               unique.astype(np.int64), (~unique).astype(np.int64), *tags)
 
 
 def _report_read_positions(read, counter):
-    chrom = read.reference_name
+    """Count the junctions of one read, spliced or not"""
+    cigartuples = read.cigartuples
+    if not cigartuples:
+        return
+    reads, starts, stops = _cigar_junctions(
+        np.array([read.reference_start]), np.array([len(cigartuples)]),
+        np.array(cigartuples, dtype=np.int64))
     strand = '-' if read.is_reverse else '+'
+    for start, stop in zip(starts.tolist(), stops.tolist()):
+        counter[(read.reference_name, start, stop, strand)] += 1
+
 
-    last_read_pos = False
-    for read_loc, genome_loc in read.get_aligned_pairs():
-        if read_loc is None and last_read_pos:
-            # Add one to be compatible with STAR output and show the
-            # start of the intron (not the end of the exon)
-            start = genome_loc + 1
-        elif read_loc and last_read_pos is None:
-            stop = genome_loc  # we are right exclusive ,so this is correct
-            counter[(chrom, start, stop, strand)] += 1
-            del start
-            del stop
-        last_read_pos = read_loc
-
-
-def _choose_strand_and_sum(reads):
+def _majority_strand(chrom, start, stop, reverse, reads):
     """Use the strand with more counts and sum all reads with same junction
 
     STAR seems to take a simple majority to decide on strand when there are
-    reads mapping to both, so we'll do the same
+    reads mapping to both, so we'll do the same. When both strands have the
+    same number of reads, the plus strand is chosen.
 
     Parameters
     ----------
-    reads : pandas.Series
-        A (chrom, start, stop, strand)-indexed series of read counts
+    chrom, start, stop, reverse : numpy.ndarray
+        Chromosome code, start, stop and whether it is on the minus strand,
+        of each junction on each strand
+    reads : numpy.ndarray
+        Number of reads of each. Junctions without reads are left out
 
     Returns
     -------
-    reads_strand_chosen : pandas.Series
-        A (chrom, start, stop, strand)-indexed series of read counts, with
-        the majority strand as the "winner" and
-
+    chrom, start, stop, reverse, reads : numpy.ndarray
+        The same for each (chrom, start, stop) junction, sorted, with the
+        majority strand as the "winner" and the reads of both strands
     """
-    if reads.empty:
-        return pd.Series(name=reads.name)
-    locations = reads.groupby(level=(0, 1, 2)).idxmax()
-    counts = reads.groupby(level=(0, 1, 2)).sum()
+    observed = reads > 0
+    chrom, start, stop, reverse, reads = [
+        x[observed] for x in (chrom, start, stop, reverse, reads)]
+
+    # Within each junction, the strand with the most reads comes first
+    order = np.lexsort((reverse, -reads, stop, start, chrom))
+    keys = [key[order] for key in (chrom, start, stop)]
+    firsts = _group_starts(keys)
+    if len(firsts) == 0:
+        return keys + [reverse[order], reads[order]]
+    return [key[firsts] for key in keys] + [
+        reverse[order][firsts], np.add.reduceat(reads[order], firsts)]
 
-    index = pd.MultiIndex.from_tuples(locations.values)
 
-    return pd.Series(counts.values, index=index, name=reads.name)
+def _strand_table(chroms, chrom, start, stop, reverse, reads, name):
+    """Make a table of junction reads from the output of _majority_strand"""
+    return pd.DataFrame({CHROM: chroms[chrom],
+                         JUNCTION_START: start.astype(np.int64),
+                         JUNCTION_STOP: stop.astype(np.int64),
+                         STRAND: np.where(reverse, '-', '+'), name: reads},
+                        columns=[CHROM, JUNCTION_START, JUNCTION_STOP, STRAND,
+                                 name])
 
 
-def _combine_uniquely_multi(uniquely, multi, ignore_multimapping=False):
+def _combine_uniquely_multi(counts, ignore_multimapping=False):
     """Combine uniquely and multi-mapped read counts into a single table
 
+    Each junction is on the majority strand of its uniquely mapped reads,
+    and the multi-mapped reads are only added where their own majority
+    strand is the same one.
+
     Parameters
     ----------
-    unqiuely, multi : dict
-        A dictionary of {(chrom, start, end, strand) : n_reads} uniquely mapped
-        and multi-mapped (reads that could map to multiple parts of the genome)
+    counts : JunctionCounts
+        Uniquely mapped and multi-mapped (reads that could map to multiple
+        parts of the genome) reads on each junction
     ignore_multimapping : bool
         When summing all reads, whether or not to ignore the multimapping
         reads. Default is False.
@@ -75,77 +344,852 @@ def _combine_uniquely_multi(uniquely, multi, ignore_multimapping=False):
         A combined table of all uniquely and multi-mapped reads, with an
         additional column of "reads" which will ultimately be the reads used
         for creating an outrigger index and calculating percent spliced-in.
+        The counts are stored in the smallest unsigned integer type that
+        holds them.
     """
-    uniquely = pd.Series(uniquely, name=UNIQUE_READS)
-    multi = pd.Series(multi, name=MULTIMAP_READS)
+    # Sort the junctions by chromosome name, not code
+    chroms = np.array(counts.references, dtype=object)
+    order = np.argsort(chroms.astype(str), kind='mergesort')
+    ranks = np.empty(len(chroms), dtype=np.int32)
+    ranks[order] = np.arange(len(chroms))
+    chrom = ranks[counts.chrom]
+    chroms = chroms[order]
 
-    uniquely = _choose_strand_and_sum(uniquely)
-    multi = _choose_strand_and_sum(multi)
+    uniquely = _strand_table(chroms, *_majority_strand(
+        chrom, counts.start, counts.stop, counts.reverse, counts.uniquely),
+        name=UNIQUE_READS)
+    multi = _strand_table(chroms, *_majority_strand(
+        chrom, counts.start, counts.stop, counts.reverse, counts.multi),
+        name=MULTIMAP_READS)
 
     # Join the data on the chromosome locations
     if multi.empty:
-        reads = uniquely.to_frame()
-        reads[MULTIMAP_READS] = np.nan
+        reads = uniquely
+        reads[MULTIMAP_READS] = 0
     elif uniquely.empty:
-        reads = multi.to_frame()
-        reads[UNIQUE_READS] = np.nan
+        reads = multi
+        reads[UNIQUE_READS] = 0
     else:
-        reads = uniquely.to_frame().join(multi)
-
-    reads = reads.fillna(0)
-    reads = reads.astype(int)
+        reads = uniquely.merge(multi, how='left', on=[
+            CHROM, JUNCTION_START, JUNCTION_STOP, STRAND])
+    columns = [column for column in reads.columns
+               if column in (UNIQUE_READS, MULTIMAP_READS)]
+    reads[columns] = reads[columns].fillna(0).astype(np.int64)
 
     if ignore_multimapping:
         reads[READS] = reads[UNIQUE_READS]
     else:
-        reads[READS] = reads.sum(axis=1)
-    reads = reads.reset_index()
-    reads = reads.rename(columns={'level_0': CHROM, 'level_1': JUNCTION_START,
-                                  'level_2': JUNCTION_STOP, 'level_3': STRAND})
+        reads[READS] = reads[columns].sum(axis=1)
+    # Store each column of counts in the smallest unsigned type, after
+    # adding them up so the total can't overflow
+    for column in columns + [READS]:
+        reads[column] = compact_counts(reads[column])
     reads.index = np.arange(reads.shape[0])
     return reads
 
 
-def _get_junction_reads(filename):
-    """Read a sam file and extract unique and multi mapped junction reads"""
-    samfile = pysam.AlignmentFile(filename, "rb")
+def _bam_shards(filename, shard_length=SHARD_LENGTH):
+    """Split an indexed bam file into regions which can be read separately
 
-    # Uniquely mapped reads
-    uniquely = collections.Counter()
+    Parameters
+    ----------
+    filename : str
+        Name of the bam file
+    shard_length : int, optional
+        Largest number of bases in a region. Longer chromosomes are split
+        into several regions. If None, each region is a whole chromosome
+
+    Returns
+    -------
+    shards : list
+        (contig, start, stop) of every region of the chromosomes with mapped
+        reads, in 0-based half-open coordinates like pysam's ``fetch``. If
+        the bam file has no index, it can't be split, and this is ``[None]``
+    """
+    with pysam.AlignmentFile(filename, "rb") as samfile:
+        if not samfile.has_index():
+            return [None]
+        mapped = set(statistics.contig for statistics
+                     in samfile.get_index_statistics()
+                     if statistics.mapped > 0)
+        if shard_length is None:
+            shard_length = max(samfile.lengths)
+        return [(contig, start, min(start + shard_length, length))
+                for contig, length in zip(samfile.references, samfile.lengths)
+                if contig in mapped
+                for start in range(0, length, shard_length)]
 
-    # Multimapped reads
-    multi = collections.Counter()
 
-    for read in samfile.fetch():
-        if "N" in read.cigarstring:
-            if read.mapping_quality < 255:
-                counter = multi
-            else:
-                counter = uniquely
+def _get_junction_reads(filename, shard=None, threads=1):
+    """Read a sam file and extract unique and multi mapped junction reads
+
+    Parameters
+    ----------
+    filename : str
+        Name of the bam file
+    shard : tuple, optional
+        (contig, start, stop) region from ``_bam_shards`` to read only the
+        reads starting in. By default, read the whole file
+    threads : int, optional
+        Number of threads for decompressing the bam file
 
-            _report_read_positions(read, counter)
+    Returns
+    -------
+    counts : JunctionCounts
+        Number of uniquely and multi-mapped reads on each junction
+    """
+    samfile = pysam.AlignmentFile(filename, "rb", threads=threads)
+    counts = JunctionCounts(samfile.references)
+    _count_junctions(_fetch(samfile, shard), counts)
     samfile.close()
-    return uniquely, multi
+    return counts
 
 
-def bam_to_junction_reads_table(bam_filename, ignore_multimapping=False):
-    """Create a table of reads for this bam file"""
-    uniquely, multi = _get_junction_reads(bam_filename)
-    reads = _combine_uniquely_multi(uniquely, multi, ignore_multimapping)
+def _fetch(samfile, shard=None):
+    """Iterate over the reads starting in a region from ``_bam_shards``"""
+    if shard is None:
+        return samfile.fetch()
+    contig, start, stop = shard
+    # Reads overlapping the start of the region are counted with the
+    # region before, so every read is counted exactly once
+    return (read for read in samfile.fetch(contig, start, stop)
+            if read.reference_start >= start)
+
+
+def _junction_reads_table(counts, sample_id, ignore_multimapping=False):
+    """Create a table of reads from the junction counts of one sample"""
+    reads = _combine_uniquely_multi(counts, ignore_multimapping)
 
     # Remove "junctions" with same start and stop
     reads = reads.loc[reads[JUNCTION_START] != reads[JUNCTION_STOP]]
     reads.index = np.arange(reads.shape[0])
 
-    reads['sample_id'] = os.path.basename(bam_filename)
+    reads['sample_id'] = sample_id
     reads = add_exons_and_junction_ids(reads)
     return reads
 
 
-def read_multiple_bams(bam_filenames, ignore_multimapping=False, n_jobs=-1):
-    dfs = joblib.Parallel(n_jobs=n_jobs)(
-        joblib.delayed(
-            bam_to_junction_reads_table)(filename, ignore_multimapping)
-        for filename in bam_filenames)
+def bam_to_junction_reads_table(bam_filename, ignore_multimapping=False):
+    """Create a table of reads for this bam file"""
+    counts = _get_junction_reads(bam_filename)
+    return _junction_reads_table(counts, os.path.basename(bam_filename),
+                                 ignore_multimapping)
+
+
+def read_multiple_bams(bam_filenames, ignore_multimapping=False, n_jobs=-1,
+                       threads=1):
+    """Create a table of the junction reads of several bam files
+
+    Indexed bam files are split into regions of their chromosomes (see
+    ``_bam_shards``) which are read in parallel, so even a single big bam
+    file uses all ``n_jobs``. The counts of the regions are then added up,
+    which gives the same table as reading each file from start to end.
+
+    Parameters
+    ----------
+    bam_filenames : list of str
+        Names of the bam files. Each is a sample
+    ignore_multimapping : bool, optional
+        Whether to leave the multi-mapped reads out of the "reads" column
+    n_jobs : int, optional
+        Number of processes. If 1, read each file from start to end
+    threads : int, optional
+        Number of threads each process uses to decompress its bam file
+
+    Returns
+    -------
+    reads : pandas.DataFrame
+        Junction reads of all samples
+    """
+    shards = [(i, filename, shard)
+              for i, filename in enumerate(bam_filenames)
+              for shard in (_bam_shards(filename) if n_jobs != 1
+                            else [None])]
+    counts = joblib.Parallel(n_jobs=n_jobs)(
+        joblib.delayed(_get_junction_reads)(filename, shard, threads)
+        for i, filename, shard in shards)
+
+    # Add up the regions of each file
+    samples = [None] * len(bam_filenames)
+    for (i, filename, shard), shard_counts in zip(shards, counts):
+        if samples[i] is None:
+            samples[i] = shard_counts
+        else:
+            samples[i].update(shard_counts)
+    # Files without any mapped reads have no regions
+    samples = [JunctionCounts([]) if sample_counts is None else sample_counts
+               for sample_counts in samples]
+
+    dfs = [_junction_reads_table(sample_counts, os.path.basename(filename),
+                                 ignore_multimapping)
+           for filename, sample_counts in zip(bam_filenames, samples)]
     reads = pd.concat(dfs, ignore_index=True)
     return reads
+
+
+class TargetedJunctionCounts(object):
+
+    __slots__ = ('junctions', 'counts', 'uniquely_seen')
+
+    def __init__(self, references, chroms, starts, stops):
+        """Numbers of reads on only some junctions, e.g. those of an index
+
+        Reads on any other junction are ignored, so the counts are one
+        preallocated array instead of growing with every junction found.
+        Same as ``JunctionCounts``, reads are added with ``add``.
+
+        Parameters
+        ----------
+        references : list of str
+            Names of the chromosomes of the bam file, whose positions are
+            the chromosome codes of the reads
+        chroms, starts, stops : numpy.ndarray
+            Chromosome name, and 1-based first and last base of each
+            junction to count, without duplicates
+        """
+        codes = dict((chrom, i) for i, chrom in enumerate(references))
+        self.junctions = pd.MultiIndex.from_arrays(
+            [np.array([codes.get(chrom, -1) for chrom in chroms],
+                      dtype=np.int64), starts, stops])
+        # Uniquely mapped reads on the plus and minus strands, then
+        # multi-mapped reads on the plus and minus strands
+        self.counts = np.zeros((len(starts), 4), dtype=np.int64)
+        # Whether any uniquely mapped read was added, on any junction
+        self.uniquely_seen = False
+
+    def add(self, chrom, start, stop, reverse, uniquely, multi):
+        """Add the reads of the junctions which are counted"""
+        if len(chrom) == 0:
+            return
+        self.uniquely_seen |= bool(np.any(uniquely))
+        positions = self.junctions.get_indexer(pd.MultiIndex.from_arrays(
+            [chrom.astype(np.int64), start, stop]))
+        found = positions >= 0
+        positions = positions[found]
+        strand = reverse[found].astype(np.intp)
+        np.add.at(self.counts, (positions, strand), uniquely[found])
+        np.add.at(self.counts, (positions, 2 + strand), multi[found])
+
+
+def _target_regions(starts, stops):
+    """Merge the spans of the junctions of a chromosome into regions
+
+    Parameters
+    ----------
+    starts, stops : numpy.ndarray
+        1-based first and last base of each junction
+
+    Returns
+    -------
+    regions : list
+        (start, stop) of the regions covering all the junctions, sorted and
+        not overlapping, in 0-based half-open coordinates like pysam's
+        ``fetch``
+    """
+    order = np.argsort(starts, kind='mergesort')
+    starts = starts[order] - 1
+    stops = np.maximum.accumulate(stops[order])
+    if len(starts) == 0:
+        return []
+    new = np.ones(len(starts), dtype=bool)
+    new[1:] = starts[1:] > stops[:-1]
+    ends = np.append(np.flatnonzero(new)[1:] - 1, len(starts) - 1)
+    return list(zip(starts[new].tolist(), stops[ends].tolist()))
+
+
+def _count_targeted_junctions(filename, chrom, starts, stops, threads=1):
+    """Count the reads of the junctions on one chromosome of a bam file
+
+    Parameters
+    ----------
+    filename : str
+        Name of the bam file
+    chrom : str
+        Chromosome to read
+    starts, stops : numpy.ndarray
+        1-based first and last base of the junctions on ``chrom`` to count
+    threads : int, optional
+        Number of threads for decompressing the bam file
+
+    Returns
+    -------
+    counts : numpy.ndarray
+        (n_junctions, 4) uniquely mapped reads on the plus and minus strand,
+        and multi-mapped reads on the plus and minus strand of each junction,
+        in the smallest unsigned integer type that holds them
+    uniquely_seen : bool
+        Whether any uniquely mapped spliced read was read, on any junction
+    """
+    with pysam.AlignmentFile(filename, "rb", threads=threads) as samfile:
+        counts = TargetedJunctionCounts(
+            samfile.references, np.repeat(chrom, len(starts)), starts, stops)
+        if chrom in samfile.references:
+            previous_stop = 0
+            for start, stop in _target_regions(starts, stops):
+                # Reads which overlap the region before were counted there
+                reads = (read for read in samfile.fetch(chrom, start, stop)
+                         if read.reference_start >= previous_stop)
+                _count_junctions(reads, counts)
+                previous_stop = stop
+    return compact_counts(counts.counts), counts.uniquely_seen
+
+
+def _has_uniquely_spliced(filename, threads=1):
+    """Whether a bam file has any uniquely mapped spliced read"""
+    with pysam.AlignmentFile(filename, "rb", threads=threads) as samfile:
+        for read in samfile.fetch(until_eof=True):
+            if read.mapping_quality >= 255 and \
+                    _is_spliced(read.cigartuples):
+                return True
+    return False
+
+
+def _targeted_reads(counts, positions, reverse, uniquely_mapped,
+                    ignore_multimapping=False):
+    """Reads on each junction of one sample, like ``_combine_uniquely_multi``
+
+    Each junction is on the majority strand of its uniquely mapped reads,
+    and gets the multi-mapped reads only if their majority strand is the
+    same, so the reads are the same as in the table of all junctions.
+
+    Parameters
+    ----------
+    counts : numpy.ndarray
+        Counts of the junctions, as from ``_count_targeted_junctions``
+    positions : numpy.ndarray
+        (n_junctions,) row of ``counts`` of each junction id
+    reverse : numpy.ndarray
+        (n_junctions,) whether each junction id is on the minus strand
+    uniquely_mapped : bool
+        Whether the sample has any uniquely mapped spliced read, on any
+        junction. If not, the multi-mapped reads are used instead
+    ignore_multimapping : bool, optional
+        Whether to leave out the multi-mapped reads
+
+    Returns
+    -------
+    reads : numpy.ndarray
+        (n_junctions,) reads on each junction id
+    observed : numpy.ndarray
+        (n_junctions,) whether each junction id would be in the table of all
+        junctions of this sample
+    """
+    counts = counts[positions]
+    uniquely = counts[:, 0] + counts[:, 1]
+    multi = counts[:, 2] + counts[:, 3]
+    # The plus strand wins ties
+    uniquely_here = (uniquely > 0) & (
+        (counts[:, 1] > counts[:, 0]) == reverse)
+    multi_here = (multi > 0) & ((counts[:, 3] > counts[:, 2]) == reverse)
+
+    # Without any uniquely mapped reads, the multi-mapped reads are used
+    if uniquely_mapped:
+        observed = uniquely_here
+        multi_here &= uniquely_here
+    else:
+        observed = multi_here
+    reads = np.where(uniquely_here, uniquely, 0)
+    if not ignore_multimapping:
+        reads = reads + np.where(multi_here, multi, 0)
+    return reads, observed
+
+
+def read_multiple_bams_targeted(bam_filenames, junctions,
+                                ignore_multimapping=False, n_jobs=-1,
+                                threads=1):
+    """Count the reads of only some junctions, e.g. those of an index
+
+    Only the parts of the chromosomes with the junctions are read, and the
+    reads go straight into a samples x junctions matrix instead of a table
+    of every junction of every sample.
+
+    Parameters
+    ----------
+    bam_filenames : list of str
+        Names of the bam files. Each is a sample
+    junctions : pandas.Index
+        Ids of the junctions to count, e.g. "junction:chr2:100-200:+", as
+        from ``outrigger.psi.compute.index_junctions``
+    ignore_multimapping : bool, optional
+        Whether to leave out the multi-mapped reads
+    n_jobs : int, optional
+        Number of processes, each reading one chromosome of one bam file
+    threads : int, optional
+        Number of threads each process uses to decompress its bam file
+
+    Returns
+    -------
+    reads2d : scipy.sparse.csc_matrix
+        A (n_samples, n_junctions) matrix of junction reads, in the smallest
+        unsigned integer type that holds them, like
+        ``outrigger.io.core.junction_reads_to_sparse``
+    samples : pandas.Index
+        Sorted sample ids of the rows of ``reads2d``
+    junctions : pandas.Index
+        Sorted ids of the ``junctions`` with reads in any sample
+    """
+    junctions = pd.Index(sorted(junction for junction in junctions
+                                if isinstance(junction, str)))
+    regions = [Region(junction) for junction in junctions]
+    chroms = np.array([region.chrom for region in regions], dtype=object)
+    reverse = np.array([region.strand == '-' for region in regions],
+                       dtype=bool)
+    starts = np.array([region.start for region in regions], dtype=np.int64)
+    stops = np.array([region.stop for region in regions], dtype=np.int64)
+
+    # Junctions on both strands have the same reads, so count them once
+    positions = pd.factorize(['{}:{}-{}'.format(region.chrom, region.start,
+                                                region.stop)
+                              for region in regions])[0]
+    first = np.unique(positions, return_index=True)[1]
+    unique_chroms = chroms[first]
+    unique_starts = starts[first]
+    unique_stops = stops[first]
+
+    samples = sorted(set(os.path.basename(filename)
+                         for filename in bam_filenames))
+    rows = dict((sample, row) for row, sample in enumerate(samples))
+    on_chrom = dict((chrom, np.flatnonzero(unique_chroms == chrom))
+                    for chrom in sorted(set(unique_chroms)))
+    tasks = [(rows[os.path.basename(filename)], filename, chrom)
+             for filename in bam_filenames for chrom in on_chrom]
+    results = joblib.Parallel(n_jobs=n_jobs)(
+        joblib.delayed(_count_targeted_junctions)(
+            filename, chrom, unique_starts[on_chrom[chrom]],
+            unique_stops[on_chrom[chrom]], threads)
+        for row, filename, chrom in tasks)
+    sample_results = [[] for sample in samples]
+    uniquely_mapped = [False] * len(samples)
+    for (row, filename, chrom), (chrom_counts, uniquely_seen) in zip(
+            tasks, results):
+        sample_results[row].append((chrom, chrom_counts))
+        uniquely_mapped[row] |= uniquely_seen
+    # Like the table of all junctions, whether the multi-mapped reads are
+    # used depends on every junction of the sample, not only those read
+    for filename in bam_filenames:
+        row = rows[os.path.basename(filename)]
+        if not uniquely_mapped[row]:
+            uniquely_mapped[row] = _has_uniquely_spliced(filename, threads)
+
+    # Add up the chromosomes of each sample and keep only its nonzero reads
+    observed = np.zeros(len(junctions), dtype=bool)
+    entries = [(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64),
+                np.zeros(0, dtype=np.int64))]
+    for row, chrom_results in enumerate(sample_results):
+        counts = np.zeros((len(unique_starts), 4), dtype=np.int64)
+        for chrom, chrom_counts in chrom_results:
+            counts[on_chrom[chrom]] += chrom_counts
+        reads, sample_observed = _targeted_reads(
+            counts, positions, reverse, uniquely_mapped[row],
+            ignore_multimapping)
+        observed |= sample_observed
+        columns = np.flatnonzero(reads)
+        entries.append((np.repeat(row, len(columns)), columns,
+                        reads[columns]))
+    rows, columns, reads = [np.concatenate(x) for x in zip(*entries)]
+    reads2d = sparse.coo_matrix((reads, (rows, columns)),
+                                shape=(len(samples), len(junctions))).tocsc()
+
+    # Like a table of all junctions, only junctions found in any sample
+    found = np.flatnonzero(observed)
+    return compact_counts(reads2d[:, found]), \
+        pd.Index(samples, name=SAMPLE_ID), \
+        pd.Index(junctions[found], name=JUNCTION_ID)
+
+
+class BarcodeJunctionCounts(object):
+
+    __slots__ = ('references', 'codes', 'whitelisted', 'barcode', 'chrom',
+                 'start', 'stop', 'reverse', 'uniquely', 'multi',
+                 'molecule_keys', 'molecule_counts', 'partial', 'n_partial')
+
+    def __init__(self, references, whitelist=None, umis=False):
+        """Numbers of reads on each junction of each cell barcode
+
+        Like ``JunctionCounts``, with the barcode of each read as an integer
+        code. With UMIs, the reads of the same barcode, UMI and junction are
+        one molecule, which counts as one uniquely mapped read if any of its
+        reads is uniquely mapped, otherwise as one multi-mapped read. The
+        molecules are kept with their UMIs only until ``flush`` is called.
+
+        The reads of each batch are added up on their own, and only merged
+        into the counts so far once there are as many of them, so the
+        counts aren't sorted again for every batch. They are complete after
+        ``flush()``.
+
+        Parameters
+        ----------
+        references : list of str
+            Names of the chromosomes, e.g. of a bam file. The chromosome
+            codes are positions in this list
+        whitelist : iterable of str, optional
+            If given, only count the reads of these barcodes
+        umis : bool, optional
+            If True, ``add`` gets the UMI of each read after its barcode
+        """
+        self.references = list(references)
+        self.whitelisted = whitelist is not None
+        self.codes = {} if whitelist is None else dict(
+            (barcode, i) for i, barcode in enumerate(sorted(set(whitelist))))
+        self.barcode = np.zeros(0, dtype=np.int64)
+        self.chrom = np.zeros(0, dtype=np.int32)
+        self.start = np.zeros(0, dtype=np.int32)
+        self.stop = np.zeros(0, dtype=np.int32)
+        self.reverse = np.zeros(0, dtype=bool)
+        self.uniquely = np.zeros(0, dtype=np.int64)
+        self.multi = np.zeros(0, dtype=np.int64)
+        # Added up reads of each batch which aren't merged into the counts
+        self.partial = []
+        self.n_partial = 0
+        if umis:
+            # Barcode, UMI, chromosome, start, stop and strand of each
+            # molecule, and whether it is uniquely or multi-mapped
+            self.molecule_keys = [self.barcode, np.zeros(0, dtype=str),
+                                  self.chrom, self.start, self.stop,
+                                  self.reverse]
+            self.molecule_counts = [self.uniquely, self.multi]
+        else:
+            self.molecule_keys = None
+            self.molecule_counts = None
+
+    def __len__(self):
+        return len(self.barcode)
+
+    def __repr__(self):
+        return 'outrigger.BarcodeJunctionCounts ({0} barcodes, {1} ' \
+               'junction counts)'.format(len(self.codes), len(self))
+
+    @property
+    def barcodes(self):
+        """Names of the barcodes, at the position of their code"""
+        names = np.empty(len(self.codes), dtype=object)
+        names[list(self.codes.values())] = list(self.codes.keys())
+        return names
+
+    def _encode(self, barcode):
+        """Code of each barcode, or -1 if it is not in the whitelist"""
+        values, uniques = pd.factorize(barcode)
+        if self.whitelisted:
+            lookup = [self.codes.get(x, -1) for x in uniques]
+        else:
+            lookup = [self.codes.setdefault(x, len(self.codes))
+                      for x in uniques]
+        return np.array(lookup, dtype=np.int64)[values]
+
+    def add(self, chrom, start, stop, reverse, uniquely, multi, barcode,
+            umi=None):
+        """Add reads on junctions of barcodes, e.g. one for each read
+
+        Parameters
+        ----------
+        chrom, start, stop, reverse, uniquely, multi : numpy.ndarray
+            Same as for ``JunctionCounts.add``
+        barcode : numpy.ndarray
+            Barcode of each junction
+        umi : numpy.ndarray, optional
+            UMI of each junction, if the counts were made with ``umis``
+        """
+        codes = self._encode(barcode)
+        kept = codes >= 0
+        if self.molecule_keys is None:
+            self._add_reads(codes[kept], chrom[kept], start[kept],
+                            stop[kept], reverse[kept], uniquely[kept],
+                            multi[kept])
+            return
+
+        # UMIs are kept as strings, which are widened as needed
+        new = [codes, np.asarray(umi, dtype=str), chrom, start, stop, reverse]
+        keys = [np.concatenate([old, values[kept].astype(
+                    old.dtype if old.dtype.kind != 'U' else values.dtype)])
+                for old, values in zip(self.molecule_keys, new)]
+        counts = [np.concatenate([old, values[kept]]).astype(np.int64)
+                  for old, values in zip(self.molecule_counts,
+                                         (uniquely, multi))]
+        keys, (uniquely, multi) = _sum_keys(keys, counts)
+        # Each molecule is one read, uniquely mapped if any of its reads is
+        unique = uniquely > 0
+        self.molecule_keys = keys
+        self.molecule_counts = [unique.astype(np.int64),
+                                (~unique & (multi > 0)).astype(np.int64)]
+
+    def _add_reads(self, barcode, chrom, start, stop, reverse, uniquely,
+                   multi):
+        columns = [np.asarray(values).astype(getattr(self, name).dtype)
+                   for name, values in zip(
+                       self.__slots__[3:10], (barcode, chrom, start, stop,
+                                              reverse, uniquely, multi))]
+        keys, counts = _sum_keys(columns[:5], columns[5:])
+        self.partial.append(keys + counts)
+        self.n_partial += len(keys[0])
+        # Merging sorts all the counts so far, so wait until there are about
+        # as many new ones
+        if self.n_partial >= max(READS_PER_BATCH, len(self)):
+            self._merge()
+
+    def _merge(self):
+        """Add the reads of the batches so far to the counts"""
+        if not self.partial:
+            return
+        names = self.__slots__[3:10]
+        columns = [np.concatenate([getattr(self, name)]
+                                  + [batch[i] for batch in self.partial])
+                   for i, name in enumerate(names)]
+        keys, counts = _sum_keys(columns[:5], columns[5:])
+        (self.barcode, self.chrom, self.start, self.stop,
+         self.reverse), (self.uniquely, self.multi) = keys, counts
+        self.partial = []
+        self.n_partial = 0
+
+    def flush(self, position=None, chrom=None):
+        """Add the molecules which can't get any more reads to the counts
+
+        Parameters
+        ----------
+        position : int, optional
+            0-based position on the chromosome where all the reads still to
+            be added start at or after, e.g. of the last read of a
+            coordinate-sorted bam file. Their junctions start after it, so
+            the molecules of junctions starting up to here are finished. If
+            None, all molecules are finished, and all reads are merged into
+            the counts
+        chrom : int, optional
+            Code of the chromosome of ``position``. The sorted reads are
+            past all other chromosomes, so their molecules are finished too
+        """
+        if position is None:
+            self._flush_molecules(None)
+            self._merge()
+        elif self.molecule_keys is not None:
+            finished = self.molecule_keys[3] <= position
+            if chrom is not None:
+                finished |= self.molecule_keys[2] != chrom
+            self._flush_molecules(finished)
+
+    def _flush_molecules(self, finished=None):
+        """Add the reads of the finished molecules, or all of them"""
+        if self.molecule_keys is None:
+            return
+        if finished is None:
+            finished = np.ones(len(self.molecule_keys[0]), dtype=bool)
+        barcode, _, chrom, start, stop, reverse = [
+            key[finished] for key in self.molecule_keys]
+        self._add_reads(barcode, chrom, start, stop, reverse,
+                        *[count[finished] for count in self.molecule_counts])
+        self.molecule_keys = [key[~finished] for key in self.molecule_keys]
+        self.molecule_counts = [count[~finished]
+                                for count in self.molecule_counts]
+
+
+def _count_barcoded_junctions(filename, shard=None, barcode_tag=BARCODE_TAG,
+                              umi_tag=None, whitelist=None, threads=1):
+    """Count the junction reads of each cell barcode of a bam file
+
+    Parameters
+    ----------
+    filename : str
+        Name of the bam file
+    shard : tuple, optional
+        (contig, start, stop) region from ``_bam_shards`` to read only the
+        reads starting in. By default, read the whole file
+    barcode_tag, umi_tag : str, optional
+        Tags of the cell barcode and UMI of the reads. Reads without them
+        are skipped. Without ``umi_tag``, every read is counted
+    whitelist : set of str, optional
+        If given, only count the reads of these barcodes
+    threads : int, optional
+        Number of threads for decompressing the bam file
+
+    Returns
+    -------
+    counts : BarcodeJunctionCounts
+        Number of uniquely and multi-mapped reads (or molecules) on each
+        junction of each barcode
+
+    Raises
+    ------
+    ValueError
+        If ``umi_tag`` is given but the bam file isn't sorted by position,
+        as the molecules of all UMIs would have to be kept until the end
+    """
+    tags = (barcode_tag,) if umi_tag is None else (barcode_tag, umi_tag)
+    with pysam.AlignmentFile(filename, "rb", threads=threads) as samfile:
+        # Indexed bam files are sorted by position
+        if shard is None:
+            header = samfile.header.to_dict().get('HD', {})
+            is_sorted = header.get('SO') == 'coordinate'
+            reads = samfile.fetch(until_eof=True)
+        else:
+            is_sorted = True
+            reads = _fetch(samfile, shard)
+        if umi_tag is not None and not is_sorted:
+            raise ValueError(
+                "The reads of each UMI (--umi-tag) can only be counted once "
+                "in bam files sorted by position, but {} has no "
+                "'SO:coordinate' in its header. Sort it with "
+                "'samtools sort'".format(filename))
+
+        counts = BarcodeJunctionCounts(samfile.references, whitelist,
+                                       umis=umi_tag is not None)
+        while True:
+            batch = list(itertools.islice(reads, READS_PER_BATCH))
+            if not batch:
+                break
+            _count_junctions(batch, counts, tags=tags)
+            # The reads are sorted by position, so only the molecules of the
+            # last junctions can get more reads
+            if is_sorted:
+                counts.flush(batch[-1].reference_start,
+                             batch[-1].reference_id)
+        counts.flush()
+    return counts
+
+
+def _barcode_junction_reads(barcode, chrom, start, stop, reverse, uniquely,
+                            multi, chroms, ignore_multimapping=False):
+    """Combine uniquely and multi-mapped reads, for every barcode at once
+
+    The same as ``_combine_uniquely_multi`` on the reads of each barcode,
+    with the barcode and chromosome codes as one key.
+
+    Parameters
+    ----------
+    barcode, chrom : numpy.ndarray
+        Codes of the barcode and chromosome name of each junction
+    start, stop, reverse, uniquely, multi : numpy.ndarray
+        Same as for ``JunctionCounts.add``
+    chroms : numpy.ndarray
+        Chromosome names of the codes
+    ignore_multimapping : bool, optional
+        Whether to leave out the multi-mapped reads
+
+    Returns
+    -------
+    reads : pandas.DataFrame
+        Barcode code, chromosome, start, stop, strand, and uniquely
+        mapped, multi-mapped and all reads of each junction of each barcode
+    """
+    n_chroms = max(len(chroms), 1)
+    key = barcode.astype(np.int64) * n_chroms + chrom
+    columns = ['key', JUNCTION_START, JUNCTION_STOP, 'reverse']
+    tables = []
+    for reads, name in ((uniquely, UNIQUE_READS), (multi, MULTIMAP_READS)):
+        table = pd.DataFrame(dict(zip(columns + [name], _majority_strand(
+            key, start, stop, reverse, reads))), columns=columns + [name])
+        tables.append(table)
+    uniquely, multi = tables
+
+    # Barcodes without any uniquely mapped reads use the multi-mapped ones
+    reads = uniquely.merge(multi, how='left', on=columns)
+    with_uniquely = np.unique(uniquely['key'].values // n_chroms)
+    multi_only = ~np.in1d(multi['key'].values // n_chroms, with_uniquely)
+    reads = pd.concat([reads, multi.loc[multi_only]], ignore_index=True)
+    counts = [UNIQUE_READS, MULTIMAP_READS]
+    reads[counts] = reads[counts].fillna(0).astype(np.int64)
+    if ignore_multimapping:
+        reads[READS] = reads[UNIQUE_READS]
+    else:
+        reads[READS] = reads[counts].sum(axis=1)
+
+    # Remove "junctions" with same start and stop
+    reads = reads.loc[reads[JUNCTION_START] != reads[JUNCTION_STOP]]
+    key = reads['key'].values
+    return pd.DataFrame(
+        {SAMPLE_ID: key // n_chroms,
+         CHROM: np.asarray(chroms, dtype=object)[key % n_chroms],
+         JUNCTION_START: reads[JUNCTION_START].values.astype(np.int64),
+         JUNCTION_STOP: reads[JUNCTION_STOP].values.astype(np.int64),
+         STRAND: np.where(reads['reverse'].values, '-', '+'),
+         UNIQUE_READS: reads[UNIQUE_READS].values,
+         MULTIMAP_READS: reads[MULTIMAP_READS].values,
+         READS: reads[READS].values},
+        columns=[SAMPLE_ID, CHROM, JUNCTION_START, JUNCTION_STOP, STRAND,
+                 UNIQUE_READS, MULTIMAP_READS, READS])
+
+
+def read_barcoded_bams(bam_filenames, barcode_tag=BARCODE_TAG, umi_tag=None,
+                       whitelist=None, ignore_multimapping=False, n_jobs=-1,
+                       threads=1):
+    """Count the junction reads of each cell barcode of multiplexed bam files
+
+    Instead of splitting a bam file into one file per cell, the reads are
+    counted in one pass, keyed by their barcode. Indexed bam files are read
+    in parallel by chromosome, and with ``umi_tag``, the reads of the same
+    barcode, UMI and junction are counted once. As the reads must be sorted
+    by position, each molecule is only kept until no more reads can have its
+    junction, so the memory doesn't grow with the number of UMIs.
+
+    Parameters
+    ----------
+    bam_filenames : list of str
+        Names of the bam files. With several files, the barcodes are prefixed
+        by the file name, e.g. "mouse1.bam:AAACCTGAGAAGGCCT-1"
+    barcode_tag : str, optional
+        Tag of the cell barcode of the reads
+    umi_tag : str, optional
+        Tag of the UMI of the reads, e.g. "UB". If given, count molecules
+        instead of reads
+    whitelist : iterable of str, optional
+        If given, only count the reads of these barcodes
+    ignore_multimapping : bool, optional
+        Whether to leave out the multi-mapped reads
+    n_jobs : int, optional
+        Number of processes, each reading one chromosome of one bam file
+    threads : int, optional
+        Number of threads each process uses to decompress its bam file
+
+    Returns
+    -------
+    reads2d : scipy.sparse.csc_matrix
+        A (n_barcodes, n_junctions) matrix of junction reads, in the
+        smallest unsigned integer type that holds them, like
+        ``outrigger.io.core.junction_reads_to_sparse``
+    barcodes : pandas.Index
+        Sorted barcodes of the rows of ``reads2d``, as sample ids
+    junctions : pandas.Index
+        Sorted ids of the junctions with reads in any barcode
+
+    Raises
+    ------
+    ValueError
+        If ``umi_tag`` is given and a bam file without an index isn't sorted
+        by position
+    """
+    if whitelist is not None:
+        whitelist = set(whitelist)
+    tasks = [(filename, shard) for filename in bam_filenames
+             for shard in _bam_shards(filename, shard_length=None)]
+    results = joblib.Parallel(n_jobs=n_jobs)(
+        joblib.delayed(_count_barcoded_junctions)(
+            filename, shard, barcode_tag, umi_tag, whitelist, threads)
+        for filename, shard in tasks)
+
+    # Name the barcodes and chromosomes of all files and chromosomes
+    columns = [[np.zeros(0, dtype=object), np.zeros(0, dtype=object),
+                np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32),
+                np.zeros(0, dtype=bool), np.zeros(0, dtype=np.int64),
+                np.zeros(0, dtype=np.int64)]]
+    for (filename, shard), counts in zip(tasks, results):
+        barcodes = counts.barcodes
+        if len(bam_filenames) > 1:
+            barcodes = np.array(['{}:{}'.format(os.path.basename(filename),
+                                                barcode)
+                                 for barcode in barcodes], dtype=object)
+        columns.append([barcodes[counts.barcode],
+                        np.array(counts.references, dtype=object)[
+                            counts.chrom],
+                        counts.start, counts.stop, counts.reverse,
+                        counts.uniquely, counts.multi])
+    names, chrom_names, start, stop, reverse, uniquely, multi = [
+        np.concatenate(x) for x in zip(*columns)]
+    barcode, barcodes = pd.factorize(names, sort=True)
+    chrom, chroms = pd.factorize(chrom_names, sort=True)
+    keys, (uniquely, multi) = _sum_keys(
+        [barcode.astype(np.int64), chrom.astype(np.int32), start, stop,
+         reverse], [uniquely, multi])
+
+    reads = _barcode_junction_reads(*(keys + [uniquely, multi]),
+                                    chroms=np.asarray(chroms, dtype=object),
+                                    ignore_multimapping=ignore_multimapping)
+    reads = add_exons_and_junction_ids(reads)
+    reads[SAMPLE_ID] = np.asarray(barcodes, dtype=object)[reads[SAMPLE_ID]]
+    return junction_reads_to_sparse(reads)
@@ -1,5 +1,76 @@
+import csv
+import os
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
 from ..common import EXON_START, EXON_STOP, JUNCTION_START, JUNCTION_STOP, \
-    JUNCTION_ID, CHROM, STRAND
+    JUNCTION_ID, CHROM, STRAND, SAMPLE_ID, READS
+from . import tables
+
+# Number of rows of a junction reads csv to read at once
+CHUNKSIZE = 1000000
+
+# Unsigned integer types to store numbers of junction reads in, smallest first
+COUNT_DTYPES = (np.uint16, np.uint32, np.uint64)
+
+
+def count_dtype(max_count):
+    """Get the smallest unsigned integer type that holds a number of reads
+
+    Parameters
+    ----------
+    max_count : int
+        Largest number of reads to store
+
+    Returns
+    -------
+    dtype : numpy.dtype
+        One of ``COUNT_DTYPES``
+
+    Raises
+    ------
+    OverflowError
+        If ``max_count`` is too big for any of ``COUNT_DTYPES``
+    """
+    for dtype in COUNT_DTYPES:
+        if max_count <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    raise OverflowError('{} reads is too many to store as an unsigned '
+                        'integer'.format(max_count))
+
+
+def compact_counts(counts):
+    """Store numbers of reads in the smallest unsigned integer type
+
+    Junction reads almost always fit in 16 or 32 bits, which takes a quarter
+    or half the memory of 64-bit integers. The type is chosen from the
+    largest count, so no count can overflow.
+
+    Parameters
+    ----------
+    counts : numpy.ndarray, pandas.Series or scipy.sparse matrix
+        Whole numbers of reads, of any integer type
+
+    Returns
+    -------
+    compact : numpy.ndarray, pandas.Series or scipy.sparse matrix
+        The same counts, as the smallest of ``COUNT_DTYPES`` that holds them
+
+    Raises
+    ------
+    ValueError
+        If any of the counts are negative, e.g. because they overflowed a
+        signed integer type before
+    """
+    values = counts.data if sparse.issparse(counts) else np.asarray(counts)
+    if values.size == 0:
+        return counts.astype(COUNT_DTYPES[0])
+    if values.min() < 0:
+        raise ValueError('Numbers of junction reads can\'t be negative, but '
+                         'the smallest is {}'.format(values.min()))
+    return counts.astype(count_dtype(values.max()))
 
 
 def add_exons_and_junction_ids(junction_reads):
@@ -38,3 +109,503 @@ def add_exons_and_junction_ids(junction_reads):
                                   + ':' \
                                   + junction_reads[STRAND].astype(str)
     return junction_reads
+
+
+def junction_reads_to_sparse(junction_reads, sample_id_col=SAMPLE_ID,
+                             junction_id_col=JUNCTION_ID, reads_col=READS,
+                             junctions=None):
+    """Make a sparse samples x junctions matrix from a tidy table of reads
+
+    This is the same as pivoting the table and filling the missing values
+    with zeros, but only the nonzero reads are stored.
+
+    Parameters
+    ----------
+    junction_reads : pandas.DataFrame
+        A tidy table of junction reads, with one row per junction per sample
+    sample_id_col, junction_id_col, reads_col : str, optional
+        Columns of ``junction_reads`` with the sample ids, junction ids, and
+        number of reads
+    junctions : pandas.Index, optional
+        If given, use exactly these junctions as the columns, e.g. all the
+        junctions of an index, and leave out the reads of any other junctions.
+        This way, matrices of different samples have the same columns
+
+    Returns
+    -------
+    reads2d : scipy.sparse.csc_matrix
+        A (n_samples, n_junctions) matrix of junction reads, with the
+        smallest unsigned integer type that holds them (see
+        ``compact_counts``). Reads of the same junction in the same sample
+        are added together
+    samples : pandas.Index
+        Sorted sample ids of the rows of ``reads2d``, named ``sample_id_col``
+    junctions : pandas.Index
+        Sorted junction ids of the columns of ``reads2d``, named
+        ``junction_id_col``, or the given ``junctions``
+    """
+    rows, samples = pd.factorize(junction_reads[sample_id_col], sort=True)
+    reads = np.nan_to_num(junction_reads[reads_col].values).astype(np.int64)
+    if junctions is None:
+        columns, junctions = pd.factorize(junction_reads[junction_id_col],
+                                          sort=True)
+    else:
+        columns = junctions.get_indexer(junction_reads[junction_id_col])
+        in_junctions = columns >= 0
+        rows, columns = rows[in_junctions], columns[in_junctions]
+        reads = reads[in_junctions]
+
+    # Duplicates are added up as 64-bit integers before making them compact,
+    # so their sum can't overflow
+    reads2d = sparse.coo_matrix((reads, (rows, columns)),
+                                shape=(len(samples), len(junctions))).tocsc()
+    reads2d.eliminate_zeros()
+    return compact_counts(reads2d), pd.Index(samples, name=sample_id_col), \
+        pd.Index(junctions, name=junction_id_col)
+
+
+def _intern(values, ids):
+    """Get integer codes of ids, giving new ids the next unused code
+
+    Parameters
+    ----------
+    values : pandas.Series
+        Ids to get the codes of
+    ids : dict
+        Mapping of every id seen so far to its code. New ids are added to it
+
+    Returns
+    -------
+    codes : numpy.ndarray
+        Integer code of each of ``values``
+    """
+    codes, uniques = pd.factorize(values)
+    lookup = np.array([ids.setdefault(x, len(ids)) for x in uniques],
+                      dtype=np.int64)
+    return lookup[codes]
+
+
+def _sorted_ids(ids):
+    """Sort interned ids, and get the new code of each old code
+
+    Parameters
+    ----------
+    ids : dict
+        Mapping of ids to their integer codes, as made by ``_intern``
+
+    Returns
+    -------
+    sorted_ids : numpy.ndarray
+        All ids in sorted order
+    recode : numpy.ndarray
+        Position of each old code's id in ``sorted_ids``
+    """
+    unsorted = np.empty(len(ids), dtype=object)
+    for x, code in ids.items():
+        unsorted[code] = x
+    order = np.argsort(unsorted, kind='mergesort')
+    recode = np.empty(len(ids), dtype=np.int64)
+    recode[order] = np.arange(len(ids))
+    return unsorted[order], recode
+
+
+def read_junction_reads_sparse(filename, sample_id_col=SAMPLE_ID,
+                               junction_id_col=JUNCTION_ID, reads_col=READS,
+                               chunksize=CHUNKSIZE, samples=None):
+    """Stream a tidy csv of junction reads into a sparse matrix
+
+    Gives the same matrix as reading the whole csv and using
+    ``junction_reads_to_sparse``, but only ``chunksize`` rows and the nonzero
+    reads seen so far are kept in memory at once. Tables in the binary
+    formats of ``tables.FORMATS`` are typed already, so only their three
+    columns are read, all at once.
+
+    Parameters
+    ----------
+    filename : str
+        Tidy csv of junction reads, with one row per junction per sample,
+        e.g. "junctions/reads.csv" made by ``outrigger index``, or the same
+        table in another format of ``tables.FORMATS``
+    sample_id_col, junction_id_col, reads_col : str, optional
+        Columns of the csv with the sample ids, junction ids, and number of
+        reads. The other columns are not read
+    chunksize : int, optional
+        Number of rows to read at once (default=1000000)
+    samples : pandas.Index, optional
+        If given, use exactly these samples as the rows, e.g. all samples of
+        a dataset when the csv only has some of them
+
+    Returns
+    -------
+    reads2d : scipy.sparse.csc_matrix
+        A (n_samples, n_junctions) matrix of junction reads, with the
+        smallest unsigned integer type that holds them (see
+        ``compact_counts``). Reads of the same junction in the same sample
+        are added together
+    samples : pandas.Index
+        Sorted sample ids of the rows of ``reads2d``, named ``sample_id_col``,
+        or the given ``samples``
+    junctions : pandas.Index
+        Sorted junction ids of the columns of ``reads2d``, named
+        ``junction_id_col``
+
+    Raises
+    ------
+    ValueError
+        If any of the columns are not in the csv, or if the csv has samples
+        which are not in ``samples``
+    """
+    if tables.table_format(filename) != 'csv':
+        return _read_junction_reads_table(filename, sample_id_col,
+                                          junction_id_col, reads_col,
+                                          samples)
+
+    header = pd.read_csv(filename, nrows=0).columns
+    for col in (sample_id_col, junction_id_col, reads_col):
+        if col not in header:
+            raise ValueError('The required column name {col} does not exist '
+                             'in {csv}'.format(col=col, csv=filename))
+
+    sample_ids, junction_ids = {}, {}
+    rows, columns, data = [], [], []
+
+    chunks = pd.read_csv(filename,
+                         usecols=[sample_id_col, junction_id_col, reads_col],
+                         dtype={sample_id_col: str, junction_id_col: str,
+                                reads_col: np.float64},
+                         chunksize=chunksize)
+    for chunk in chunks:
+        reads = np.nan_to_num(chunk[reads_col].values).astype(np.int64)
+        nonzero = reads != 0
+        # Intern the ids of every row, so that samples and junctions with no
+        # reads at all still get a row or column of zeros
+        row = _intern(chunk[sample_id_col], sample_ids)
+        column = _intern(chunk[junction_id_col], junction_ids)
+        rows.append(row[nonzero])
+        columns.append(column[nonzero])
+        # Only the compact reads are kept until the end
+        data.append(compact_counts(reads[nonzero]))
+
+    if samples is None:
+        samples, recode_rows = _sorted_ids(sample_ids)
+        samples = pd.Index(samples, name=sample_id_col)
+    else:
+        ids, recode = _sorted_ids(sample_ids)
+        recode_rows = samples.get_indexer(ids)[recode]
+        if (recode_rows < 0).any():
+            raise ValueError('{csv} has samples which are not in the given '
+                             'samples'.format(csv=filename))
+    junctions, recode_columns = _sorted_ids(junction_ids)
+    rows = recode_rows[np.concatenate(rows)] if rows else []
+    columns = recode_columns[np.concatenate(columns)] if columns else []
+    data = np.concatenate(data) if data else []
+
+    # Duplicates are added up as 64-bit integers, so their sum can't overflow
+    reads2d = sparse.coo_matrix((data, (rows, columns)),
+                                shape=(len(samples), len(junctions)),
+                                dtype=np.int64).tocsc()
+    reads2d.eliminate_zeros()
+    return compact_counts(reads2d), samples, \
+        pd.Index(junctions, name=junction_id_col)
+
+
+def _read_junction_reads_table(filename, sample_id_col=SAMPLE_ID,
+                               junction_id_col=JUNCTION_ID, reads_col=READS,
+                               samples=None):
+    """Read a binary table of junction reads into a sparse matrix
+
+    Parameters and outputs are the same as ``read_junction_reads_sparse``
+    """
+    junction_reads = tables.read_table(filename)
+    for col in (sample_id_col, junction_id_col, reads_col):
+        if col not in junction_reads:
+            raise ValueError('The required column name {col} does not exist '
+                             'in {csv}'.format(col=col, csv=filename))
+    reads2d, found, junctions = junction_reads_to_sparse(
+        junction_reads[[sample_id_col, junction_id_col, reads_col]],
+        sample_id_col=sample_id_col, junction_id_col=junction_id_col,
+        reads_col=reads_col)
+    if samples is None:
+        return reads2d, found, junctions
+
+    rows = samples.get_indexer(found)
+    if (rows < 0).any():
+        raise ValueError('{csv} has samples which are not in the given '
+                         'samples'.format(csv=filename))
+    reads2d = reads2d.tocoo()
+    reads2d = sparse.coo_matrix(
+        (reads2d.data, (rows[reads2d.row], reads2d.col)),
+        shape=(len(samples), len(junctions))).tocsc()
+    return reads2d, samples, junctions
+
+
+def read_junction_ids(filename, junction_id_col=JUNCTION_ID,
+                      chunksize=CHUNKSIZE):
+    """Get all junction ids of a tidy csv of junction reads
+
+    Only the junction id column is read, ``chunksize`` rows at a time.
+
+    Parameters
+    ----------
+    filename : str
+        Tidy csv of junction reads, with one row per junction per sample, or
+        the same table in another format of ``tables.FORMATS``
+    junction_id_col : str, optional
+        Column of the csv with the junction ids
+    chunksize : int, optional
+        Number of rows to read at once (default=1000000)
+
+    Returns
+    -------
+    junctions : set
+        Every junction id in the csv
+    """
+    if tables.table_format(filename) != 'csv':
+        return set(tables.read_table(
+            filename, columns=[junction_id_col])[junction_id_col].unique())
+
+    junctions = set()
+    chunks = pd.read_csv(filename, usecols=[junction_id_col],
+                         dtype={junction_id_col: str}, chunksize=chunksize)
+    for chunk in chunks:
+        junctions.update(chunk[junction_id_col].unique())
+    return junctions
+
+
+def iter_junction_reads_samples(filename, sample_id_col=SAMPLE_ID,
+                                junction_id_col=JUNCTION_ID, reads_col=READS,
+                                n_samples=100, chunksize=CHUNKSIZE):
+    """Stream a tidy csv of junction reads a few samples at a time
+
+    The csv is read ``chunksize`` rows at a time, and the reads of a sample
+    are given once all of its rows have been read, so only a few samples'
+    reads are in memory at once. The rows of each sample must be next to
+    each other, as in the "junctions/reads.csv" made by ``outrigger index``.
+
+    Parameters
+    ----------
+    filename : str
+        Tidy csv of junction reads, with one row per junction per sample
+    sample_id_col, junction_id_col, reads_col : str, optional
+        Columns of the csv with the sample ids, junction ids, and number of
+        reads. The other columns are not read
+    n_samples : int, optional
+        Maximum number of samples to give at once (default=100)
+    chunksize : int, optional
+        Number of rows to read at once (default=1000000)
+
+    Yields
+    ------
+    junction_reads : pandas.DataFrame
+        All rows of the next ``n_samples`` samples, in the order of the csv
+
+    Raises
+    ------
+    ValueError
+        If any of the columns are not in the csv, or if the rows of a sample
+        are not all next to each other
+    """
+    header = pd.read_csv(filename, nrows=0).columns
+    for col in (sample_id_col, junction_id_col, reads_col):
+        if col not in header:
+            raise ValueError('The required column name {col} does not exist '
+                             'in {csv}'.format(col=col, csv=filename))
+
+    finished = set()
+    # Rows and ordered ids of the samples which haven't been given yet
+    pending, pending_samples = [], {}
+    chunks = pd.read_csv(filename,
+                         usecols=[sample_id_col, junction_id_col, reads_col],
+                         dtype={sample_id_col: str, junction_id_col: str,
+                                reads_col: np.float64},
+                         chunksize=chunksize)
+    for chunk in chunks:
+        samples = pd.unique(chunk[sample_id_col])
+        if finished.intersection(samples):
+            raise ValueError(
+                'The rows of sample(s) {samples} in {csv} are not all next to '
+                'each other, so they can\'t be read one sample at a '
+                'time'.format(samples=sorted(finished.intersection(samples)),
+                              csv=filename))
+        pending.append(chunk)
+        pending_samples.update((x, None) for x in samples)
+
+        # The last sample may continue in the next chunk
+        complete = list(pending_samples)[:-1]
+        if len(complete) < n_samples:
+            continue
+        rows = pd.concat(pending, ignore_index=True)
+        while len(complete) >= n_samples:
+            batch = complete[:n_samples]
+            in_batch = rows[sample_id_col].isin(batch)
+            yield rows.loc[in_batch].reset_index(drop=True)
+            finished.update(batch)
+            for x in batch:
+                del pending_samples[x]
+            rows = rows.loc[~in_batch]
+            complete = complete[n_samples:]
+        pending = [rows]
+
+    if not pending:
+        return
+    rows = pd.concat(pending, ignore_index=True)
+    samples = list(pending_samples)
+    for start in range(0, len(samples), n_samples):
+        in_batch = rows[sample_id_col].isin(samples[start:start + n_samples])
+        yield rows.loc[in_batch].reset_index(drop=True)
+
+
+def paste_csv_columns(filenames, output):
+    """Put the columns of csv files with the same rows side by side
+
+    Only one row of each file is in memory at once. The first column of
+    every file is the row names, which are written only once.
+
+    Parameters
+    ----------
+    filenames : list of str
+        Csv files with the same row names in the same order
+    output : str
+        Csv file to write
+
+    Raises
+    ------
+    ValueError
+        If the files don't all have the same row names
+    """
+    handles = [open(filename) for filename in filenames]
+    try:
+        readers = [csv.reader(handle) for handle in handles]
+        with open(output, 'w') as f:
+            writer = csv.writer(f, lineterminator='\n')
+            for rows in zip(*readers):
+                if any(row[0] != rows[0][0] for row in rows):
+                    raise ValueError('The rows of {} are not all in the same '
+                                     'order'.format(', '.join(filenames)))
+                writer.writerow(rows[0] + [x for row in rows[1:]
+                                           for x in row[1:]])
+    finally:
+        for handle in handles:
+            handle.close()
+
+
+def junction_chromosome(junction_ids):
+    """Get the chromosome of junction ids like "junction:chr1:100-400:+"
+
+    Parameters
+    ----------
+    junction_ids : pandas.Series
+        Junction ids, as made by ``add_exons_and_junction_ids``
+
+    Returns
+    -------
+    chroms : pandas.Series
+        Chromosome of each junction
+    """
+    return junction_ids.str.split(':').str[1]
+
+
+def split_junction_reads_by_chromosome(filename, folder,
+                                       sample_id_col=SAMPLE_ID,
+                                       junction_id_col=JUNCTION_ID,
+                                       reads_col=READS, chunksize=CHUNKSIZE):
+    """Split a tidy csv of junction reads into one csv per chromosome
+
+    The csv is read ``chunksize`` rows at a time, and only the sample ids,
+    junction ids and reads are written to the new files.
+
+    Parameters
+    ----------
+    filename : str
+        Tidy csv of junction reads, with one row per junction per sample
+    folder : str
+        Existing folder to write a "<chrom>.csv" file of each chromosome to
+    sample_id_col, junction_id_col, reads_col : str, optional
+        Columns of the csv with the sample ids, junction ids, and number of
+        reads. The junction ids must look like "junction:chr1:100-400:+"
+    chunksize : int, optional
+        Number of rows to read at once (default=1000000)
+
+    Returns
+    -------
+    filenames : dict
+        Mapping of each chromosome to its csv of junction reads
+    samples : pandas.Index
+        Sorted ids of all samples in the csv, named ``sample_id_col``
+    nonzero : dict
+        Mapping of each chromosome to its number of rows with nonzero reads
+
+    Raises
+    ------
+    ValueError
+        If any of the columns are not in the csv
+    """
+    header = pd.read_csv(filename, nrows=0).columns
+    for col in (sample_id_col, junction_id_col, reads_col):
+        if col not in header:
+            raise ValueError('The required column name {col} does not exist '
+                             'in {csv}'.format(col=col, csv=filename))
+
+    filenames, nonzero = {}, {}
+    samples = set()
+    columns = [sample_id_col, junction_id_col, reads_col]
+    chunks = pd.read_csv(filename, usecols=columns,
+                         dtype={sample_id_col: str, junction_id_col: str,
+                                reads_col: np.float64},
+                         chunksize=chunksize)
+    for chunk in chunks:
+        samples.update(chunk[sample_id_col].unique())
+        chroms = junction_chromosome(chunk[junction_id_col])
+        for chrom, rows in chunk.groupby(chroms, sort=False):
+            exists = chrom in filenames
+            if not exists:
+                filenames[chrom] = os.path.join(folder,
+                                                '{}.csv'.format(chrom))
+            rows[columns].to_csv(filenames[chrom], index=False,
+                                 mode='a' if exists else 'w',
+                                 header=not exists)
+            nonzero[chrom] = nonzero.get(chrom, 0) \
+                + int((rows[reads_col].fillna(0) != 0).sum())
+    return filenames, pd.Index(sorted(samples), name=sample_id_col), nonzero
+
+
+def append_csv_rows(filenames, output, values=None, index=False,
+                    chunksize=CHUNKSIZE):
+    """Put the rows of csv files one after the other, a chunk at a time
+
+    The files can have different columns, and the output has all of them,
+    in the same order as concatenating the tables with pandas. Missing
+    values are written as "NA".
+
+    Parameters
+    ----------
+    filenames : list of str
+        Csv files to concatenate
+    output : str
+        Csv file to write
+    values : list of dict, optional
+        For each file, columns with a single value to add to its rows, e.g.
+        [{'splice_type': 'se'}, {'splice_type': 'mxe'}]
+    index : bool, optional
+        If True, write the row numbers of the concatenated table as the first
+        column, like ``pandas.concat(..., ignore_index=True).to_csv()``
+    chunksize : int, optional
+        Number of rows to read at once (default=1000000)
+    """
+    if values is None:
+        values = [{} for filename in filenames]
+    columns = []
+    for filename, file_values in zip(filenames, values):
+        header = list(pd.read_csv(filename, nrows=0).columns)
+        columns.extend(x for x in header + list(file_values)
+                       if x not in columns)
+
+    n_rows = 0
+    pd.DataFrame(columns=columns).to_csv(output, index=index)
+    for filename, file_values in zip(filenames, values):
+        for chunk in pd.read_csv(filename, chunksize=chunksize):
+            chunk = chunk.assign(**file_values).reindex(columns=columns)
+            chunk.index = np.arange(n_rows, n_rows + len(chunk))
+            chunk.to_csv(output, na_rep='NA', index=index, mode='a',
+                         header=False)
+            n_rows += len(chunk)
@@ -0,0 +1,229 @@
+"""Store Psi in chunks sorted by genomic position, to read only the events of
+one gene or region instead of the whole Psi table"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from ..region import Region
+
+# Number of events in each chunk of Psi
+CHUNK_SIZE = 10000
+
+# Columns of the events table which are indexed, so their events can be read
+# by name
+GENE_COLUMNS = ('isoform1_gene_name', 'isoform2_gene_name',
+                'isoform1_gene_id', 'isoform2_gene_id')
+
+# Column of the events table with the coordinates of the whole event, e.g.
+# "event:chr2:136770057-136777480:+"
+EVENT_LOCATION = 'event_location'
+
+EVENTS_NPZ = 'events.npz'
+CHUNK_NPY = 'psi_{:05d}.npy'
+
+
+def write_psi_store(psi, events, folder, chunk_size=CHUNK_SIZE,
+                    gene_columns=GENE_COLUMNS):
+    """Write Psi in chunks of events sorted by genomic position
+
+    Each chunk is a plain numpy array, so it can be memory-mapped and only
+    the rows of the wanted events are read. The event coordinates and genes
+    are kept in "events.npz", to find which events (and thus which chunks)
+    overlap a region or belong to a gene.
+
+    Parameters
+    ----------
+    psi : pandas.DataFrame
+        Percent spliced-in of events x samples
+    events : pandas.DataFrame
+        Annotation of the events in ``psi``, indexed by event id, with
+        the ``EVENT_LOCATION`` column and the ``gene_columns`` it has
+    folder : str
+        Where to write the store
+    chunk_size : int, optional
+        Number of events in each chunk
+    gene_columns : tuple of str, optional
+        Columns of ``events`` to index. Values with several comma-separated
+        names are indexed under each name
+
+    Returns
+    -------
+    folder : str
+        Where the store was written
+    """
+    # An event can be on several rows of the events table, e.g. once for
+    # each pair of isoforms, but it has one row of Psi
+    events = events[~events.index.duplicated()].reindex(psi.index)
+    regions = [Region(location) for location in events[EVENT_LOCATION]]
+    chroms = pd.Categorical([region.chrom for region in regions])
+    starts = np.array([region.start for region in regions], dtype=np.int64)
+    stops = np.array([region.stop for region in regions], dtype=np.int64)
+    strands = np.array([region.strand for region in regions], dtype=str)
+
+    # Sort by chromosome, then start and stop
+    order = np.lexsort((stops, starts, chroms.codes))
+    codes = chroms.codes[order]
+    starts = starts[order]
+    stops = stops[order]
+    chrom_offsets = np.searchsorted(codes, np.arange(len(chroms.categories)
+                                                     + 1))
+
+    # Largest stop of all events up to each one on its chromosome. It never
+    # decreases, so the first event which could overlap a region is found by
+    # binary search
+    max_stops = stops.copy()
+    for lo, hi in zip(chrom_offsets[:-1], chrom_offsets[1:]):
+        max_stops[lo:hi] = np.maximum.accumulate(stops[lo:hi])
+
+    # Pairs of every gene name and the position of its events, sorted by
+    # name
+    genes = []
+    gene_events = []
+    for column in gene_columns:
+        if column not in events:
+            continue
+        values = events[column].values[order]
+        for position, value in enumerate(values):
+            if not isinstance(value, str):
+                continue
+            for gene in set(value.split(',')):
+                genes.append(gene)
+                gene_events.append(position)
+    genes = np.array(genes, dtype=str)
+    gene_events = np.array(gene_events, dtype=np.int64)
+    gene_order = np.lexsort((gene_events, genes))
+
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    values = np.asarray(psi.values, dtype=np.float32)[order]
+    for i, lo in enumerate(range(0, len(values), chunk_size)):
+        np.save(os.path.join(folder, CHUNK_NPY.format(i)),
+                values[lo:lo + chunk_size])
+
+    np.savez(os.path.join(folder, EVENTS_NPZ),
+             event_id=np.array([str(x) for x in psi.index[order]], dtype=str),
+             chrom_names=np.array(chroms.categories, dtype=str),
+             chrom_offsets=chrom_offsets, start=starts, stop=stops,
+             max_stop=max_stops, strand=strands[order],
+             genes=genes[gene_order], gene_events=gene_events[gene_order],
+             samples=np.array([str(x) for x in psi.columns], dtype=str),
+             names=np.array([psi.index.name or '', psi.columns.name or ''],
+                            dtype=str),
+             chunk_size=np.array(chunk_size))
+    return folder
+
+
+class PsiStore(object):
+
+    def __init__(self, folder, mmap=True):
+        """Read Psi of only some events from a store
+
+        Parameters
+        ----------
+        folder : str
+            Folder written by ``write_psi_store``
+        mmap : bool, optional
+            If True, memory-map the chunks so only the rows of the wanted
+            events are read from disk
+        """
+        self.folder = folder
+        self.mmap_mode = 'r' if mmap else None
+
+        with np.load(os.path.join(folder, EVENTS_NPZ)) as arrays:
+            self.event_ids = arrays['event_id']
+            self.chrom_names = arrays['chrom_names']
+            self.chrom_offsets = arrays['chrom_offsets']
+            self.start = arrays['start']
+            self.stop = arrays['stop']
+            self.max_stop = arrays['max_stop']
+            self.strand = arrays['strand']
+            self.genes = arrays['genes']
+            self.gene_events = arrays['gene_events']
+            self.chunk_size = int(arrays['chunk_size'])
+            names = [str(x) or None for x in arrays['names']]
+            self.samples = pd.Index(arrays['samples'].astype(object),
+                                    name=names[1])
+        self.event_id_name = names[0]
+
+    def __len__(self):
+        return len(self.event_ids)
+
+    def __repr__(self):
+        return 'outrigger.PsiStore ({0}: {1} events x {2} samples)'.format(
+            self.folder, len(self), len(self.samples))
+
+    @property
+    def events(self):
+        """Coordinates of all events, sorted by genomic position"""
+        chroms = np.repeat(self.chrom_names, np.diff(self.chrom_offsets))
+        return pd.DataFrame(
+            {'chrom': chroms, 'start': self.start, 'stop': self.stop,
+             'strand': self.strand},
+            index=pd.Index(self.event_ids.astype(object),
+                           name=self.event_id_name),
+            columns=['chrom', 'start', 'stop', 'strand'])
+
+    def _read(self, positions):
+        """Psi of the events at sorted positions, reading only their chunks"""
+        chunks = positions // self.chunk_size
+        values = [np.empty((0, len(self.samples)), dtype=np.float32)]
+        for chunk in np.unique(chunks):
+            filename = os.path.join(self.folder, CHUNK_NPY.format(chunk))
+            psi = np.load(filename, mmap_mode=self.mmap_mode)
+            rows = positions[chunks == chunk] - chunk * self.chunk_size
+            values.append(np.array(psi[rows]))
+        index = pd.Index(self.event_ids[positions].astype(object),
+                         name=self.event_id_name)
+        return pd.DataFrame(np.concatenate(values), index=index,
+                            columns=self.samples)
+
+    def region(self, chrom, start, stop, strand=None):
+        """Psi of all events overlapping a region
+
+        Parameters
+        ----------
+        chrom : str
+            Chromosome, e.g. "chr7"
+        start, stop : int
+            Coordinates of the region, including both ends
+        strand : str, optional
+            If given, only events on this strand
+
+        Returns
+        -------
+        psi : pandas.DataFrame
+            Psi of the overlapping events x samples, sorted by position
+        """
+        i = np.searchsorted(self.chrom_names, chrom)
+        if i == len(self.chrom_names) or self.chrom_names[i] != chrom:
+            return self._read(np.array([], dtype=np.int64))
+        lo, hi = self.chrom_offsets[i], self.chrom_offsets[i + 1]
+
+        # Events starting at or before the end of the region, of which only
+        # those stopping at or after its start overlap
+        hi = lo + np.searchsorted(self.start[lo:hi], stop, side='right')
+        lo = lo + np.searchsorted(self.max_stop[lo:hi], start, side='left')
+        positions = np.arange(lo, hi)
+        keep = self.stop[positions] >= start
+        if strand is not None:
+            keep &= self.strand[positions] == strand
+        return self._read(positions[keep])
+
+    def gene(self, name):
+        """Psi of all events of a gene
+
+        Parameters
+        ----------
+        name : str
+            Gene name or id, as in the indexed columns of the events, e.g.
+            "Snap25" or "ENSMUSG00000027273.13"
+
+        Returns
+        -------
+        psi : pandas.DataFrame
+            Psi of the gene's events x samples, sorted by position
+        """
+        lo = np.searchsorted(self.genes, name, side='left')
+        hi = np.searchsorted(self.genes, name, side='right')
+        return self._read(np.unique(self.gene_events[lo:hi]))
@@ -0,0 +1,398 @@
+"""Read and write tables as csv, or as typed and compressed binary files"""
+import os
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+from ..util import progress
+
+# Formats of tables, by file extension. Parquet and feather need pyarrow, and
+# npz only needs numpy
+FORMATS = ('csv', 'parquet', 'feather', 'npz')
+ARROW_FORMATS = ('parquet', 'feather')
+
+# Column name of an unnamed index in binary tables, which need every column
+# to have a name
+UNNAMED_INDEX = '__index__'
+
+# Number of rows in each row group of parquet files and each chunk of feather
+# files, so they can be read a piece at a time
+ROW_GROUP_SIZE = 1000000
+
+# Quantized Psi is stored as 8-bit codes from 0 (Psi=0) to 250 (Psi=1), in
+# steps of 0.004. Codes 251-255 are reserved
+QUANTIZED_PSI_MAX = 250
+
+# Ending of the filenames of sparse Psi matrices, instead of ".csv"
+SPARSE_PSI_SUFFIX = '_sparse.npz'
+
+
+def table_format(filename):
+    """Get the format of a table from its file extension
+
+    Parameters
+    ----------
+    filename : str
+        Name of a table, e.g. "junctions/reads.parquet"
+
+    Returns
+    -------
+    output_format : str
+        One of ``FORMATS``, or "csv" for any other extension
+    """
+    extension = os.path.splitext(filename)[1].lstrip('.')
+    return extension if extension in FORMATS else 'csv'
+
+
+def table_filename(filename, output_format='csv'):
+    """Change the extension of a table's filename to that of a format
+
+    Parameters
+    ----------
+    filename : str
+        Name of a table in any format, e.g. "junctions/reads.csv"
+    output_format : str, optional
+        One of ``FORMATS``
+
+    Returns
+    -------
+    filename : str
+        The same name with the extension of ``output_format``, e.g.
+        "junctions/reads.parquet"
+    """
+    if table_format(filename) == output_format:
+        return filename
+    root, extension = os.path.splitext(filename)
+    if extension.lstrip('.') not in FORMATS:
+        root = filename
+    return '{}.{}'.format(root, output_format)
+
+
+def find_table(filename, output_format='csv'):
+    """Find a table which may have been written in any format
+
+    Parameters
+    ----------
+    filename : str
+        Name of a table in any format, e.g. "index/se/events.csv"
+    output_format : str, optional
+        Format to look for first, and to name the table with if it doesn't
+        exist in any format
+
+    Returns
+    -------
+    filename : str
+        Name of the existing table, or of the table in ``output_format`` if
+        there is none
+    """
+    for x in (output_format,) + FORMATS:
+        candidate = table_filename(filename, x)
+        if os.path.exists(candidate):
+            return candidate
+    return table_filename(filename, output_format)
+
+
+def resolve_format(output_format):
+    """Fall back to npz if a format needs pyarrow and it isn't installed
+
+    Parameters
+    ----------
+    output_format : str
+        One of ``FORMATS``
+
+    Returns
+    -------
+    output_format : str
+        ``output_format``, or "npz" if it can't be written here
+
+    Raises
+    ------
+    ValueError
+        If ``output_format`` is not one of ``FORMATS``
+    """
+    if output_format not in FORMATS:
+        raise ValueError('"{}" is not a table format, it must be one of '
+                         '{}'.format(output_format, ', '.join(FORMATS)))
+    if output_format in ARROW_FORMATS and not HAS_PYARROW:
+        progress('Writing {} files needs pyarrow, which is not installed, '
+                 'so writing npz files instead'.format(output_format))
+        return 'npz'
+    return output_format
+
+
+def _dictionary_encoded(table):
+    """Store the columns of strings as categoricals, i.e. dictionaries
+
+    Parameters
+    ----------
+    table : pandas.DataFrame
+        Any table
+
+    Returns
+    -------
+    encoded : pandas.DataFrame
+        The same table, with the object columns as categoricals
+    """
+    objects = [column for column, dtype in table.dtypes.items()
+               if dtype == object]
+    if not objects:
+        return table
+    return table.astype(dict((column, 'category') for column in objects))
+
+
+def _write_npz(table, filename):
+    """Write a table as compressed numpy arrays, one for each column
+
+    Columns of numbers are written as they are, and every other column is
+    written as integer codes of its unique values, so that no python objects
+    have to be pickled.
+    """
+    arrays = {'columns': np.array([str(x) for x in table.columns], dtype=str)}
+    for i, (name, column) in enumerate(table.items()):
+        if column.dtype.kind in 'biuf':
+            arrays['values{}'.format(i)] = column.values
+            continue
+        codes, uniques = pd.factorize(column)
+        arrays['codes{}'.format(i)] = codes.astype(np.int32)
+        arrays['categories{}'.format(i)] = np.array(
+            [str(x) for x in uniques], dtype=str)
+    np.savez_compressed(filename, **arrays)
+
+
+def _read_npz(filename, columns=None):
+    """Read a table written by ``_write_npz``"""
+    with np.load(filename) as arrays:
+        names = [str(x) for x in arrays['columns']]
+        data = {}
+        for i, name in enumerate(names):
+            if columns is not None and name not in columns:
+                continue
+            if 'values{}'.format(i) in arrays.files:
+                data[name] = arrays['values{}'.format(i)]
+                continue
+            codes = arrays['codes{}'.format(i)]
+            values = arrays['categories{}'.format(i)].astype(object)
+            values = values[codes] if len(values) > 0 \
+                else np.empty(len(codes), dtype=object)
+            values[codes < 0] = np.nan
+            data[name] = values
+    names = [x for x in names if x in data]
+    return pd.DataFrame(data, columns=names)
+
+
+def write_table(table, filename, output_format='csv', index=True,
+                **csv_kwargs):
+    """Write a table in one of the formats
+
+    Parquet and feather files are compressed and typed, with the strings
+    stored as dictionaries of their unique values and the rows in groups of
+    ``ROW_GROUP_SIZE``, so they are much smaller and faster to read than a
+    csv. The npz format is a compressed array of each column, for when
+    pyarrow isn't installed.
+
+    Parameters
+    ----------
+    table : pandas.DataFrame
+        Table to write
+    filename : str
+        Name of the table. Its extension is changed to that of
+        ``output_format``
+    output_format : str, optional
+        One of ``FORMATS`` (default="csv")
+    index : bool, optional
+        Whether to write the index as the first column(s), like
+        ``pandas.DataFrame.to_csv``
+    csv_kwargs
+        Other keyword arguments to ``pandas.DataFrame.to_csv``, which are
+        only used for csv
+
+    Returns
+    -------
+    filename : str
+        Name of the written table
+    """
+    filename = table_filename(filename, output_format)
+    if output_format == 'csv':
+        table.to_csv(filename, index=index, **csv_kwargs)
+        return filename
+
+    if index and table.index.nlevels == 1 and table.index.name is None:
+        table = table.rename_axis(UNNAMED_INDEX)
+    table = table.reset_index() if index \
+        else table.reset_index(drop=True)
+    table.columns = [str(x) for x in table.columns]
+    if output_format == 'parquet':
+        table.to_parquet(filename, engine='pyarrow', index=False,
+                         row_group_size=ROW_GROUP_SIZE)
+    elif output_format == 'feather':
+        _dictionary_encoded(table).to_feather(filename,
+                                              chunksize=ROW_GROUP_SIZE)
+    else:
+        _write_npz(table, filename)
+    return filename
+
+
+def read_table(filename, index_col=None, columns=None, **csv_kwargs):
+    """Read a table in any of the formats, by its file extension
+
+    Parameters
+    ----------
+    filename : str
+        Name of the table, ending in ".csv", ".parquet", ".feather" or ".npz"
+    index_col : int or str, optional
+        Position or name of the column to use as the index, like
+        ``pandas.read_csv``
+    columns : list of str, optional
+        If given, only read these columns, like ``usecols`` of
+        ``pandas.read_csv``
+    csv_kwargs
+        Other keyword arguments to ``pandas.read_csv``, which are only used
+        for csv
+
+    Returns
+    -------
+    table : pandas.DataFrame
+        The table, with strings as objects as if it was read from a csv
+    """
+    output_format = table_format(filename)
+    if output_format == 'csv':
+        return pd.read_csv(filename, index_col=index_col, usecols=columns,
+                           **csv_kwargs)
+
+    if output_format == 'parquet':
+        table = pd.read_parquet(filename, engine='pyarrow', columns=columns)
+    elif output_format == 'feather':
+        table = pd.read_feather(filename, columns=columns)
+    else:
+        table = _read_npz(filename, columns)
+
+    categoricals = [column for column, dtype in table.dtypes.items()
+                    if pd.api.types.is_categorical_dtype(dtype)]
+    if categoricals:
+        table = table.astype(dict((column, object)
+                                  for column in categoricals))
+    if index_col is not None:
+        if not isinstance(index_col, str):
+            index_col = table.columns[index_col]
+        table = table.set_index(index_col)
+        if table.index.name == UNNAMED_INDEX:
+            table.index.name = None
+    return table
+
+
+def sparse_psi_filename(filename):
+    """Get the filename of a Psi matrix stored with ``write_sparse_psi``
+
+    Parameters
+    ----------
+    filename : str
+        Name of a Psi table, e.g. "psi/outrigger_psi.csv"
+
+    Returns
+    -------
+    filename : str
+        The same name ending in ``SPARSE_PSI_SUFFIX``, e.g.
+        "psi/outrigger_psi_sparse.npz"
+    """
+    if filename.endswith(SPARSE_PSI_SUFFIX):
+        return filename
+    root, extension = os.path.splitext(filename)
+    if extension.lstrip('.') not in FORMATS:
+        root = filename
+    return root + SPARSE_PSI_SUFFIX
+
+
+def write_sparse_psi(psi, filename, quantize=False):
+    """Write only the Psi values which aren't NaN, as a sparse matrix
+
+    Most samples have no Psi on most events in single-cell data, so storing
+    the positions and values of only the observed Psi, like the rows of a
+    compressed sparse row (CSR) matrix, is many times smaller than the whole
+    table. Unlike an ordinary sparse matrix, zeros are kept and the missing
+    values are NaN.
+
+    Parameters
+    ----------
+    psi : pandas.DataFrame
+        Percent spliced-in, e.g. samples x events
+    filename : str
+        Name of the Psi table. It is changed to end in ``SPARSE_PSI_SUFFIX``
+    quantize : bool, optional
+        If True, store Psi as 8-bit codes (see ``QUANTIZED_PSI_MAX``),
+        which are within half a step (1/500) of the Psi, plus the rounding
+        of 32-bit floats, instead of exact 32-bit floats
+
+    Returns
+    -------
+    filename : str
+        Name of the written file
+    """
+    values = np.asarray(psi.values, dtype=np.float32)
+    observed = ~np.isnan(values)
+    data = values[observed]
+    if quantize:
+        data = np.rint(data.astype(np.float64) * QUANTIZED_PSI_MAX).astype(
+            np.uint8)
+
+    filename = sparse_psi_filename(filename)
+    np.savez_compressed(
+        filename, data=data,
+        indices=np.nonzero(observed)[1].astype(np.int32),
+        indptr=np.concatenate([[0], np.cumsum(observed.sum(axis=1))]),
+        rows=np.array([str(x) for x in psi.index], dtype=str),
+        columns=np.array([str(x) for x in psi.columns], dtype=str),
+        names=np.array([psi.index.name or '', psi.columns.name or ''],
+                       dtype=str),
+        quantized=np.array(quantize))
+    return filename
+
+
+def read_sparse_psi(filename, sparse=False):
+    """Read a Psi matrix written by ``write_sparse_psi``
+
+    Parameters
+    ----------
+    filename : str
+        Name of the sparse Psi matrix, e.g. "psi/outrigger_psi_sparse.npz"
+    sparse : bool, optional
+        If True, make each column a pandas sparse array whose missing values
+        are NaN, so only the observed Psi take memory. Otherwise, make an
+        ordinary table with NaN for the missing Psi
+
+    Returns
+    -------
+    psi : pandas.DataFrame
+        32-bit float Psi, with the same rows and columns as were written
+    """
+    with np.load(filename) as arrays:
+        data = arrays['data']
+        indices = arrays['indices']
+        indptr = arrays['indptr']
+        names = [str(x) or None for x in arrays['names']]
+        rows = pd.Index(arrays['rows'].astype(object), name=names[0])
+        columns = pd.Index(arrays['columns'].astype(object), name=names[1])
+        if arrays['quantized']:
+            data = (data / float(QUANTIZED_PSI_MAX)).astype(np.float32)
+    positions = np.repeat(np.arange(len(rows)), np.diff(indptr))
+
+    if not sparse:
+        values = np.full((len(rows), len(columns)), np.nan, dtype=np.float32)
+        values[positions, indices] = data
+        return pd.DataFrame(values, index=rows, columns=columns)
+
+    # Go through the observed Psi one column at a time
+    order = np.argsort(indices, kind='mergesort')
+    bounds = np.searchsorted(indices[order], np.arange(len(columns) + 1))
+    psi = {}
+    for i, column in enumerate(columns):
+        observed = order[bounds[i]:bounds[i + 1]]
+        values = np.full(len(rows), np.nan, dtype=np.float32)
+        values[positions[observed]] = data[observed]
+        psi[column] = pd.arrays.SparseArray(values, fill_value=np.nan)
+    return pd.DataFrame(psi, index=rows, columns=columns)
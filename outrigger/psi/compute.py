@@ -1,10 +1,19 @@
+import contextlib
+import itertools
 import logging
+import os
+import shutil
+import tempfile
 
 import joblib
+import numpy as np
 import pandas as pd
+from scipy import sparse
 
 from ..common import INCOMPATIBLE_JUNCTIONS, MIN_READS, \
-    UNEVEN_COVERAGE_MULTIPLIER, SAMPLE_ID, EVENT_ID, NOTES, PSI
+    UNEVEN_COVERAGE_MULTIPLIER, SAMPLE_ID, EVENT_ID, NOTES, PSI, \
+    ZERO_READS_SAMPLES, JUNCTION_ID
+from ..io.core import compact_counts
 from ..util import progress
 
 
@@ -274,8 +283,8 @@ def _single_isoform_maybe_reject(
     #     return None, None, "Case 5: One or more junction is zero, but is " \
     #                        "incompatible with annotation"
 
-    pseudo1 = isoform1 + 1
-    pseudo2 = isoform2 + 1
+    pseudo1 = _widened(isoform1) + 1
+    pseudo2 = _widened(isoform2) + 1
 
     unequal1 = _single_sample_check_unequal_read_coverage(
         pseudo1, uneven_coverage_multiplier)
@@ -313,6 +322,242 @@ def _single_isoform_maybe_reject(
     return None, None, "Case ???"
 
 
+# Integer codes for the cases in ``_maybe_reject`` and
+# ``_single_isoform_maybe_reject``. Each code is the position of the
+# explanation in CASE_NOTES
+CASE_NOTES = (
+    'Case 1: >= {min_reads} reads on junctions that are incompatible with the '
+    'annotation',
+    'Case 2: Zero observed reads',
+    'Case 3: All junctions with insufficient reads',
+    'Case 4: Only one junction with sufficient reads',
+    'Case 5: Unequal read coverage (one side has at least '
+    '{uneven_coverage_multiplier}x more reads)',
+    'Case 6: Exclusion',
+    'Case 7: Inclusion',
+    'Case 8: Sufficient reads on all junctions',
+    'Case 9a: Isoform1 with sufficient reads but Isoform2 has 1+ junctions '
+    'with insufficient reads: There are sufficient junction reads',
+    'Case 9b: Isoform1 with sufficient reads but Isoform2 has 1+ junctions '
+    'with insufficient reads: There are insufficient junction reads',
+    'Case 10a: Isoform1 has 1+ junction with insufficient reads but Isoform2 '
+    'with sufficient reads: There are sufficient junction reads',
+    'Case 10b: Isoform1 has 1+ junction with insufficient reads but Isoform2 '
+    'with sufficient reads: There are insufficient junction reads',
+    'Case 11a: Isoform1 and Isoform2 each have both sufficient and '
+    'insufficient junctions: There are sufficient junction reads',
+    'Case 11b: Isoform1 and Isoform2 each have both sufficient and '
+    'insufficient junctions: There are insufficient junction reads',
+    'Case ???')
+CASE_UNKNOWN = len(CASE_NOTES) - 1
+
+# Cases where Psi is calculated, all others are rejected
+RETAINED_CASES = (5, 6, 7, 8, 10, 12)
+
+# Case of samples with zero reads on all of an event's junctions
+CASE_ZERO_READS = 1
+
+# Psi is between 0 and 1, so single precision is plenty and takes half the
+# memory of a (n_samples, n_events) matrix of doubles
+PSI_DTYPE = np.float32
+
+
+def _case_notes(min_reads=MIN_READS,
+                uneven_coverage_multiplier=UNEVEN_COVERAGE_MULTIPLIER):
+    """Fill in the thresholds of each case's explanation
+
+    Returns
+    -------
+    notes : numpy.ndarray
+        Array of strings which can be indexed by the integer case codes
+    """
+    return np.array([note.format(
+        min_reads=min_reads,
+        uneven_coverage_multiplier=uneven_coverage_multiplier)
+        for note in CASE_NOTES], dtype=object)
+
+
+def _psi_settings(min_reads=MIN_READS, method='mean',
+                  uneven_coverage_multiplier=UNEVEN_COVERAGE_MULTIPLIER):
+    """Get every combination of the thresholds and methods to use for Psi
+
+    Parameters
+    ----------
+    min_reads, method, uneven_coverage_multiplier
+        A single value, or a list of values, of each parameter of
+        ``calculate_psi``
+
+    Returns
+    -------
+    settings : list of dict
+        Keyword arguments of ``min_reads``, ``method`` and
+        ``uneven_coverage_multiplier`` for each combination
+    """
+    values = [x if isinstance(x, (list, tuple)) else [x]
+              for x in (min_reads, method, uneven_coverage_multiplier)]
+    return [dict(min_reads=x, method=y, uneven_coverage_multiplier=z)
+            for x, y, z in itertools.product(*values)]
+
+
+def _widened(reads):
+    """Get compact integer reads as 64-bit integers
+
+    Junction reads are stored in the smallest unsigned integer type that
+    holds them (see ``outrigger.io.core.compact_counts``), so they are
+    widened before adding to or multiplying them, which could overflow.
+
+    Parameters
+    ----------
+    reads : numpy.ndarray or pandas.Series
+        Numbers of reads, of any type
+
+    Returns
+    -------
+    widened : numpy.ndarray or pandas.Series
+        The reads as 64-bit integers if they were smaller integers, otherwise
+        the same reads
+    """
+    if reads.dtype.kind in 'ui' and reads.dtype.itemsize < 8:
+        return reads.astype(np.int64)
+    return reads
+
+
+def _vectorized_unequal_read_coverage(
+        isoform, uneven_coverage_multiplier=UNEVEN_COVERAGE_MULTIPLIER):
+    """Array version of ``_single_sample_check_unequal_read_coverage``
+
+    Parameters
+    ----------
+    isoform : numpy.ndarray
+        A (..., n_junctions) array of the number of reads found on each
+        junction of an isoform, including any pseudocounts
+    uneven_coverage_multiplier : int
+        Scale factor for the maximum amount bigger one side of a junction can
+        be before rejecting the event
+
+    Returns
+    -------
+    unequal : numpy.ndarray
+        A (...) boolean array that is True where the isoform has unequal read
+        coverage and must be rejected
+    """
+    if isoform.shape[-1] == 1:
+        return np.zeros(isoform.shape[:-1], dtype=bool)
+
+    junction0 = isoform[..., 0]
+    junction1 = isoform[..., 1]
+
+    return ((junction0 > junction1)
+            & (junction0 > junction1 * uneven_coverage_multiplier)) \
+        | ((junction1 > junction0)
+           & (junction1 > junction0 * uneven_coverage_multiplier))
+
+
+def _vectorized_maybe_reject(
+        isoform1, isoform2, incompatible=None, incompatible_mask=None,
+        min_reads=MIN_READS,
+        uneven_coverage_multiplier=UNEVEN_COVERAGE_MULTIPLIER):
+    """Assign a rejection case to all samples at once
+
+    Evaluates the same cases as ``_maybe_reject`` and
+    ``_single_isoform_maybe_reject``, in the same order, but on whole arrays
+    instead of one sample at a time.
+
+    Parameters
+    ----------
+    isoform1, isoform2 : numpy.ndarray
+        (..., n_junctions) arrays of the number of reads found on the
+        junctions of isoform1 and isoform2, e.g. (n_samples, n_junctions) for
+        a single event
+    incompatible : numpy.ndarray, optional
+        (..., n_incompatible) array of the number of reads found on junctions
+        that are incompatible with the event definition. If None, the event
+        has no incompatible junctions to check
+    incompatible_mask : numpy.ndarray, optional
+        Boolean array of the same shape as ``incompatible`` which is False
+        where an incompatible junction is only padding and should be ignored
+    min_reads : int, optional
+        Minimum number of reads for a junction to be counted (default=10)
+    uneven_coverage_multiplier : int, optional
+        Scale factor for the maximum amount bigger one side of a junction can
+        be before rejecting the event (default=10)
+
+    Returns
+    -------
+    cases : numpy.ndarray
+        (...) integer array of positions in ``CASE_NOTES``
+    """
+    n_junctions = isoform1.shape[-1] + isoform2.shape[-1]
+
+    zero1 = (isoform1 == 0).all(axis=-1)
+    zero2 = (isoform2 == 0).all(axis=-1)
+    sufficient1 = isoform1 >= min_reads
+    sufficient2 = isoform2 >= min_reads
+    all_sufficient1 = sufficient1.all(axis=-1)
+    all_sufficient2 = sufficient2.all(axis=-1)
+    any_sufficient1 = sufficient1.any(axis=-1)
+    any_sufficient2 = sufficient2.any(axis=-1)
+    all_insufficient1 = ~any_sufficient1
+    all_insufficient2 = ~any_sufficient2
+    any_insufficient1 = ~all_sufficient1
+    any_insufficient2 = ~all_sufficient2
+
+    if incompatible is None:
+        incompatible_coverage = np.zeros(zero1.shape, dtype=bool)
+    else:
+        incompatible_coverage = incompatible >= min_reads
+        if incompatible_mask is not None:
+            incompatible_coverage &= incompatible_mask
+        incompatible_coverage = incompatible_coverage.any(axis=-1)
+
+    unequal = _vectorized_unequal_read_coverage(
+        _widened(isoform1) + 1, uneven_coverage_multiplier) \
+        | _vectorized_unequal_read_coverage(
+            _widened(isoform2) + 1, uneven_coverage_multiplier)
+
+    enough_total = (isoform1.sum(axis=-1) + isoform2.sum(axis=-1)) \
+        >= (min_reads * n_junctions)
+
+    case9 = all_sufficient1 & any_insufficient2
+    case10 = any_insufficient1 & all_sufficient2
+    case11 = (any_insufficient1 & any_sufficient1) \
+        | (any_insufficient2 & any_sufficient2)
+
+    conditions = [
+        incompatible_coverage,
+        zero1 & zero2,
+        all_insufficient1 & all_insufficient2,
+        (any_insufficient1 & all_insufficient2)
+        | (all_insufficient1 & any_insufficient2),
+        unequal,
+        all_sufficient1 & zero2,
+        zero1 & all_sufficient2,
+        all_sufficient1 & all_sufficient2,
+        case9 & enough_total, case9,
+        case10 & enough_total, case10,
+        case11 & enough_total, case11]
+    return np.select(conditions, np.arange(len(conditions)),
+                     default=CASE_UNKNOWN)
+
+
+def _vectorized_scale(x, method='mean'):
+    """Aggregate the last axis of junction reads, like ``_scale``"""
+    if method == 'mean':
+        return x.sum(axis=-1)/float(x.shape[-1])
+    elif method == 'min':
+        return x.min(axis=-1)
+
+
+def _vectorized_psi(isoform1, isoform2, cases, method='mean'):
+    """Percent spliced-in of all samples, with rejected cases as NaN"""
+    retained = np.in1d(cases, RETAINED_CASES).reshape(cases.shape)
+    scaled1 = _widened(_vectorized_scale(isoform1, method))
+    scaled2 = _widened(_vectorized_scale(isoform2, method))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        psi = scaled2 / (scaled2 + scaled1)
+    return np.where(retained, psi, np.nan)
+
+
 def _make_summary_columns(isoform1_junction_numbers,
                           isoform2_junction_numbers,
                           incompatible_junctions=None):
@@ -398,10 +643,193 @@ def _summarize_event(event_id, reads, maybe_rejected, psi,
     return summary
 
 
+def _junction_positions(event_annotation, junctions, isoform1_junctions,
+                        isoform2_junctions):
+    """Find where each event's junctions are in the columns of the reads
+
+    This is done once for all events, so that getting an event's reads is a
+    slice by position instead of looking up and splitting junction ids.
+
+    Parameters
+    ----------
+    event_annotation : pandas.DataFrame
+        A table of all possible events, with event ids as the index (row names)
+        and all junctions described, and contains the columns described by
+        ``isoform1_junctions`` and ``isoform_junctions``
+    junctions : pandas.Index
+        Junction ids of the columns of the (n_samples, n_total_junctions)
+        reads matrix
+    isoform1_junctions, isoform2_junctions : list of str
+        Junction numbers corresponding to isoform 1 and isoform 2
+
+    Returns
+    -------
+    event_ids : numpy.ndarray
+        (n_events,) sorted ids of events whose junctions are all in the data
+    positions : numpy.ndarray
+        (n_events, n_junctions) integer column positions of the isoform1
+        junctions followed by the isoform2 junctions
+    incompatible_positions : numpy.ndarray
+        (n_events, max_incompatible) integer column positions of each event's
+        incompatible junctions which exist in the data, padded with zeros
+    incompatible_mask : numpy.ndarray
+        (n_events, max_incompatible) boolean array which is False for padding
+    """
+    # Rows with the same event id only differ in their flanking exons, so
+    # only the first is needed, sorted the same way as a groupby
+    first = ~event_annotation.index.duplicated()
+    events = event_annotation.loc[first].sort_index()
+
+    junction_numbers = list(isoform1_junctions) + list(isoform2_junctions)
+    junction_ids = events[junction_numbers].values
+    positions = junctions.get_indexer(junction_ids.ravel()).reshape(
+        junction_ids.shape)
+
+    # Events from the index that don't exist in the dataset are skipped
+    in_data = (positions >= 0).all(axis=1)
+    events = events.loc[in_data]
+    positions = positions[in_data]
+
+    incompatible = []
+    for incompatible_junctions in events[INCOMPATIBLE_JUNCTIONS]:
+        if isinstance(incompatible_junctions, float):
+            incompatible.append(np.array([], dtype=int))
+            continue
+        incompatible_positions = junctions.get_indexer(
+            incompatible_junctions.split('|'))
+        # Same order as the columns of the reads, like Index.intersection
+        incompatible.append(
+            np.unique(incompatible_positions[incompatible_positions >= 0]))
+
+    max_incompatible = max([len(x) for x in incompatible] + [0])
+    incompatible_positions = np.zeros((len(events), max_incompatible),
+                                      dtype=int)
+    incompatible_mask = np.zeros((len(events), max_incompatible),
+                                 dtype=bool)
+    for i, x in enumerate(incompatible):
+        incompatible_positions[i, :len(x)] = x
+        incompatible_mask[i, :len(x)] = True
+
+    return events.index.values, positions, incompatible_positions, \
+        incompatible_mask
+
+
+def index_junctions(event_annotation, isoform1_junctions,
+                    isoform2_junctions):
+    """Get every junction that the events of an index use
+
+    The Psi of the events only depends on the reads of these junctions, so
+    reads matrices made with exactly these columns give the same Psi, no
+    matter which samples they have.
+
+    Parameters
+    ----------
+    event_annotation : pandas.DataFrame
+        A table of all possible events, with the columns described by
+        ``isoform1_junctions`` and ``isoform2_junctions``, and the
+        incompatible junctions of each event
+    isoform1_junctions, isoform2_junctions : list of str
+        Junction numbers corresponding to isoform 1 and isoform 2
+
+    Returns
+    -------
+    junctions : pandas.Index
+        Sorted ids of the isoform and incompatible junctions of all events
+    """
+    junction_numbers = list(isoform1_junctions) + list(isoform2_junctions)
+    junctions = set(event_annotation[junction_numbers].values.ravel())
+    if INCOMPATIBLE_JUNCTIONS in event_annotation:
+        for incompatible in event_annotation[INCOMPATIBLE_JUNCTIONS].dropna():
+            junctions.update(incompatible.split('|'))
+    return pd.Index(sorted(junctions), name=JUNCTION_ID)
+
+
+def _reads_matrix(reads2d, samples=None, junctions=None):
+    """Get the junction reads as a plain array, and its row and column ids
+
+    Parameters
+    ----------
+    reads2d : pandas.DataFrame, numpy.ndarray or scipy.sparse matrix
+        A (n_samples, n_total_junctions) table of the number of reads found in
+        all samples' exon-exon, all junctions
+    samples : array-like, optional
+        (n_samples,) sample ids of the rows of ``reads2d``. Required if
+        ``reads2d`` is not a DataFrame, otherwise its index is used
+    junctions : array-like, optional
+        (n_total_junctions,) junction ids of the columns of ``reads2d``.
+        Required if ``reads2d`` is not a DataFrame, otherwise its columns are
+        used
+
+    Returns
+    -------
+    reads : numpy.ndarray or scipy.sparse.csc_matrix
+        Junction reads, as a dense array or a sparse matrix with compressed
+        columns, so that taking an event's columns is fast
+    samples : pandas.Index
+        Sample ids of the rows of ``reads``, named "sample_id" if they had
+        no name
+    junctions : pandas.Index
+        Junction ids of the columns of ``reads``
+
+    Raises
+    ------
+    ValueError
+        If ``reads2d`` is not a DataFrame but ``samples`` or ``junctions`` is
+        missing, or if they don't match the shape of ``reads2d``
+    """
+    if isinstance(reads2d, pd.DataFrame):
+        return reads2d.values, reads2d.index, reads2d.columns
+
+    if samples is None or junctions is None:
+        raise ValueError('When the junction reads are not a DataFrame, the '
+                         'sample ids of its rows and junction ids of its '
+                         'columns must be given as "samples" and '
+                         '"junctions"')
+    samples = pd.Index(samples)
+    junctions = pd.Index(junctions)
+    if samples.name is None:
+        # The summary gets its sample id column from the name of the index
+        samples = samples.rename(SAMPLE_ID)
+    if reads2d.shape != (len(samples), len(junctions)):
+        raise ValueError('The junction reads matrix has shape {}, but there '
+                         'are {} samples and {} junctions'.format(
+                            reads2d.shape, len(samples), len(junctions)))
+    if sparse.issparse(reads2d):
+        reads2d = sparse.csc_matrix(reads2d)
+    else:
+        reads2d = np.asarray(reads2d)
+    return reads2d, samples, junctions
+
+
+def _take_columns(reads, columns):
+    """Get the reads of some columns as a dense array
+
+    Parameters
+    ----------
+    reads : numpy.ndarray or scipy.sparse matrix
+        A (n_samples, n_total_junctions) array of junction reads
+    columns : numpy.ndarray
+        Integer positions of the columns to take, of any shape
+
+    Returns
+    -------
+    taken : numpy.ndarray
+        A (n_samples,) + columns.shape array, the same as
+        ``reads[:, columns]`` of a dense array
+    """
+    columns = np.asarray(columns)
+    if not sparse.issparse(reads):
+        return reads[:, columns]
+    # Only the few columns needed are made dense
+    taken = reads[:, columns.ravel()].toarray()
+    return taken.reshape(reads.shape[:1] + columns.shape)
+
+
 def _single_event_psi(event_id, event_df, reads2d,
                       isoform1_junction_numbers, isoform2_junction_numbers,
                       min_reads=MIN_READS, method='mean',
-                      uneven_coverage_multiplier=UNEVEN_COVERAGE_MULTIPLIER):
+                      uneven_coverage_multiplier=UNEVEN_COVERAGE_MULTIPLIER,
+                      engine='pandas', samples=None, junctions=None):
     """Calculate percent spliced in for a single event across all samples
 
     Parameters
@@ -412,7 +840,7 @@ def _single_event_psi(event_id, event_df, reads2d,
         A table with the event id as the index (row names) and the junction
         locations for the different isoforms. This may have multiple rows (or
         not) depending on the different widths of the flanking exons
-    junction_reads_2d : pandas.DataFrame
+    junction_reads_2d : pandas.DataFrame or scipy.sparse matrix
         A (n_samples, n_total_junctions) table of the number of reads found in
         all samples' exon-exon, all junctions. Very very large, e.g.
         1000 samples x 50,000 junctions = 50 million elements
@@ -434,6 +862,12 @@ def _single_event_psi(event_id, event_df, reads2d,
         be before rejecting the event, e.g. for an SE event with two junctions,
         junction12 and junction23, junction12=40 but junction23=500, then this
         event would be rejected because 500 > 40*10
+    engine : "pandas" | "numpy"
+        Whether to find the rejection cases one sample at a time (default) or
+        all samples at once
+    samples, junctions : array-like, optional
+        Sample ids of the rows and junction ids of the columns of
+        ``reads2d``, if it is a sparse matrix
 
     Returns
     -------
@@ -466,36 +900,467 @@ def _single_event_psi(event_id, event_df, reads2d,
     4  isoform1=junction:chr10:128491034-128491719:-|...
 
     """
-    junction_locations = event_df.iloc[0]
-
-    n_junctions1 = len(isoform1_junction_numbers)
-    n_junctions2 = len(isoform2_junction_numbers)
-    n_junctions = n_junctions1 + n_junctions2
-
-    isoform1_junction_ids = junction_locations[
-        isoform1_junction_numbers].tolist()
-    isoform2_junction_ids = junction_locations[
-        isoform2_junction_numbers].tolist()
-    incompatible_junctions = junction_locations[INCOMPATIBLE_JUNCTIONS]
-
-    junction_cols = isoform1_junction_ids + isoform2_junction_ids
+    reads, samples, junctions = _reads_matrix(reads2d, samples, junctions)
+    event_ids, positions, incompatible_positions, incompatible_mask = \
+        _junction_positions(event_df, junctions,
+                            isoform1_junction_numbers,
+                            isoform2_junction_numbers)
 
     # If this event from the index doesn't exist in the dataset, return an
     # empty dataframe
-    junctions_in_data = reads2d.columns.intersection(junction_cols)
-    if len(junctions_in_data) < n_junctions:
+    if len(event_ids) == 0:
         summary_columns = _make_summary_columns(isoform1_junction_numbers,
-                                                isoform2_junction_numbers,
-                                                incompatible_junctions)
+                                                isoform2_junction_numbers)
         return pd.DataFrame(columns=summary_columns)
 
-    if not isinstance(incompatible_junctions, float):
-        incompatible_junctions = incompatible_junctions.split('|')
-        incompatible_junctions = reads2d.columns.intersection(
-            incompatible_junctions).tolist()
-        junction_cols += incompatible_junctions
+    (event_id, columns, junction_ids), = _event_tasks(
+        event_ids, positions, incompatible_positions, incompatible_mask,
+        junctions)
+    single_event_psi = SINGLE_EVENT_ENGINES[engine]
+    return single_event_psi(
+        event_id, reads, samples, columns, junction_ids,
+        isoform1_junction_numbers, isoform2_junction_numbers,
+        min_reads=min_reads, method=method,
+        uneven_coverage_multiplier=uneven_coverage_multiplier)
+
+
+def _event_tasks(event_ids, positions, incompatible_positions,
+                 incompatible_mask, junctions):
+    """Make the small per-event inputs that are sent to each worker
+
+    Parameters
+    ----------
+    event_ids, positions, incompatible_positions, incompatible_mask
+        Output of ``_junction_positions``
+    junctions : pandas.Index
+        Junction ids of the columns of the reads matrix
+
+    Returns
+    -------
+    tasks : list of tuples
+        For each event, the event id, the column positions of the isoform1,
+        isoform2 and incompatible junctions in the reads matrix, and the
+        junction ids of those columns
+    """
+    tasks = []
+    for i, event_id in enumerate(event_ids):
+        columns = np.concatenate([
+            positions[i], incompatible_positions[i][incompatible_mask[i]]])
+        tasks.append((event_id, columns, junctions[columns].tolist()))
+    return tasks
+
+
+def _event_junction_reads(reads, samples, columns, junction_ids,
+                          n_junctions1, n_junctions):
+    """Get an event's junction ids and reads by their column positions
+
+    Parameters
+    ----------
+    reads : numpy.ndarray
+        A (n_samples, n_total_junctions) array of the number of reads found in
+        all samples' exon-exon, all junctions
+    samples : pandas.Index
+        Sample ids of the rows of ``reads``
+    columns : numpy.ndarray
+        Column positions of the isoform1 junctions followed by the isoform2
+        junctions and the incompatible junctions in the data
+    junction_ids : list of str
+        Junction ids of ``columns``
+    n_junctions1 : int
+        Number of isoform1 junctions
+    n_junctions : int
+        Total number of isoform1 and isoform2 junctions
+
+    Returns
+    -------
+    isoform1_junction_ids, isoform2_junction_ids : list of str
+        Junction ids of each isoform
+    incompatible_junctions : list of str or float
+        Incompatible junctions of the event which exist in the dataset, or NaN
+        if there are none
+    event_reads : pandas.DataFrame
+        A (n_samples, n_junctions) table of reads on this event's junctions
+    """
+    event_reads = pd.DataFrame(_take_columns(reads, columns), index=samples,
+                               columns=junction_ids)
+
+    isoform1_junction_ids = junction_ids[:n_junctions1]
+    isoform2_junction_ids = junction_ids[n_junctions1:n_junctions]
+    incompatible_junctions = junction_ids[n_junctions:]
+    if len(incompatible_junctions) == 0:
+        incompatible_junctions = np.nan
+    return isoform1_junction_ids, isoform2_junction_ids, \
+        incompatible_junctions, event_reads
+
+
+def _event_support(reads, event_columns, n_junctions, min_reads=MIN_READS):
+    """Count the junctions of each event with reads in each sample, in bulk
+
+    Samples with zero reads on all of an event's junctions, including the
+    incompatible junctions, are always "Case 2: Zero observed reads", so they
+    don't need to go through all the rejection cases. The only exception is
+    when ``min_reads`` is zero or less and the event has incompatible
+    junctions, because then every sample is Case 1 instead.
+
+    Parameters
+    ----------
+    reads : numpy.ndarray or scipy.sparse matrix
+        A (n_samples, n_total_junctions) array of the number of reads found in
+        all samples' exon-exon, all junctions
+    event_columns : list of numpy.ndarray
+        Column positions of each event's isoform1, isoform2 and incompatible
+        junctions in ``reads``
+    n_junctions : int
+        Total number of isoform1 and isoform2 junctions
+    min_reads : int, optional
+        Minimum number of reads for a junction to be viable
+
+    Returns
+    -------
+    support : scipy.sparse.csc_matrix
+        (n_samples, n_events) number of each event's junctions with nonzero
+        reads in each sample, with sorted indices
+    prunable : numpy.ndarray
+        (n_events,) boolean array of whether the samples with zero support
+        are Case 2 and can be skipped
+    """
+    n_samples, n_total_junctions = reads.shape
+    n_events = len(event_columns)
+    lengths = np.array([len(x) for x in event_columns], dtype=int)
+    if n_events > 0:
+        columns = np.concatenate(event_columns).astype(int)
+    else:
+        columns = np.array([], dtype=int)
+
+    # (n_total_junctions, n_events) matrix of which junctions are in an event
+    indicator = sparse.csc_matrix(
+        (np.ones(len(columns), dtype=np.int32),
+         (columns, np.repeat(np.arange(n_events), lengths))),
+        shape=(n_total_junctions, n_events))
+    if sparse.issparse(reads):
+        nonzero = (reads != 0).astype(np.int32)
+    else:
+        nonzero = sparse.csr_matrix(reads != 0, dtype=np.int32)
+    support = sparse.csc_matrix(nonzero.dot(indicator))
+    support.eliminate_zeros()
+    support.sort_indices()
+
+    return support, _prunable(event_columns, n_junctions, min_reads)
+
+
+def _prunable(event_columns, n_junctions, min_reads=MIN_READS):
+    """Find the events whose samples without reads can be skipped
+
+    Parameters
+    ----------
+    event_columns, n_junctions, min_reads
+        See ``_event_support``
+
+    Returns
+    -------
+    prunable : numpy.ndarray
+        (n_events,) boolean array of whether the samples with zero support
+        are Case 2 and can be skipped
+    """
+    lengths = np.array([len(x) for x in event_columns], dtype=int)
+    if min_reads > 0:
+        return np.ones(len(lengths), dtype=bool)
+    # Every sample is Case 1 when the event has incompatible junctions
+    return lengths <= n_junctions
+
+
+def _supported_rows(support, prunable):
+    """Get the samples which need the full rejection cases for each event
+
+    Parameters
+    ----------
+    support, prunable
+        Output of ``_event_support``
+
+    Returns
+    -------
+    rows : list of numpy.ndarray
+        Sorted row positions of the samples with reads on each event, or all
+        samples if the event can't be pruned
+    """
+    all_rows = np.arange(support.shape[0])
+    return [support.indices[support.indptr[i]:support.indptr[i + 1]]
+            if prunable[i] else all_rows
+            for i in range(support.shape[1])]
+
+
+def _zero_reads_summary(event_id, samples, junction_ids, n_junctions,
+                        isoform1_junction_numbers, isoform2_junction_numbers,
+                        dtype):
+    """Summarize samples with zero reads on all of an event's junctions
+
+    Parameters
+    ----------
+    event_id : str
+        Uniquely identifying string for a splicing event
+    samples : pandas.Index
+        Sample ids with zero reads on the event
+    junction_ids : list of str
+        Junction ids of the event, from ``_event_tasks``
+    n_junctions : int
+        Total number of isoform1 and isoform2 junctions
+    isoform1_junction_numbers, isoform2_junction_numbers : list of str
+        Junction numbers corresponding to isoform 1 and isoform 2
+    dtype : numpy.dtype
+        Data type of the junction reads
+
+    Returns
+    -------
+    summary : pandas.DataFrame
+        The same rows as the summary of the full rejection cases, which are
+        all "Case 2: Zero observed reads" with Psi of NaN
+    """
+    incompatible_junctions = list(junction_ids[n_junctions:]) or None
+    summary_columns = _make_summary_columns(isoform1_junction_numbers,
+                                            isoform2_junction_numbers,
+                                            incompatible_junctions)
+    n_samples = len(samples)
+    data = {SAMPLE_ID: samples.values, EVENT_ID: event_id,
+            PSI: np.full(n_samples, np.nan),
+            NOTES: CASE_NOTES[CASE_ZERO_READS]}
+    zeros = np.zeros(n_samples, dtype=dtype)
+    for column in summary_columns:
+        if column.startswith(('isoform', 'incompatible')):
+            data[column] = zeros
+    return pd.DataFrame(data, columns=summary_columns)
+
+
+def _pruned_event_psi(single_event_psi, event_id, reads, samples, columns,
+                      junction_ids, rows, isoform1_junction_numbers,
+                      isoform2_junction_numbers, min_reads=MIN_READS,
+                      method='mean',
+                      uneven_coverage_multiplier=UNEVEN_COVERAGE_MULTIPLIER,
+                      compact_summary=False, event_code=None,
+                      summarize=True):
+    """Calculate Psi of an event only on the samples with reads on it
+
+    The samples without any reads on the event are added as Case 2 directly,
+    so the summary is the same as using ``single_event_psi`` on all samples.
+    With ``compact_summary=True``, they are left out instead.
+
+    Parameters
+    ----------
+    single_event_psi : function
+        One of ``SINGLE_EVENT_ENGINES``
+    event_id, reads, samples, columns, junction_ids
+        See ``_event_psi``
+    rows : numpy.ndarray
+        Sorted row positions of the samples which need the full rejection
+        cases, from ``_supported_rows``
+    isoform1_junction_numbers, isoform2_junction_numbers, min_reads, method,
+    uneven_coverage_multiplier
+        See ``_event_psi``
+    compact_summary : bool, optional
+        If True, only summarize the samples in ``rows``
+    event_code : int, optional
+        If given, the sample id, event id and notes columns of the summary
+        are integer codes instead of strings (see ``_encode_summary``), and
+        this is the code of the event id
+    summarize : bool, optional
+        If False, don't make the summary of the samples without reads, and
+        return None instead of the summary
+
+    Returns
+    -------
+    psi : numpy.ndarray
+        (n_samples,) percent spliced-in of the event in every sample, in the
+        same order as ``samples``
+    summary : pandas.DataFrame or None
+        Summary of the event, or None if ``summarize=False``
+    """
+    kwargs = dict(min_reads=min_reads, method=method,
+                  uneven_coverage_multiplier=uneven_coverage_multiplier)
+    n_samples = len(samples)
+    n_junctions = len(isoform1_junction_numbers) \
+        + len(isoform2_junction_numbers)
+    psi = np.full(n_samples, np.nan, dtype=PSI_DTYPE)
+
+    if len(rows) == n_samples:
+        summary = single_event_psi(event_id, reads, samples, columns,
+                                   junction_ids, isoform1_junction_numbers,
+                                   isoform2_junction_numbers, **kwargs)
+        psi[:] = summary[PSI].values
+        summary_rows = rows
+    elif not summarize:
+        if len(rows) > 0:
+            event_reads = _take_columns(reads, columns)[rows]
+            summary = single_event_psi(event_id, event_reads, samples[rows],
+                                       np.arange(len(columns)), junction_ids,
+                                       isoform1_junction_numbers,
+                                       isoform2_junction_numbers, **kwargs)
+            psi[rows] = summary[PSI].values
+        return psi, None
+    elif len(rows) == 0 and compact_summary:
+        summary = _zero_reads_summary(event_id, samples[rows], junction_ids,
+                                      n_junctions, isoform1_junction_numbers,
+                                      isoform2_junction_numbers, reads.dtype)
+        summary_rows = rows
+    elif len(rows) == 0:
+        summary = _zero_reads_summary(event_id, samples, junction_ids,
+                                      n_junctions, isoform1_junction_numbers,
+                                      isoform2_junction_numbers, reads.dtype)
+        summary_rows = np.arange(n_samples)
+    else:
+        event_reads = _take_columns(reads, columns)[rows]
+        summary = single_event_psi(event_id, event_reads, samples[rows],
+                                   np.arange(len(columns)), junction_ids,
+                                   isoform1_junction_numbers,
+                                   isoform2_junction_numbers, **kwargs)
+        psi[rows] = summary[PSI].values
+        summary_rows = rows
+        if not compact_summary:
+            zero_rows = np.setdiff1d(np.arange(n_samples), rows,
+                                     assume_unique=True)
+            zero = _zero_reads_summary(
+                event_id, samples[zero_rows], junction_ids, n_junctions,
+                isoform1_junction_numbers, isoform2_junction_numbers,
+                reads.dtype)
+
+            # Put the samples back in their original order
+            summary = pd.concat([summary, zero], ignore_index=True)
+            order = np.argsort(np.concatenate([rows, zero_rows]),
+                               kind='mergesort')
+            summary = summary.iloc[order].reset_index(drop=True)
+            summary_rows = np.arange(n_samples)
+
+    if not summarize:
+        return psi, None
+    if event_code is not None:
+        summary = _encode_summary(summary, summary_rows, event_code,
+                                  min_reads, uneven_coverage_multiplier)
+    return psi, summary
+
+
+def _sweep_event_psi(single_event_psi, event_id, reads, samples, columns,
+                     junction_ids, rows, isoform1_junction_numbers,
+                     isoform2_junction_numbers, settings,
+                     compact_summary=False, event_code=None, summarize=True):
+    """Calculate Psi of an event with each of several settings
+
+    The reads of the event's junctions are taken out of the matrix only
+    once, and then used for every setting.
+
+    Parameters
+    ----------
+    single_event_psi, event_id, reads, samples, columns, junction_ids
+        See ``_pruned_event_psi``
+    rows : list of numpy.ndarray
+        Row positions of the samples which need the full rejection cases,
+        for each setting
+    isoform1_junction_numbers, isoform2_junction_numbers
+        See ``_event_psi``
+    settings : list of dict
+        Keyword arguments of ``min_reads``, ``method`` and
+        ``uneven_coverage_multiplier``, from ``_psi_settings``
+    compact_summary, event_code, summarize
+        See ``_pruned_event_psi``
+
+    Returns
+    -------
+    results : list of tuples
+        Output of ``_pruned_event_psi`` for each setting
+    """
+    if len(settings) > 1 and any(len(x) > 0 for x in rows):
+        reads = _take_columns(reads, columns)
+        columns = np.arange(len(columns))
+    return [_pruned_event_psi(
+        single_event_psi, event_id, reads, samples, columns, junction_ids,
+        setting_rows, isoform1_junction_numbers, isoform2_junction_numbers,
+        compact_summary=compact_summary, event_code=event_code,
+        summarize=summarize, **setting)
+        for setting_rows, setting in zip(rows, settings)]
+
 
-    reads = reads2d[junction_cols]
+def _encode_summary(summary, sample_codes, event_code, min_reads=MIN_READS,
+                    uneven_coverage_multiplier=UNEVEN_COVERAGE_MULTIPLIER):
+    """Replace the sample ids, event id and notes of a summary by integers
+
+    Integers take much less memory than the full strings, and are much faster
+    to concatenate. They are turned into categoricals by ``_decode_summary``.
+
+    Parameters
+    ----------
+    summary : pandas.DataFrame
+        Summary of a single event
+    sample_codes : numpy.ndarray
+        Row position in the junction reads of the sample of each row
+    event_code : int
+        Position of the event in all events
+    min_reads, uneven_coverage_multiplier
+        Thresholds used to write the notes
+
+    Returns
+    -------
+    summary : pandas.DataFrame
+        The same table, with integer sample ids, event ids and notes. The
+        notes are positions in ``CASE_NOTES``
+    """
+    note_codes = dict((note, code) for code, note in enumerate(
+        _case_notes(min_reads, uneven_coverage_multiplier)))
+    summary = summary.copy()
+    summary[SAMPLE_ID] = np.asarray(sample_codes, dtype=np.int32)
+    summary[EVENT_ID] = np.full(len(summary), event_code, dtype=np.int32)
+    summary[NOTES] = np.array([note_codes[note] for note in summary[NOTES]],
+                              dtype=np.int8)
+    return summary
+
+
+def _decode_summary(summary, samples, event_ids, min_reads=MIN_READS,
+                    uneven_coverage_multiplier=UNEVEN_COVERAGE_MULTIPLIER):
+    """Make the integer sample ids, event ids and notes into categoricals
+
+    Parameters
+    ----------
+    summary : pandas.DataFrame
+        Summary with integer codes, from ``_encode_summary`` or ``_batch_psi``
+    samples : pandas.Index
+        Sample ids, in the order of their codes
+    event_ids : numpy.ndarray
+        Event ids, in the order of their codes
+    min_reads, uneven_coverage_multiplier
+        Thresholds used to write the notes
+
+    Returns
+    -------
+    summary : pandas.DataFrame
+        The same table, where the sample id, event id and notes columns are
+        categoricals which look like the original strings
+    """
+    notes = _case_notes(min_reads, uneven_coverage_multiplier)
+    summary[SAMPLE_ID] = pd.Categorical.from_codes(summary[SAMPLE_ID],
+                                                   categories=samples)
+    summary[EVENT_ID] = pd.Categorical.from_codes(summary[EVENT_ID],
+                                                  categories=event_ids)
+    summary[NOTES] = pd.Categorical.from_codes(summary[NOTES],
+                                               categories=notes)
+    return summary
+
+
+def _event_psi(event_id, reads, samples, columns, junction_ids,
+               isoform1_junction_numbers, isoform2_junction_numbers,
+               min_reads=MIN_READS, method='mean',
+               uneven_coverage_multiplier=UNEVEN_COVERAGE_MULTIPLIER):
+    """Calculate percent spliced in of an event, one sample at a time
+
+    Parameters are the same as ``_single_event_psi``, except that the reads
+    are a plain (n_samples, n_total_junctions) array with their ``samples``
+    as a separate index, and the event's junctions are given as the
+    ``columns`` of the array and their ``junction_ids``, from
+    ``_event_tasks``. The array can be a read-only memory map shared by all
+    workers.
+    """
+    n_junctions1 = len(isoform1_junction_numbers)
+    n_junctions2 = len(isoform2_junction_numbers)
+    n_junctions = n_junctions1 + n_junctions2
+
+    isoform1_junction_ids, isoform2_junction_ids, incompatible_junctions, \
+        reads = _event_junction_reads(reads, samples, columns, junction_ids,
+                                      n_junctions1, n_junctions)
 
     maybe_rejected = _maybe_reject(
         reads, isoform1_junction_ids, isoform2_junction_ids,
@@ -507,7 +1372,9 @@ def _single_event_psi(event_id, event_df, reads2d,
     isoform2 = maybe_rejected[isoform2_junction_ids].apply(
         _scale, n_junctions=n_junctions2, method=method, axis=1)
 
-    psi = isoform2 / (isoform2 + isoform1)
+    # The minimum reads can be compact unsigned integers, which could
+    # overflow when added up
+    psi = isoform2 / (isoform2 + isoform1.astype(float))
 
     summary = _summarize_event(event_id, reads, maybe_rejected, psi,
                                isoform1_junction_ids, isoform2_junction_ids,
@@ -517,10 +1384,242 @@ def _single_event_psi(event_id, event_df, reads2d,
     return summary
 
 
+def _event_psi_vectorized(
+        event_id, reads, samples, columns, junction_ids,
+        isoform1_junction_numbers, isoform2_junction_numbers,
+        min_reads=MIN_READS, method='mean',
+        uneven_coverage_multiplier=UNEVEN_COVERAGE_MULTIPLIER):
+    """Calculate percent spliced in of an event, all samples at once
+
+    Same inputs and outputs as ``_event_psi``, but the rejection cases
+    of all samples are found at once on arrays instead of row by row.
+    """
+    n_junctions1 = len(isoform1_junction_numbers)
+    n_junctions = n_junctions1 + len(isoform2_junction_numbers)
+
+    isoform1_junction_ids, isoform2_junction_ids, incompatible_junctions, \
+        reads = _event_junction_reads(reads, samples, columns, junction_ids,
+                                      n_junctions1, n_junctions)
+
+    isoform1 = reads[isoform1_junction_ids].values
+    isoform2 = reads[isoform2_junction_ids].values
+    if isinstance(incompatible_junctions, list):
+        incompatible = reads[incompatible_junctions].values
+    else:
+        incompatible = None
+
+    cases = _vectorized_maybe_reject(
+        isoform1, isoform2, incompatible, min_reads=min_reads,
+        uneven_coverage_multiplier=uneven_coverage_multiplier)
+    psi = pd.Series(_vectorized_psi(isoform1, isoform2, cases, method),
+                    index=reads.index)
+    notes = _case_notes(min_reads, uneven_coverage_multiplier)[cases]
+    maybe_rejected = pd.DataFrame({NOTES: notes}, index=reads.index)
+
+    summary = _summarize_event(event_id, reads, maybe_rejected, psi,
+                               isoform1_junction_ids, isoform2_junction_ids,
+                               isoform1_junction_numbers,
+                               isoform2_junction_numbers,
+                               incompatible_junctions=incompatible_junctions)
+    return summary
+
+
+def _batch_psi(event_ids, positions, incompatible_positions,
+               incompatible_mask, reads, samples, isoform1_junctions,
+               isoform2_junctions, min_reads=MIN_READS, method='mean',
+               uneven_coverage_multiplier=UNEVEN_COVERAGE_MULTIPLIER,
+               supported=None, compact_summary=False, event_codes=None,
+               summarize=True, settings=None):
+    """Calculate percent spliced in for a batch of events at once
+
+    All events of a splice type have the same number of junctions, so their
+    reads can be stacked into one (n_events, n_samples, n_junctions) array.
+
+    Parameters
+    ----------
+    event_ids, positions, incompatible_positions, incompatible_mask
+        Output of ``_junction_positions``, for this batch of events only
+    reads : numpy.ndarray or scipy.sparse.csc_matrix
+        A (n_samples, n_total_junctions) array of the number of reads found in
+        all samples' exon-exon, all junctions
+    samples : numpy.ndarray
+        (n_samples,) sample ids of the rows of ``reads``
+    isoform1_junctions, isoform2_junctions : list of str
+        Junction numbers corresponding to isoform 1 and isoform 2
+    min_reads, method, uneven_coverage_multiplier
+        See ``calculate_psi``
+    supported : numpy.ndarray, optional
+        (n_events, n_samples) boolean array of which samples need the full
+        rejection cases for each event. The others are "Case 2: Zero observed
+        reads", and events without any supported samples aren't even read.
+        By default, all samples of all events go through all the cases
+    compact_summary : bool, optional
+        If True, only summarize the ``supported`` samples of each event
+    event_codes : numpy.ndarray, optional
+        If given, the sample id, event id and notes columns of the summary
+        are integer codes instead of strings (see ``_encode_summary``), and
+        these are the codes of ``event_ids``
+    summarize : bool, optional
+        If False, only calculate Psi and return None instead of the summary
+    settings : list of dict, optional
+        If given, calculate Psi with each of these settings from
+        ``_psi_settings`` instead of ``min_reads``, ``method`` and
+        ``uneven_coverage_multiplier``, reading the batch only once. Then
+        ``supported`` is a list with an array for each setting
+
+    Returns
+    -------
+    psi : numpy.ndarray
+        (n_samples, n_events) percent spliced-in of each event in each sample
+    summary : pandas.DataFrame or None
+        A (n_samples * n_events, 7+) shaped table with the sample id, junction
+        reads, percent spliced-in (Psi), and notes on each event in each
+        sample, with the same rows and columns as concatenating the
+        ``_single_event_psi`` output of each event
+    results : list of tuples
+        Instead of ``psi`` and ``summary``, if ``settings`` are given: both
+        of them for each setting
+    """
+    n_events = len(event_ids)
+    n_samples = len(samples)
+
+    if settings is None:
+        results = _batch_psi(
+            event_ids, positions, incompatible_positions, incompatible_mask,
+            reads, samples, isoform1_junctions, isoform2_junctions,
+            supported=[supported], compact_summary=compact_summary,
+            event_codes=event_codes, summarize=summarize,
+            settings=[dict(
+                min_reads=min_reads, method=method,
+                uneven_coverage_multiplier=uneven_coverage_multiplier)])
+        return results[0]
+
+    if supported is None:
+        supported = [None] * len(settings)
+    supported = [np.ones((n_events, n_samples), dtype=bool) if x is None
+                 else x for x in supported]
+    gathered = np.any([x.any(axis=1) for x in supported], axis=0)
+
+    # (n_events, n_samples, n_junctions), only reading the events which have
+    # any reads in any samples
+    tensor = np.zeros((n_events, n_samples, positions.shape[1]),
+                      dtype=reads.dtype)
+    tensor[gathered] = np.moveaxis(
+        _take_columns(reads, positions[gathered]), 0, 1)
+    incompatible = np.zeros((n_events, n_samples,
+                             incompatible_positions.shape[1]),
+                            dtype=reads.dtype)
+    incompatible[gathered] = np.moveaxis(
+        _take_columns(reads, incompatible_positions[gathered]), 0, 1)
+
+    return [_batch_cases_psi(
+        event_ids, samples, tensor, incompatible, incompatible_mask,
+        isoform1_junctions, isoform2_junctions, supported=setting_supported,
+        compact_summary=compact_summary, event_codes=event_codes,
+        summarize=summarize, **setting)
+        for setting_supported, setting in zip(supported, settings)]
+
+
+def _batch_cases_psi(event_ids, samples, tensor, incompatible,
+                     incompatible_mask, isoform1_junctions,
+                     isoform2_junctions, supported, min_reads=MIN_READS,
+                     method='mean',
+                     uneven_coverage_multiplier=UNEVEN_COVERAGE_MULTIPLIER,
+                     compact_summary=False, event_codes=None, summarize=True):
+    """Find the rejection cases and Psi of a batch of events' reads
+
+    Parameters
+    ----------
+    event_ids, samples, isoform1_junctions, isoform2_junctions
+        See ``_batch_psi``
+    tensor : numpy.ndarray
+        (n_events, n_samples, n_junctions) reads of the isoform1 junctions
+        followed by the isoform2 junctions of each event
+    incompatible : numpy.ndarray
+        (n_events, n_samples, max_incompatible) reads of the incompatible
+        junctions of each event
+    incompatible_mask : numpy.ndarray
+        (n_events, max_incompatible) boolean array which is False for padding
+    supported : numpy.ndarray
+        (n_events, n_samples) boolean array of which samples need the full
+        rejection cases for each event
+    min_reads, method, uneven_coverage_multiplier, compact_summary,
+    event_codes, summarize
+        See ``_batch_psi``
+
+    Returns
+    -------
+    psi, summary
+        See ``_batch_psi``
+    """
+    n_junctions1 = len(isoform1_junctions)
+    n_events = len(event_ids)
+    n_samples = len(samples)
+
+    isoform1 = tensor[..., :n_junctions1]
+    isoform2 = tensor[..., n_junctions1:]
+    mask = np.broadcast_to(incompatible_mask[:, np.newaxis, :],
+                           incompatible.shape)
+
+    cases = np.full((n_events, n_samples), CASE_ZERO_READS, dtype=int)
+    cases[supported] = _vectorized_maybe_reject(
+        isoform1[supported], isoform2[supported], incompatible[supported],
+        incompatible_mask=mask[supported], min_reads=min_reads,
+        uneven_coverage_multiplier=uneven_coverage_multiplier)
+    psi = _vectorized_psi(isoform1, isoform2, cases, method)
+    if not summarize:
+        return psi.T.astype(PSI_DTYPE), None
+    notes = _case_notes(min_reads, uneven_coverage_multiplier)[cases]
+
+    # Which of the (event, sample) pairs to keep in the summary
+    keep = supported.ravel() if compact_summary else slice(None)
+
+    summary_columns = _make_summary_columns(isoform1_junctions,
+                                            isoform2_junctions)
+    if event_codes is None:
+        data = {SAMPLE_ID: np.tile(samples, n_events)[keep],
+                EVENT_ID: np.repeat(event_ids, n_samples)[keep],
+                NOTES: notes.ravel()[keep]}
+    else:
+        data = {SAMPLE_ID: np.tile(np.arange(n_samples, dtype=np.int32),
+                                   n_events)[keep],
+                EVENT_ID: np.repeat(np.asarray(event_codes, dtype=np.int32),
+                                    n_samples)[keep],
+                NOTES: cases.astype(np.int8).ravel()[keep]}
+    data[PSI] = psi.ravel()[keep]
+    junction_columns = [x for x in summary_columns
+                        if x.startswith('isoform')]
+    for i, column in enumerate(junction_columns):
+        data[column] = tensor[..., i].ravel()[keep]
+    for i in range(incompatible.shape[-1]):
+        column = 'incompatible_junction{}'.format(i)
+        summary_columns.append(column)
+        if incompatible_mask[:, i].all():
+            data[column] = incompatible[..., i].ravel()[keep]
+        else:
+            data[column] = np.where(mask[..., i], incompatible[..., i],
+                                    np.nan).ravel()[keep]
+    return psi.T.astype(PSI_DTYPE), pd.DataFrame(data,
+                                                 columns=summary_columns)
+
+
+# Functions to calculate Psi of a single event, by name of the engine
+SINGLE_EVENT_ENGINES = {'pandas': _event_psi,
+                        'numpy': _event_psi_vectorized}
+ENGINES = 'pandas', 'numpy', 'batched'
+BATCH_SIZE = 1000
+
+# When parallelizing, split the events into this many chunks per processor
+CHUNKS_PER_PROCESSOR = 4
+
+
 def _maybe_parallelize_psi(
         event_annotation, reads2d, isoform1_junctions,
         isoform2_junctions, min_reads=MIN_READS, method='mean',
-        uneven_coverage_multiplier=UNEVEN_COVERAGE_MULTIPLIER, n_jobs=-1):
+        uneven_coverage_multiplier=UNEVEN_COVERAGE_MULTIPLIER, n_jobs=-1,
+        engine='pandas', batch_size=BATCH_SIZE, samples=None, junctions=None,
+        compact_summary=False, categorical_summary=False, psi=None,
+        summarize=True, settings=None):
     """If n_jobs!=1, run the parallelized version of psi
 
     Parameters
@@ -529,7 +1628,7 @@ def _maybe_parallelize_psi(
         A table of all possible events, with event ids as the index (row names)
         and all junctions described, and contains the columns described by
         ``isoform1_junctions`` and ``isoform_junctions``
-    reads2d : pandas.DataFrame
+    reads2d : pandas.DataFrame or scipy.sparse matrix
         A (n_samples, n_total_junctions) table of the number of reads found in
         all samples' exon-exon, all junctions. Very very large, e.g.
         1000 samples x 50,000 junctions = 50 million elements
@@ -554,59 +1653,414 @@ def _maybe_parallelize_psi(
     n_jobs : int, optional
         Number of subprocesses to create. Default is -1, which is to use as
         many processes/cores as possible
+    engine : "pandas" | "numpy" | "batched", optional
+        How to find the rejection cases of an event. "pandas" (default)
+        checks every sample one at a time, "numpy" checks all samples of
+        an event at once, and "batched" checks all samples of many events at
+        once. All give the same Psi and notes.
+    batch_size : int, optional
+        Number of events per batch with engine="batched" (default=1000)
+    samples, junctions : array-like, optional
+        Sample ids of the rows and junction ids of the columns of
+        ``reads2d``, if it is a sparse matrix
+    compact_summary : bool, optional
+        If True, leave out the samples with zero reads on all of an event's
+        junctions
+    categorical_summary : bool, optional
+        If True, the sample ids, event ids and notes of the summaries are
+        integer codes, for ``_decode_summary``
+    psi : numpy.ndarray, optional
+        (n_samples, n_events) array to write the Psi of each event into, with
+        the events in the order of ``_junction_positions``
+    summarize : bool, optional
+        If False, only calculate Psi and don't make any summaries
+    settings : list of dict, optional
+        If given, calculate Psi with each of these settings from
+        ``_psi_settings`` instead of ``min_reads``, ``method`` and
+        ``uneven_coverage_multiplier``, taking out the reads of each event
+        only once. Then ``psi`` is a list with an array for each setting
 
     Returns
     -------
-    summary : pandas.DataFrame
-        A (n_samples * n_events, 7) shaped table with the sample id, junction
-        reads, percent spliced-in (Psi), and notes on each event in each
-        sample, that explains why or why not Psi was calculated
+    summaries : list of pandas.DataFrame
+        Tables with the sample id, junction reads, percent spliced-in (Psi),
+        and notes on each event in each sample, that explains why or why not
+        Psi was calculated. When parallelized, each table holds a whole chunk
+        of events, with about the same amount of work in each chunk. Empty if
+        ``summarize=False``. If ``settings`` are given, this is a list of
+        summaries for each setting
     """
+    if settings is None:
+        summaries = _maybe_parallelize_psi(
+            event_annotation, reads2d, isoform1_junctions,
+            isoform2_junctions, n_jobs=n_jobs, engine=engine,
+            batch_size=batch_size, samples=samples, junctions=junctions,
+            compact_summary=compact_summary,
+            categorical_summary=categorical_summary, psi=[psi],
+            summarize=summarize, settings=[dict(
+                min_reads=min_reads, method=method,
+                uneven_coverage_multiplier=uneven_coverage_multiplier)])
+        return summaries[0]
+
+    if engine == 'batched':
+        return _maybe_parallelize_batched_psi(
+            event_annotation, reads2d, isoform1_junctions,
+            isoform2_junctions, n_jobs=n_jobs, batch_size=batch_size,
+            samples=samples, junctions=junctions,
+            compact_summary=compact_summary,
+            categorical_summary=categorical_summary, psi=psi,
+            summarize=summarize, settings=settings)
+
+    single_event_psi = SINGLE_EVENT_ENGINES[engine]
+
     # There are multiple rows with the same event id because the junctions
     # are the same, but the flanking exons may be a little wider or shorter,
     # but ultimately the event Psi is calculated only on the junctions so the
     # flanking exons don't matter for this. But, all the exons are in
     # exon\d.bed in the index! And you, the lovely user, can decide what you
     # want to do with them!
-    grouped = event_annotation.groupby(level=0, axis=0)
-
-    n_events = len(grouped.size())
+    reads, samples, junctions = _reads_matrix(reads2d, samples, junctions)
+    event_ids, positions, incompatible_positions, incompatible_mask = \
+        _junction_positions(event_annotation, junctions,
+                            isoform1_junctions, isoform2_junctions)
+    events = _event_tasks(event_ids, positions, incompatible_positions,
+                          incompatible_mask, junctions)
+
+    n_events = len(events)
+
+    # Most samples have no reads on most events, so find them all at once
+    # and skip them
+    n_junctions = len(isoform1_junctions) + len(isoform2_junctions)
+    event_columns = [columns for event_id, columns, junction_ids in events]
+    support, prunable = _event_support(reads, event_columns, n_junctions)
+    setting_rows = [_supported_rows(support, _prunable(
+        event_columns, n_junctions, setting['min_reads']))
+        for setting in settings]
+    # Samples to check for each event, for each setting
+    rows = list(zip(*setting_rows)) or [()] * n_events
+    event_codes = np.arange(n_events) if categorical_summary \
+        else [None] * n_events
 
     if n_jobs == 1:
         # Do a separate branch because joblib doesn't do a good job of
         # managing the python debugger so use --n-jobs=1 (n_jobs=1) when
         # debugging
         progress('\tIterating over {} events ...\n'.format(n_events))
-        summaries = []
-        for event_id, event_df in grouped:
-            summary = _single_event_psi(
-                event_id, event_df, reads2d,
-                isoform1_junctions, isoform2_junctions,
-                min_reads=min_reads,
-                uneven_coverage_multiplier=uneven_coverage_multiplier,
-                method=method)
-            summaries.append(summary)
+        results = [[] for setting in settings]
+        for (event_id, columns, junction_ids), event_rows, event_code in \
+                zip(events, rows, event_codes):
+            event_results = _sweep_event_psi(
+                single_event_psi, event_id, reads, samples, columns,
+                junction_ids, event_rows, isoform1_junctions,
+                isoform2_junctions, settings,
+                compact_summary=compact_summary, event_code=event_code,
+                summarize=summarize)
+            for setting_results, (event_psi, summary) in zip(
+                    results, event_results):
+                setting_results.append((event_psi[:, np.newaxis], summary))
+        chunks = [slice(i, i + 1) for i in range(n_events)]
     else:
         processors = n_jobs if n_jobs > 0 else joblib.cpu_count()
-        progress("\tParallelizing {} events' Psi calculation across {} "
-                 "CPUs ...\n".format(n_events, processors))
-        summaries = joblib.Parallel(n_jobs=n_jobs)(
-            joblib.delayed(_single_event_psi)(
-                event_id, event_df, reads2d,
-                isoform1_junctions, isoform2_junctions,
-                min_reads=min_reads,
-                uneven_coverage_multiplier=uneven_coverage_multiplier,
-                method=method)
-            for event_id, event_df in grouped)
+        # Send many events to each worker at once, so that the time isn't
+        # all spent on dispatching tiny tasks and collecting their results
+        costs = sum(_event_costs(events, x) for x in setting_rows)
+        chunks = _balanced_chunks(costs, processors * CHUNKS_PER_PROCESSOR)
+        progress("\tParallelizing {} events' Psi calculation in {} chunks "
+                 "across {} CPUs ...\n".format(n_events, len(chunks),
+                                               processors))
+        with _shared_reads(reads) as shared:
+            chunk_results = joblib.Parallel(n_jobs=n_jobs)(
+                joblib.delayed(_chunk_psi)(
+                    events[chunk], rows[chunk], event_codes[chunk], shared,
+                    samples, isoform1_junctions, isoform2_junctions,
+                    settings, engine=engine,
+                    compact_summary=compact_summary, summarize=summarize)
+                for chunk in chunks)
+        results = [list(x) for x in zip(*chunk_results)] \
+            or [[] for setting in settings]
+
+    return [_collect_psi(setting_results, chunks, setting_psi)
+            for setting_results, setting_psi in zip(results, psi)]
+
+
+def _collect_psi(results, chunks, psi=None):
+    """Write the Psi of each chunk of events into one array
+
+    Parameters
+    ----------
+    results : list of tuples
+        (n_samples, n_chunk_events) Psi array and summary (or None) of each
+        chunk of events
+    chunks : list of slice
+        Positions of the events of each chunk
+    psi : numpy.ndarray, optional
+        (n_samples, n_events) array to write the Psi into. If None, the Psi
+        is only dropped
 
+    Returns
+    -------
+    summaries : list of pandas.DataFrame
+        Summary of each chunk, leaving out the missing ones
+    """
+    summaries = []
+    for (chunk_psi, summary), chunk in zip(results, chunks):
+        if psi is not None:
+            psi[:, chunk] = chunk_psi
+        if summary is not None:
+            summaries.append(summary)
     return summaries
 
 
+def _event_costs(events, rows):
+    """Estimate how long each event will take to calculate Psi on
+
+    The cost of an event grows with its number of junctions and the number
+    of samples with reads on them.
+
+    Parameters
+    ----------
+    events : list of tuples
+        Output of ``_event_tasks``
+    rows : list of numpy.ndarray
+        Output of ``_supported_rows``
+
+    Returns
+    -------
+    costs : numpy.ndarray
+        (n_events,) estimated cost of each event
+    """
+    costs = [len(columns) * (1 + len(event_rows))
+             for (event_id, columns, junction_ids), event_rows
+             in zip(events, rows)]
+    return np.array(costs, dtype=float)
+
+
+def _balanced_chunks(costs, n_chunks):
+    """Split consecutive events into chunks of about the same total cost
+
+    Events stay in the same order, so that concatenating the chunks' results
+    gives the same table as concatenating every event's result.
+
+    Parameters
+    ----------
+    costs : numpy.ndarray
+        (n_events,) estimated cost of each event
+    n_chunks : int
+        Maximum number of chunks to make
+
+    Returns
+    -------
+    chunks : list of slice
+        Positions of the events in each chunk
+    """
+    n_events = len(costs)
+    if n_events == 0:
+        return []
+    cumulative = np.cumsum(costs)
+    targets = cumulative[-1] * np.arange(1, n_chunks) / float(n_chunks)
+    stops = np.searchsorted(cumulative, targets) + 1
+    stops = np.unique(np.concatenate([stops[stops < n_events], [n_events]]))
+    starts = np.concatenate([[0], stops[:-1]])
+    return [slice(start, stop) for start, stop in zip(starts, stops)]
+
+
+def _chunk_psi(events, rows, event_codes, reads, samples, isoform1_junctions,
+               isoform2_junctions, settings, engine='pandas',
+               compact_summary=False, summarize=True):
+    """Calculate Psi on a chunk of events and combine their summaries
+
+    Parameters
+    ----------
+    events : list of tuples
+        Output of ``_event_tasks`` for the events in this chunk
+    rows : list of tuples
+        Output of ``_supported_rows`` of each setting, for each event in
+        this chunk
+    event_codes : list
+        Integer codes of the events in this chunk for an encoded summary
+        (see ``_encode_summary``), or None to keep the strings
+    reads, samples
+        See ``_event_psi``
+    isoform1_junctions, isoform2_junctions, settings, engine,
+    compact_summary, summarize
+        See ``_maybe_parallelize_psi``
+
+    Returns
+    -------
+    results : list of tuples
+        For each setting, the (n_samples, n_events) percent spliced-in of
+        the events in the chunk, and the summaries of all events in the
+        chunk (or None), in the same order as ``events``
+    """
+    single_event_psi = SINGLE_EVENT_ENGINES[engine]
+    event_results = [_sweep_event_psi(
+        single_event_psi, event_id, reads, samples, columns, junction_ids,
+        event_rows, isoform1_junctions, isoform2_junctions, settings,
+        compact_summary=compact_summary, event_code=event_code,
+        summarize=summarize)
+        for (event_id, columns, junction_ids), event_rows, event_code
+        in zip(events, rows, event_codes)]
+
+    results = []
+    for setting_results in zip(*event_results):
+        psi = np.column_stack([event_psi for event_psi, summary
+                               in setting_results])
+        if not summarize:
+            results.append((psi, None))
+            continue
+        results.append((psi, pd.concat(
+            [summary for event_psi, summary in setting_results],
+            ignore_index=True)))
+    return results
+
+
+@contextlib.contextmanager
+def _shared_reads(reads):
+    """Put the reads matrix in a memory-mapped file for all workers to share
+
+    Joblib sends a memory-mapped array to workers as only its filename, so
+    the matrix is written once and every worker reads the same pages
+    instead of getting its own copy. The file is made in the system's
+    temporary folder, which can be changed with the TMPDIR environment
+    variable, and deleted afterwards.
+
+    Parameters
+    ----------
+    reads : numpy.ndarray or scipy.sparse matrix
+        A (n_samples, n_total_junctions) array of the number of reads found in
+        all samples' exon-exon, all junctions
+
+    Yields
+    ------
+    shared : numpy.memmap or scipy.sparse matrix
+        Read-only memory map of ``reads``. For a sparse matrix, its data and
+        indices arrays are memory-mapped
+    """
+    if not sparse.issparse(reads):
+        reads = np.ascontiguousarray(reads)
+    folder = tempfile.mkdtemp(prefix='outrigger_psi_')
+    try:
+        filename = os.path.join(folder, 'reads.mmap')
+        joblib.dump(reads, filename)
+        yield joblib.load(filename, mmap_mode='r')
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def _batch_supported(support, prunable, batch):
+    """Get which samples need the full rejection cases for a batch of events
+
+    Parameters
+    ----------
+    support, prunable
+        Output of ``_event_support``
+    batch : slice
+        Positions of the events in the batch
+
+    Returns
+    -------
+    supported : numpy.ndarray
+        (n_events, n_samples) boolean array, for ``_batch_psi``
+    """
+    supported = support[:, batch].toarray().T > 0
+    supported[~prunable[batch]] = True
+    return supported
+
+
+def _maybe_parallelize_batched_psi(
+        event_annotation, reads2d, isoform1_junctions,
+        isoform2_junctions, min_reads=MIN_READS, method='mean',
+        uneven_coverage_multiplier=UNEVEN_COVERAGE_MULTIPLIER, n_jobs=-1,
+        batch_size=BATCH_SIZE, samples=None, junctions=None,
+        compact_summary=False, categorical_summary=False, psi=None,
+        summarize=True, settings=None):
+    """Calculate psi on batches of events, in parallel if n_jobs!=1
+
+    Parameters are the same as ``_maybe_parallelize_psi``
+
+    Returns
+    -------
+    summaries : list of pandas.DataFrame
+        Summary of each batch of events, or a list of them for each setting
+        if ``settings`` are given
+    """
+    if settings is None:
+        summaries = _maybe_parallelize_batched_psi(
+            event_annotation, reads2d, isoform1_junctions,
+            isoform2_junctions, n_jobs=n_jobs, batch_size=batch_size,
+            samples=samples, junctions=junctions,
+            compact_summary=compact_summary,
+            categorical_summary=categorical_summary, psi=[psi],
+            summarize=summarize, settings=[dict(
+                min_reads=min_reads, method=method,
+                uneven_coverage_multiplier=uneven_coverage_multiplier)])
+        return summaries[0]
+
+    reads, samples, junctions = _reads_matrix(reads2d, samples, junctions)
+    samples = samples.values
+    event_ids, positions, incompatible_positions, incompatible_mask = \
+        _junction_positions(event_annotation, junctions,
+                            isoform1_junctions, isoform2_junctions)
+
+    n_events = len(event_ids)
+    event_codes = np.arange(n_events)
+    batches = [slice(start, start + batch_size)
+               for start in range(0, n_events, batch_size)]
+
+    # Most samples have no reads on most events, so find them all at once
+    # and skip them
+    event_columns = [np.concatenate([x, y[m]]) for x, y, m in
+                     zip(positions, incompatible_positions, incompatible_mask)]
+    support, prunable = _event_support(reads, event_columns,
+                                       positions.shape[1])
+    prunables = [_prunable(event_columns, positions.shape[1],
+                           setting['min_reads']) for setting in settings]
+
+    if n_jobs == 1:
+        progress('\tIterating over {} events in {} batches ...\n'.format(
+            n_events, len(batches)))
+        batch_results = []
+        for batch in batches:
+            batch_results.append(_batch_psi(
+                event_ids[batch], positions[batch],
+                incompatible_positions[batch], incompatible_mask[batch],
+                reads, samples, isoform1_junctions, isoform2_junctions,
+                supported=[_batch_supported(support, x, batch)
+                           for x in prunables],
+                compact_summary=compact_summary,
+                event_codes=event_codes[batch] if categorical_summary
+                else None, summarize=summarize, settings=settings))
+    else:
+        processors = n_jobs if n_jobs > 0 else joblib.cpu_count()
+        progress("\tParallelizing {} events' Psi calculation in {} batches "
+                 "across {} CPUs ...\n".format(n_events, len(batches),
+                                               processors))
+        with _shared_reads(reads) as shared:
+            batch_results = joblib.Parallel(n_jobs=n_jobs)(
+                joblib.delayed(_batch_psi)(
+                    event_ids[batch], positions[batch],
+                    incompatible_positions[batch], incompatible_mask[batch],
+                    shared, samples, isoform1_junctions, isoform2_junctions,
+                    supported=[_batch_supported(support, x, batch)
+                               for x in prunables],
+                    compact_summary=compact_summary,
+                    event_codes=event_codes[batch] if categorical_summary
+                    else None, summarize=summarize, settings=settings)
+                for batch in batches)
+
+    results = [list(x) for x in zip(*batch_results)] \
+        or [[] for setting in settings]
+    return [_collect_psi(setting_results, batches, setting_psi)
+            for setting_results, setting_psi in zip(results, psi)]
+
+
 def calculate_psi(event_annotation, reads2d,
                   isoform1_junctions, isoform2_junctions,
                   min_reads=MIN_READS, method='mean',
                   uneven_coverage_multiplier=UNEVEN_COVERAGE_MULTIPLIER,
-                  n_jobs=-1):
+                  n_jobs=-1, engine='pandas', batch_size=BATCH_SIZE,
+                  samples=None, junctions=None, compact_summary=False,
+                  categorical_summary=False, summarize=True):
     """Compute percent-spliced-in of events based on junction reads
 
     Parameters
@@ -615,11 +2069,14 @@ def calculate_psi(event_annotation, reads2d,
         A table where each row represents a single splicing event. The required
        columns are the ones specified in `isoform1_junctions`,
         `isoform2_junctions`, and `event_col`.
-    reads2d : pandas.DataFrame
+    reads2d : pandas.DataFrame or scipy.sparse matrix
         A (n_samples, n_total_junctions) table of the number of reads found in
         all samples' exon-exon, all junctions. Very very large, e.g.
         1000 samples x 50,000 junctions = 50 million elements
         number of reads observed at a splice junction of a particular sample.
+        Most junctions have no reads in most samples, especially in single
+        cells, so a sparse matrix can take much less memory. Then, only the
+        columns of each event are made dense.
     isoform1_junctions : list
         Columns in `event_annotation` which represent junctions that
         correspond to isoform1, the Psi=0 isoform, e.g. ['junction13'] for SE
@@ -645,21 +2102,390 @@ def calculate_psi(event_annotation, reads2d,
     n_jobs : int, optional
         Number of subprocesses to create. Default is -1, which is to use as
         many processes/cores as possible
+    engine : "pandas" | "numpy" | "batched", optional
+        How to find the rejection cases of an event. "pandas" (default)
+        checks every sample one at a time, and "numpy" checks all samples of
+        an event at once, which is much faster when there are many samples.
+        "batched" stacks the reads of ``batch_size`` events into one
+        (n_events, n_samples, n_junctions) array and checks them all at once.
+        All give the same Psi and notes.
+    batch_size : int, optional
+        Number of events per batch with engine="batched". Each batch uses
+        memory for batch_size * n_samples * n_junctions read counts.
+        (default=1000)
+    samples : array-like, optional
+        (n_samples,) sample ids of the rows of ``reads2d``. Required if
+        ``reads2d`` is a sparse matrix
+    junctions : array-like, optional
+        (n_total_junctions,) junction ids of the columns of ``reads2d``.
+        Required if ``reads2d`` is a sparse matrix
+    compact_summary : bool, optional
+        If True, leave the samples with zero reads on all of an event's
+        junctions (including incompatible junctions) out of the summary, and
+        only count them for each event, in the ``zero_reads`` of the
+        returned ``CompactSummary``. Most samples are like this in single
+        cell data, so this makes the summary much smaller. The Psi of these
+        samples is NaN, as usual. (default=False)
+    categorical_summary : bool, optional
+        If True, the sample id, event id and notes columns of the summary are
+        pandas Categoricals instead of strings. They are kept as integers
+        while Psi is calculated, which takes much less memory, and look the
+        same when written to a file. (default=False)
+    summarize : bool, optional
+        If False, only calculate Psi and return None instead of the summary,
+        which saves the time and memory of making it. (default=True)
 
     Returns
     -------
     psi : pandas.DataFrame
-        An (samples, events) dataframe of the percent spliced-in values
-    summary : pandas.DataFrame
+        An (samples, events) dataframe of the percent spliced-in values, as
+        single precision floats. The samples and events are sorted.
+    summary : pandas.DataFrame, CompactSummary or None
         A (n_samples * n_events, 7) shaped table with the sample id, junction
         reads, percent spliced-in (Psi), and notes on each event in each
-        sample, that explains why or why not Psi was calculated
+        sample, that explains why or why not Psi was calculated. With
+        ``compact_summary=True``, a ``CompactSummary``
+
+    Raises
+    ------
+    ValueError
+        If any of ``min_reads``, ``method`` or ``uneven_coverage_multiplier``
+        is a list. Use ``calculate_psi_sweep`` for several settings
     """
+    if any(isinstance(x, (list, tuple)) for x in
+           (min_reads, method, uneven_coverage_multiplier)):
+        raise ValueError(
+            "Psi can only be calculated with one min_reads, method and "
+            "uneven_coverage_multiplier at a time. To calculate it with "
+            "several, use calculate_psi_sweep")
+    return _calculate_psi_settings(
+        event_annotation, reads2d, isoform1_junctions, isoform2_junctions,
+        _psi_settings(min_reads, method, uneven_coverage_multiplier),
+        n_jobs=n_jobs, engine=engine, batch_size=batch_size, samples=samples,
+        junctions=junctions, compact_summary=compact_summary,
+        categorical_summary=categorical_summary, summarize=summarize)[0]
+
+
+def calculate_psi_sweep(event_annotation, reads2d,
+                        isoform1_junctions, isoform2_junctions,
+                        min_reads=MIN_READS, method='mean',
+                        uneven_coverage_multiplier=UNEVEN_COVERAGE_MULTIPLIER,
+                        **kwargs):
+    """Compute percent-spliced-in with several thresholds and methods
+
+    The junction reads of each event are only taken out once for all
+    combinations of the settings, which is much faster than calling
+    ``calculate_psi`` once per combination.
+
+    Parameters
+    ----------
+    event_annotation, reads2d, isoform1_junctions, isoform2_junctions
+        See ``calculate_psi``
+    min_reads : int or list of int, optional
+        Minimum numbers of reads for a junction to be viable
+    method : "mean" | "min" or list of them, optional
+        Methods to aggregate junctions from the same isoform
+    uneven_coverage_multiplier : int or list of int, optional
+        Scale factors for the maximum amount bigger one side of a junction
+        can be before rejecting the event
+    kwargs
+        Other keyword arguments to ``calculate_psi``
+
+    Returns
+    -------
+    results : dict
+        ``(psi, summary)`` as from ``calculate_psi``, for every combination
+        of the settings, keyed by ``(min_reads, method,
+        uneven_coverage_multiplier)``
+    """
+    settings = _psi_settings(min_reads, method, uneven_coverage_multiplier)
+    results = _calculate_psi_settings(
+        event_annotation, reads2d, isoform1_junctions, isoform2_junctions,
+        settings, **kwargs)
+    return dict(((setting['min_reads'], setting['method'],
+                  setting['uneven_coverage_multiplier']), setting_results)
+                for setting, setting_results in zip(settings, results))
+
+
+def _calculate_psi_settings(event_annotation, reads2d, isoform1_junctions,
+                            isoform2_junctions, settings, n_jobs=-1,
+                            engine='pandas', batch_size=BATCH_SIZE,
+                            samples=None, junctions=None,
+                            compact_summary=False, categorical_summary=False,
+                            summarize=True):
+    """Compute percent-spliced-in with each of ``_psi_settings``
+
+    Returns
+    -------
+    results : list of tuple
+        ``(psi, summary)`` of each setting, as from ``calculate_psi``
+    """
+    reads2d, samples, junctions = _reads_matrix(reads2d, samples, junctions)
+    event_ids = _junction_positions(event_annotation, junctions,
+                                    isoform1_junctions, isoform2_junctions)[0]
+
+    # Each event's Psi goes straight into its column, instead of pivoting
+    # the summary, which is the biggest table of all
+    values = [np.full((len(samples), len(event_ids)), np.nan,
+                      dtype=PSI_DTYPE) for setting in settings]
     summaries = _maybe_parallelize_psi(event_annotation, reads2d,
                                        isoform1_junctions, isoform2_junctions,
-                                       min_reads, method,
-                                       uneven_coverage_multiplier, n_jobs)
+                                       n_jobs=n_jobs, engine=engine,
+                                       batch_size=batch_size, samples=samples,
+                                       junctions=junctions,
+                                       compact_summary=compact_summary,
+                                       categorical_summary=categorical_summary,
+                                       psi=values, summarize=summarize,
+                                       settings=settings)
+    return [_psi_results(
+        setting_values, setting_summaries, samples, event_ids,
+        min_reads=setting['min_reads'],
+        uneven_coverage_multiplier=setting['uneven_coverage_multiplier'],
+        compact_summary=compact_summary,
+        categorical_summary=categorical_summary, summarize=summarize)
+        for setting_values, setting_summaries, setting
+        in zip(values, summaries, settings)]
+
+
+def _psi_results(values, summaries, samples, event_ids, min_reads=MIN_READS,
+                 uneven_coverage_multiplier=UNEVEN_COVERAGE_MULTIPLIER,
+                 compact_summary=False, categorical_summary=False,
+                 summarize=True):
+    """Make the outputs of ``calculate_psi`` for one setting
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        (n_samples, n_events) percent spliced-in of each event
+    summaries : list of pandas.DataFrame
+        Output of ``_maybe_parallelize_psi``
+    samples : pandas.Index
+        Sample ids of the rows of ``values``
+    event_ids : numpy.ndarray
+        Event ids of the columns of ``values``
+    min_reads, uneven_coverage_multiplier, compact_summary,
+    categorical_summary, summarize
+        See ``calculate_psi``
+
+    Returns
+    -------
+    psi, summary
+        See ``calculate_psi``
+    """
+    psi = pd.DataFrame(values, index=samples,
+                       columns=pd.Index(event_ids, name=EVENT_ID))
+    psi.index.name = SAMPLE_ID
+    if not psi.index.is_monotonic_increasing:
+        psi = psi.sort_index()
+
+    if not summarize:
+        return psi, None
+
     summary = pd.concat(summaries, ignore_index=True)
+    if categorical_summary:
+        summary = _decode_summary(summary, samples, event_ids,
+                                  min_reads, uneven_coverage_multiplier)
+    if not compact_summary:
+        return psi, summary
 
-    psi = summary.pivot(index=SAMPLE_ID, columns=EVENT_ID, values=PSI)
-    return psi, summary
+    n_summarized = summary.groupby(EVENT_ID).size()
+    zero_reads = len(samples) - n_summarized.reindex(event_ids, fill_value=0)
+    return psi, CompactSummary.from_summary(summary, zero_reads)
+
+
+class CompactSummary(pd.DataFrame):
+    """Summary of Psi without the samples with zero reads on an event
+
+    The same table as the full summary, except for the samples with zero
+    reads on all of an event's junctions, which are only counted in
+    ``zero_reads``: a Series of the number of samples left out of each
+    event, named ``ZERO_READS_SAMPLES`` and indexed by event id.
+    """
+    _metadata = ['zero_reads']
+    zero_reads = None
+
+    @property
+    def _constructor(self):
+        return CompactSummary
+
+    @classmethod
+    def from_summary(cls, summary, zero_reads):
+        """Make a compact summary from a table and the zero read counts"""
+        compact = cls(summary)
+        zero_reads = zero_reads.copy()
+        zero_reads.index.name = EVENT_ID
+        zero_reads.name = ZERO_READS_SAMPLES
+        compact.zero_reads = zero_reads
+        return compact
+
+
+def concat_summaries(summaries):
+    """Concatenate summaries, keeping their categorical columns categorical
+
+    Parameters
+    ----------
+    summaries : list of pandas.DataFrame
+        Summaries from ``calculate_psi``, e.g. of different splice types
+
+    Returns
+    -------
+    summary : pandas.DataFrame or CompactSummary
+        All summaries in one table. Categorical columns have all the
+        categories of every summary, instead of becoming strings. If they
+        are all compact, so is this, with the zero reads of all of them
+    """
+    summaries = [summary.copy() for summary in summaries]
+    columns = set(column for summary in summaries
+                  for column in summary.columns
+                  if pd.api.types.is_categorical_dtype(summary[column]))
+    for column in columns:
+        categories = pd.api.types.union_categoricals(
+            [summary[column] for summary in summaries
+             if column in summary], ignore_order=True).categories
+        for summary in summaries:
+            if column in summary:
+                summary[column] = summary[column].cat.set_categories(
+                    categories)
+    summary = pd.DataFrame(pd.concat(summaries, ignore_index=True))
+    if summaries and all(isinstance(x, CompactSummary) for x in summaries):
+        summary = CompactSummary.from_summary(summary, pd.concat(
+            [x.zero_reads for x in summaries]))
+    return summary
+
+
+def _group_members(samples, groups):
+    """Find the rows of the samples of each group
+
+    Parameters
+    ----------
+    samples : pandas.Index
+        Sample ids of the rows of a junction reads matrix
+    groups : pandas.Series
+        Group of each sample, indexed by sample id. A sample can be in
+        several groups, and samples which aren't in ``samples`` are ignored
+
+    Returns
+    -------
+    members : numpy.ndarray
+        Row positions of the samples in every group, sorted by group
+    sizes : numpy.ndarray
+        (n_groups,) number of samples in each group
+    names : numpy.ndarray
+        Sorted names of the groups with any samples
+
+    Raises
+    ------
+    ValueError
+        If none of the samples are in a group
+    """
+    groups = pd.Series(groups)
+    rows = samples.get_indexer(groups.index)
+    found = rows >= 0
+    if not found.any():
+        raise ValueError('None of the samples of the junction reads are in '
+                         'any of the groups')
+    codes, names = pd.factorize(groups.values[found], sort=True)
+    order = np.argsort(codes, kind='mergesort')
+    return rows[found][order], np.bincount(codes), np.asarray(names)
+
+
+def _bootstrap_indicator(members, sizes, n_samples, n_bootstraps,
+                         random_state=None):
+    """Resample the samples of every group, with replacement
+
+    Parameters
+    ----------
+    members, sizes
+        Output of ``_group_members``
+    n_samples : int
+        Total number of samples
+    n_bootstraps : int
+        Number of times to resample each group
+    random_state : int or numpy.random.RandomState, optional
+        Seed or random number generator of the resampling
+
+    Returns
+    -------
+    indicator : scipy.sparse.csr_matrix
+        (n_groups * n_bootstraps, n_samples) number of times each sample was
+        drawn in each bootstrap, with the bootstraps of each group together
+    """
+    if not isinstance(random_state, np.random.RandomState):
+        random_state = np.random.RandomState(random_state)
+    starts = np.cumsum(sizes) - sizes
+
+    # Each bootstrap draws as many samples as its group has, all at once
+    n_draws = np.repeat(sizes, n_bootstraps)
+    bootstraps = np.repeat(np.arange(len(n_draws)), n_draws)
+    draw_groups = bootstraps // n_bootstraps
+    drawn = members[starts[draw_groups]
+                    + random_state.randint(0, sizes[draw_groups])]
+    # Samples drawn several times are added up
+    return sparse.coo_matrix(
+        (np.ones(len(drawn), dtype=int), (bootstraps, drawn)),
+        shape=(len(n_draws), n_samples)).tocsr()
+
+
+def group_junction_reads(reads2d, groups, samples=None, junctions=None,
+                         n_bootstraps=0, random_state=None):
+    """Add up the junction reads of the samples in each group
+
+    Calculating Psi on groups, e.g. the clusters of a single-cell dataset,
+    is much faster than calculating it on every sample and then combining
+    them. The groups' reads are found with one sparse matrix product, and
+    so are the reads of every bootstrap of every group.
+
+    Parameters
+    ----------
+    reads2d : pandas.DataFrame, numpy.ndarray or scipy.sparse matrix
+        A (n_samples, n_total_junctions) table of the number of reads found in
+        all samples' exon-exon, all junctions
+    groups : pandas.Series
+        Group of each sample, indexed by sample id. A sample can be in
+        several groups, and samples which aren't in any group are left out
+    samples, junctions : array-like, optional
+        See ``calculate_psi``
+    n_bootstraps : int, optional
+        If given, also resample the samples of each group with replacement
+        this many times, and add up the reads of each resampling
+    random_state : int or numpy.random.RandomState, optional
+        Seed or random number generator of the bootstraps
+
+    Returns
+    -------
+    group_reads : numpy.ndarray or scipy.sparse.csc_matrix
+        A (n_groups + n_groups * n_bootstraps, n_total_junctions) matrix of
+        the reads of each group, followed by the bootstraps of each group
+    group_ids : pandas.Index
+        Sorted names of the groups, followed by "<group>_bootstrap<i>" for
+        the bootstraps, with the same name as ``samples``
+    junctions : pandas.Index
+        Junction ids of the columns of ``group_reads``
+
+    Raises
+    ------
+    ValueError
+        If none of the samples are in a group
+    """
+    reads, samples, junctions = _reads_matrix(reads2d, samples, junctions)
+    members, sizes, names = _group_members(samples, groups)
+
+    # (n_groups, n_samples) matrix of which samples are in each group
+    indicator = sparse.csr_matrix(
+        (np.ones(len(members), dtype=int), members,
+         np.concatenate([[0], np.cumsum(sizes)])),
+        shape=(len(names), len(samples)))
+    group_ids = list(names)
+    if n_bootstraps > 0:
+        indicator = sparse.vstack([indicator, _bootstrap_indicator(
+            members, sizes, len(samples), n_bootstraps, random_state)])
+        group_ids.extend('{}_bootstrap{}'.format(name, i + 1)
+                         for name in names for i in range(n_bootstraps))
+
+    group_reads = indicator.dot(reads)
+    if sparse.issparse(group_reads):
+        group_reads = sparse.csc_matrix(group_reads)
+    if group_reads.dtype.kind in 'ui':
+        # The sums are 64-bit integers, so they can't have overflowed
+        group_reads = compact_counts(group_reads)
+    return group_reads, pd.Index(group_ids, name=samples.name), junctions
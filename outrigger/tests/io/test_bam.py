@@ -2,6 +2,7 @@ import collections
 import glob
 import os
 
+import numpy as np
 import pandas as pd
 import pandas.util.testing as pdt
 import pysam
@@ -115,24 +116,99 @@ def test__report_read_positions(bamfile):
     pdt.assert_dict_equal(test, true)
 
 
-def test__choose_strand_and_sum(uniquely, uniquely_summed_csv):
-    from outrigger.io.bam import UNIQUE_READS, _choose_strand_and_sum
+def test__cigar_junctions():
+    from outrigger.io.bam import _cigar_junctions
 
-    uniquely_s = pd.Series(uniquely, name=UNIQUE_READS)
+    # 10M50N10M, and 5S10M1D5M20N2D10M where the deletion next to the intron
+    # is part of the junction
+    reference_starts = np.array([100, 500])
+    n_operations = np.array([3, 7])
+    cigars = np.array([(0, 10), (3, 50), (0, 10),
+                       (4, 5), (0, 10), (2, 1), (0, 5), (3, 20), (2, 2),
+                       (0, 10)])
 
-    test = _choose_strand_and_sum(uniquely_s)
+    reads, starts, stops = _cigar_junctions(reference_starts, n_operations,
+                                            cigars)
+    assert reads.tolist() == [0, 1, 1]
+    assert starts.tolist() == [111, 511, 517]
+    assert stops.tolist() == [160, 511, 538]
+
+
+def test__count_junctions(bamfile, uniquely, multi):
+    from outrigger.io.bam import JunctionCounts, _count_junctions
+
+    # Finding the junctions a few reads at a time gives the same counts
+    bam = pysam.AlignmentFile(bamfile, 'rb')
+    counts = JunctionCounts(bam.references)
+    _count_junctions(bam.fetch(), counts, batch_size=7)
+    bam.close()
+    test_uniquely, test_multi = counts.to_dicts()
+
+    pdt.assert_dict_equal(test_uniquely, uniquely)
+    pdt.assert_dict_equal(test_multi, multi)
+
+
+def test_junction_counts(uniquely, multi):
+    from outrigger.io.bam import JunctionCounts
+
+    counts = JunctionCounts.from_dicts(uniquely, multi)
+    assert counts.start.dtype == np.int32
+
+    # Adding the same reads again doubles them, on the same junctions
+    n_junctions = len(counts)
+    counts.update(JunctionCounts.from_dicts(uniquely, multi))
+    assert len(counts) == n_junctions
+
+    test_uniquely, test_multi = counts.to_dicts()
+    pdt.assert_dict_equal(test_uniquely, dict(
+        (key, 2 * value) for key, value in uniquely.items()))
+    pdt.assert_dict_equal(test_multi, dict(
+        (key, 2 * value) for key, value in multi.items()))
+
+
+def test__majority_strand(uniquely, uniquely_summed_csv):
+    from outrigger.io.bam import JunctionCounts, _majority_strand
+
+    counts = JunctionCounts.from_dicts(uniquely, {})
+
+    chrom, start, stop, reverse, reads = _majority_strand(
+        counts.chrom, counts.start, counts.stop, counts.reverse,
+        counts.uniquely)
+    index = pd.MultiIndex.from_arrays(
+        [np.array(counts.references)[chrom], start.astype(np.int64),
+         stop.astype(np.int64), np.where(reverse, '-', '+')])
+    test = pd.Series(reads, index=index)
     true = read_intermediate_junctions(uniquely_summed_csv)
 
     # Have to adjust the column and level names from what gets auto-created
     # upon pandas reading
     true.index.names = test.index.names
     true.name = test.name
-    pdt.assert_series_equal(test, true)
+    pdt.assert_series_equal(test, true, check_dtype=False)
+
+
+@pytest.mark.parametrize('first', ['+', '-'])
+def test__majority_strand_tie(first):
+    from outrigger.io.bam import JunctionCounts, _majority_strand
+
+    # The same number of reads on both strands goes to the plus strand, no
+    # matter which strand's reads were seen first
+    second = '-' if first == '+' else '+'
+    multi = collections.OrderedDict([(('chr1', 100, 200, first), 3),
+                                     (('chr1', 100, 200, second), 3)])
+    counts = JunctionCounts.from_dicts({}, multi)
+
+    chrom, start, stop, reverse, reads = _majority_strand(
+        counts.chrom, counts.start, counts.stop, counts.reverse,
+        counts.multi)
+    assert start.tolist() == [100]
+    assert reverse.tolist() == [False]
+    assert reads.tolist() == [6]
 
 
 def test__combine_uniquely_multi(uniquely, multi, ignore_multimapping, empty,
                                  single_bam_combined_uniquely_multi_csv):
-    from outrigger.io.bam import _combine_uniquely_multi
+    from outrigger.io.bam import JunctionCounts, _combine_uniquely_multi
 
     u = uniquely
     m = multi
@@ -141,16 +217,21 @@ def test__combine_uniquely_multi(uniquely, multi, ignore_multimapping, empty,
     elif empty == 'multi':
         m = {}
 
-    test = _combine_uniquely_multi(u, m, ignore_multimapping)
+    test = _combine_uniquely_multi(JunctionCounts.from_dicts(u, m),
+                                   ignore_multimapping)
     true = pd.read_csv(single_bam_combined_uniquely_multi_csv)
 
-    pdt.assert_frame_equal(test, true)
+    # The counts are kept in the smallest unsigned integer type
+    for column in ('unique_junction_reads', 'multimap_junction_reads',
+                   'reads'):
+        assert test[column].dtype == np.uint16
+    pdt.assert_frame_equal(test, true, check_dtype=False)
 
 
 def test__get_junction_reads(bamfile, uniquely, multi):
     from outrigger.io.bam import _get_junction_reads
 
-    test_uniquely, test_multi = _get_junction_reads(bamfile)
+    test_uniquely, test_multi = _get_junction_reads(bamfile).to_dicts()
 
     true_uniquely = uniquely
     true_multi = multi
@@ -159,6 +240,34 @@ def test__get_junction_reads(bamfile, uniquely, multi):
     pdt.assert_dict_equal(test_multi, true_multi)
 
 
+def test__bam_shards(bamfile):
+    from outrigger.io.bam import _bam_shards
+
+    shards = _bam_shards(bamfile, shard_length=1000000)
+
+    bam = pysam.AlignmentFile(bamfile, 'rb')
+    lengths = dict(zip(bam.references, bam.lengths))
+    bam.close()
+    for contig, start, stop in shards:
+        assert start % 1000000 == 0
+        assert stop == min(start + 1000000, lengths[contig])
+    assert 'chr2' in set(contig for contig, start, stop in shards)
+
+
+def test__get_junction_reads_shards(bamfile, uniquely, multi):
+    from outrigger.io.bam import _bam_shards, _get_junction_reads
+
+    # Reads crossing the edges of the regions are only counted once
+    shards = _bam_shards(bamfile, shard_length=10000)
+    counts = _get_junction_reads(bamfile, shards[0])
+    for shard in shards[1:]:
+        counts.update(_get_junction_reads(bamfile, shard))
+    test_uniquely, test_multi = counts.to_dicts()
+
+    pdt.assert_dict_equal(test_uniquely, uniquely)
+    pdt.assert_dict_equal(test_multi, multi)
+
+
 def test_bam_to_junction_reads_table(
         bamfile, single_bam_final_junction_reads_table_csv,
         ignore_multimapping):
@@ -168,14 +277,16 @@ def test_bam_to_junction_reads_table(
     test = bam_to_junction_reads_table(bamfile, ignore_multimapping)
     true = pd.read_csv(single_bam_final_junction_reads_table_csv)
 
-    pdt.assert_frame_equal(test, true)
+    pdt.assert_frame_equal(test, true, check_dtype=False)
 
 
+@pytest.mark.parametrize('n_jobs', [1, -1])
 def test_read_multiple_bams(bam_filenames, multiple_bams_reads_table_csvs,
-                            ignore_multimapping):
+                            ignore_multimapping, n_jobs):
     from outrigger.io.bam import read_multiple_bams
 
-    test = read_multiple_bams(bam_filenames, ignore_multimapping)
+    test = read_multiple_bams(bam_filenames, ignore_multimapping,
+                              n_jobs=n_jobs)
 
     dfs = [pd.read_csv(csv) for csv in multiple_bams_reads_table_csvs]
     true = pd.concat(dfs, ignore_index=True)
@@ -187,4 +298,124 @@ def test_read_multiple_bams(bam_filenames, multiple_bams_reads_table_csvs,
     true = true.sort_values(true.columns.tolist())
     true.index = range(len(true.index))
 
+    pdt.assert_frame_equal(test, true, check_dtype=False)
+
+
+def test_read_multiple_bams_threads(bam_filenames, ignore_multimapping):
+    from outrigger.io.bam import read_multiple_bams
+
+    # Decompressing each region with several threads gives the same reads
+    true = read_multiple_bams(bam_filenames, ignore_multimapping, n_jobs=2)
+    test = read_multiple_bams(bam_filenames, ignore_multimapping, n_jobs=2,
+                              threads=3)
     pdt.assert_frame_equal(test, true)
+
+
+def test__target_regions():
+    from outrigger.io.bam import _target_regions
+
+    starts = np.array([500, 101, 150, 1000])
+    stops = np.array([600, 200, 400, 1001])
+    test = _target_regions(starts, stops)
+    assert test == [(100, 400), (499, 600), (999, 1001)]
+
+
+def test_read_multiple_bams_targeted(bam_filenames, ignore_multimapping):
+    from outrigger.io.bam import read_multiple_bams, \
+        read_multiple_bams_targeted
+    from outrigger.io.core import junction_reads_to_sparse
+
+    reads = read_multiple_bams(bam_filenames, ignore_multimapping)
+    true, true_samples, true_junctions = junction_reads_to_sparse(reads)
+
+    # Junctions without any reads are left out
+    junctions = list(true_junctions) + ['junction:chr2:100-200:+']
+    test, test_samples, test_junctions = read_multiple_bams_targeted(
+        bam_filenames, junctions, ignore_multimapping)
+
+    pdt.assert_index_equal(test_samples, true_samples)
+    pdt.assert_index_equal(test_junctions, true_junctions)
+    assert (test != true).nnz == 0
+
+
+def test_barcode_junction_counts():
+    from outrigger.io.bam import BarcodeJunctionCounts
+
+    counts = BarcodeJunctionCounts(['chr1'], whitelist=['AAA', 'CCC'],
+                                   umis=True)
+    chrom = np.zeros(5, dtype=np.int32)
+    start = np.array([100, 100, 100, 100, 300], dtype=np.int32)
+    stop = np.array([200, 200, 200, 200, 400], dtype=np.int32)
+    reverse = np.zeros(5, dtype=bool)
+    uniquely = np.array([0, 1, 1, 1, 0])
+    barcode = np.array(['AAA', 'AAA', 'AAA', 'GGG', 'CCC'], dtype=object)
+    umi = np.array(['TT', 'TT', 'GG', 'TT', 'TT'], dtype=object)
+    counts.add(chrom, start, stop, reverse, uniquely, 1 - uniquely, barcode,
+               umi)
+    # The same molecule again, which can't be counted twice
+    counts.add(chrom[:1], start[:1], stop[:1], reverse[:1], uniquely[:1],
+               1 - uniquely[:1], barcode[:1], umi[:1])
+
+    # Only the molecules of junctions starting up to 150 are finished
+    counts.flush(150, chrom=0)
+    assert counts.molecule_keys[3].tolist() == [300]
+    counts.flush()
+
+    # Barcode "GGG" isn't in the whitelist, and the first molecule of "AAA"
+    # has a uniquely mapped read
+    assert counts.barcodes[counts.barcode].tolist() == ['AAA', 'CCC']
+    assert counts.start.tolist() == [100, 300]
+    assert counts.uniquely.tolist() == [2, 0]
+    assert counts.multi.tolist() == [0, 1]
+
+
+def test_read_barcoded_bams(tmpdir, bam_filenames, ignore_multimapping):
+    from outrigger.io.bam import read_multiple_bams, read_barcoded_bams
+    from outrigger.io.core import junction_reads_to_sparse
+
+    reads = read_multiple_bams(bam_filenames, ignore_multimapping)
+    true, true_samples, true_junctions = junction_reads_to_sparse(reads)
+
+    # Put the reads of all the bam files in one, with the file name as the
+    # cell barcode
+    unsorted = tmpdir.join('unsorted.bam').strpath
+    multiplexed = tmpdir.join('multiplexed.bam').strpath
+    with pysam.AlignmentFile(bam_filenames[0], 'rb') as template:
+        header = template.header.to_dict()
+        header['HD'] = {'VN': header.get('HD', {}).get('VN', '1.0'),
+                        'SO': 'unsorted'}
+        with pysam.AlignmentFile(unsorted, 'wb', header=header) as out:
+            for filename in bam_filenames:
+                with pysam.AlignmentFile(filename, 'rb') as samfile:
+                    assert samfile.references == template.references
+                    for read in samfile.fetch(until_eof=True):
+                        read.set_tag('CB', os.path.basename(filename))
+                        read.set_tag('UB', read.query_name)
+                        out.write(read)
+    pysam.sort('-o', multiplexed, unsorted)
+    pysam.index(multiplexed)
+
+    # The molecules of unsorted files would all be kept until the end
+    with pytest.raises(ValueError):
+        read_barcoded_bams([unsorted], umi_tag='UB', n_jobs=1)
+
+    test, test_barcodes, test_junctions = read_barcoded_bams(
+        [multiplexed], ignore_multimapping=ignore_multimapping)
+
+    pdt.assert_index_equal(test_barcodes, true_samples)
+    pdt.assert_index_equal(test_junctions, true_junctions)
+    assert (test != true).nnz == 0
+
+
+@pytest.mark.parametrize('uniquely_mapped, true_reads, true_observed', [
+    (True, [0], [False]), (False, [3], [True])])
+def test__targeted_reads(uniquely_mapped, true_reads, true_observed):
+    from outrigger.io.bam import _targeted_reads
+
+    # Only multi-mapped reads on the junction, which are used only if the
+    # sample has no uniquely mapped reads on any other junction either
+    counts = np.array([[0, 0, 3, 0]])
+    reads, observed = _targeted_reads(counts, np.array([0]),
+                                      np.array([False]), uniquely_mapped)
+    assert reads.tolist() == true_reads
+    assert observed.tolist() == true_observed
@@ -0,0 +1,253 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pandas.util.testing as pdt
+import pytest
+
+
+def test_junction_reads_to_sparse(junction_reads):
+    from outrigger.io.core import junction_reads_to_sparse
+
+    true = junction_reads.pivot(index='sample_id', columns='junction_id',
+                                values='reads')
+    true = true.fillna(0).astype(int)
+
+    reads2d, samples, junctions = junction_reads_to_sparse(junction_reads)
+
+    assert reads2d.format == 'csc'
+    assert reads2d.dtype == np.uint16
+    assert reads2d.nnz == (true.values != 0).sum()
+    pdt.assert_index_equal(samples, true.index)
+    pdt.assert_index_equal(junctions, true.columns)
+    pdt.assert_numpy_array_equal(reads2d.toarray(),
+                                 true.values.astype(np.uint16))
+
+
+@pytest.mark.parametrize('chunksize', [1, 100, 1000000])
+def test_read_junction_reads_sparse(tasic2016_outrigger_junctions,
+                                    junction_reads, chunksize):
+    from outrigger.io.core import junction_reads_to_sparse, \
+        read_junction_reads_sparse
+
+    filename = os.path.join(tasic2016_outrigger_junctions, 'reads.csv')
+    true_reads2d, true_samples, true_junctions = junction_reads_to_sparse(
+        junction_reads)
+
+    reads2d, samples, junctions = read_junction_reads_sparse(
+        filename, chunksize=chunksize)
+
+    assert reads2d.format == 'csc'
+    pdt.assert_index_equal(samples, true_samples)
+    pdt.assert_index_equal(junctions, true_junctions)
+    pdt.assert_numpy_array_equal(reads2d.toarray(), true_reads2d.toarray())
+
+
+def test_read_junction_reads_sparse_missing_column(
+        tasic2016_outrigger_junctions):
+    from outrigger.io.core import read_junction_reads_sparse
+
+    filename = os.path.join(tasic2016_outrigger_junctions, 'reads.csv')
+    with pytest.raises(ValueError):
+        read_junction_reads_sparse(filename, reads_col='not_a_column')
+
+
+def test_junction_reads_to_sparse_junctions(junction_reads):
+    from outrigger.io.core import junction_reads_to_sparse
+
+    true_reads2d, true_samples, true_junctions = junction_reads_to_sparse(
+        junction_reads)
+    junctions = pd.Index(['not_a_junction'] + list(true_junctions[::2]),
+                         name='junction_id')
+
+    reads2d, samples, test_junctions = junction_reads_to_sparse(
+        junction_reads, junctions=junctions)
+
+    pdt.assert_index_equal(samples, true_samples)
+    pdt.assert_index_equal(test_junctions, junctions)
+    assert reads2d[:, 0].nnz == 0
+    pdt.assert_numpy_array_equal(reads2d[:, 1:].toarray(),
+                                 true_reads2d[:, ::2].toarray())
+
+
+@pytest.mark.parametrize('chunksize', [7, 100, 1000000])
+@pytest.mark.parametrize('n_samples', [1, 10, 1000])
+def test_iter_junction_reads_samples(tasic2016_outrigger_junctions,
+                                     junction_reads, chunksize, n_samples):
+    from outrigger.io.core import iter_junction_reads_samples
+
+    filename = os.path.join(tasic2016_outrigger_junctions, 'reads.csv')
+    batches = list(iter_junction_reads_samples(
+        filename, n_samples=n_samples, chunksize=chunksize))
+
+    assert all(batch.sample_id.nunique() <= n_samples for batch in batches)
+    samples = [set(batch.sample_id) for batch in batches]
+    assert sum(len(x) for x in samples) == junction_reads.sample_id.nunique()
+
+    test = pd.concat(batches, ignore_index=True)
+    true = junction_reads[test.columns]
+    pdt.assert_frame_equal(test, true, check_dtype=False)
+
+
+def test_iter_junction_reads_samples_not_grouped(tmpdir, junction_reads):
+    from outrigger.io.core import iter_junction_reads_samples
+
+    filename = tmpdir.join('reads.csv').strpath
+    junction_reads.sort_values('junction_id').to_csv(filename, index=False)
+
+    with pytest.raises(ValueError):
+        list(iter_junction_reads_samples(filename, n_samples=1,
+                                         chunksize=100))
+
+
+def test_read_junction_ids(tasic2016_outrigger_junctions, junction_reads):
+    from outrigger.io.core import read_junction_ids
+
+    filename = os.path.join(tasic2016_outrigger_junctions, 'reads.csv')
+    test = read_junction_ids(filename, chunksize=100)
+    assert test == set(junction_reads.junction_id)
+
+
+def test_paste_csv_columns(tmpdir):
+    from outrigger.io.core import paste_csv_columns
+
+    true = pd.DataFrame({'a': [0.5, np.nan], 'b,c': [1.0, 0.0],
+                         'd': [np.nan, 0.25]},
+                        index=pd.Index(['event1', 'event2'], name='event_id'))
+    filenames = []
+    for i, column in enumerate(true):
+        filename = tmpdir.join('{}.csv'.format(i)).strpath
+        true[[column]].to_csv(filename, na_rep='NA')
+        filenames.append(filename)
+
+    output = tmpdir.join('pasted.csv').strpath
+    paste_csv_columns(filenames, output)
+
+    test = pd.read_csv(output, index_col=0)
+    pdt.assert_frame_equal(test, true)
+
+
+def test_paste_csv_columns_different_rows(tmpdir):
+    from outrigger.io.core import paste_csv_columns
+
+    filenames = []
+    for i, index in enumerate([['event1', 'event2'], ['event2', 'event1']]):
+        filename = tmpdir.join('{}.csv'.format(i)).strpath
+        pd.DataFrame({i: [0, 1]}, index=index).to_csv(filename)
+        filenames.append(filename)
+
+    with pytest.raises(ValueError):
+        paste_csv_columns(filenames, tmpdir.join('pasted.csv').strpath)
+
+
+def test_read_junction_reads_sparse_samples(tasic2016_outrigger_junctions,
+                                            junction_reads):
+    from outrigger.io.core import junction_reads_to_sparse, \
+        read_junction_reads_sparse
+
+    filename = os.path.join(tasic2016_outrigger_junctions, 'reads.csv')
+    true_reads2d, true_samples, true_junctions = junction_reads_to_sparse(
+        junction_reads)
+    samples = pd.Index(['not_a_sample'] + list(true_samples),
+                       name='sample_id')
+
+    reads2d, test_samples, junctions = read_junction_reads_sparse(
+        filename, samples=samples)
+
+    pdt.assert_index_equal(test_samples, samples)
+    assert reads2d[0].nnz == 0
+    pdt.assert_numpy_array_equal(reads2d[1:].toarray(),
+                                 true_reads2d.toarray())
+
+    with pytest.raises(ValueError):
+        read_junction_reads_sparse(filename, samples=true_samples[1:])
+
+
+def test_split_junction_reads_by_chromosome(tmpdir,
+                                            tasic2016_outrigger_junctions,
+                                            junction_reads):
+    from outrigger.io.core import split_junction_reads_by_chromosome
+
+    filename = os.path.join(tasic2016_outrigger_junctions, 'reads.csv')
+    filenames, samples, nonzero = split_junction_reads_by_chromosome(
+        filename, tmpdir.strpath, chunksize=1000)
+
+    chroms = junction_reads.junction_id.str.split(':').str[1]
+    assert set(filenames) == set(chroms)
+    pdt.assert_index_equal(
+        samples, pd.Index(sorted(junction_reads.sample_id.unique()),
+                          name='sample_id'))
+    for chrom, chrom_filename in filenames.items():
+        test = pd.read_csv(chrom_filename)
+        true = junction_reads.loc[chroms == chrom, test.columns]
+        true.index = test.index
+        pdt.assert_frame_equal(test, true, check_dtype=False)
+        assert nonzero[chrom] == (true.reads != 0).sum()
+
+
+def test_append_csv_rows(tmpdir):
+    from outrigger.io.core import append_csv_rows
+
+    df1 = pd.DataFrame({'a': [1, 2], 'b': ['x', 'y']})
+    df2 = pd.DataFrame({'a': [3], 'c': [0.5]})
+    filenames = []
+    for i, df in enumerate([df1, df2]):
+        filename = tmpdir.join('{}.csv'.format(i)).strpath
+        df.to_csv(filename, index=False)
+        filenames.append(filename)
+
+    output = tmpdir.join('appended.csv').strpath
+    values = [{'splice_type': 'se'}, {'splice_type': 'mxe'}]
+    append_csv_rows(filenames, output, values=values, index=True,
+                    chunksize=1)
+
+    true = pd.concat([df1.assign(splice_type='se'),
+                      df2.assign(splice_type='mxe')], ignore_index=True)
+    test = pd.read_csv(output, index_col=0)
+    pdt.assert_frame_equal(test, true)
+
+
+@pytest.mark.parametrize('max_count, dtype', [
+    (0, np.uint16), (65535, np.uint16), (65536, np.uint32),
+    (2 ** 32, np.uint64)])
+def test_count_dtype(max_count, dtype):
+    from outrigger.io.core import count_dtype
+
+    assert count_dtype(max_count) == dtype
+
+
+def test_count_dtype_overflow():
+    from outrigger.io.core import count_dtype
+
+    with pytest.raises(OverflowError):
+        count_dtype(2 ** 64)
+
+
+def test_compact_counts():
+    from scipy import sparse
+    from outrigger.io.core import compact_counts
+
+    counts = np.array([0, 3, 70000], dtype=np.int64)
+    test = compact_counts(counts)
+    assert test.dtype == np.uint32
+    pdt.assert_numpy_array_equal(test, counts.astype(np.uint32))
+
+    test = compact_counts(sparse.csc_matrix(counts[:2]))
+    assert test.dtype == np.uint16
+    assert compact_counts(counts[:0]).dtype == np.uint16
+
+    with pytest.raises(ValueError):
+        compact_counts(np.array([1, -1]))
+
+
+def test_junction_reads_to_sparse_duplicates_overflow():
+    from outrigger.io.core import junction_reads_to_sparse
+
+    # Each row fits in 16 bits, but their sum doesn't
+    junction_reads = pd.DataFrame({'sample_id': ['a', 'a'],
+                                   'junction_id': ['j', 'j'],
+                                   'reads': [60000, 60000]})
+    reads2d, samples, junctions = junction_reads_to_sparse(junction_reads)
+
+    assert reads2d.dtype == np.uint32
+    assert reads2d[0, 0] == 120000
@@ -1,12 +1,15 @@
+import os
+
 import gffutils
 import pytest
 
 
-def test_create_db(gtf_filename, db, snap25_exon_id):
+def test_create_db(tmpdir, gtf_filename, db, snap25_exon_id):
     from outrigger.io import gtf
 
     true = db
-    test = gtf.create_db(gtf_filename, 'test.gtf.db')
+    test = gtf.create_db(gtf_filename,
+                         os.path.join(tmpdir.strpath, 'test.gtf.db'))
 
     # Check that all the true db features are in the test database
     for featuretype in true.featuretypes():
@@ -0,0 +1,77 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pandas.util.testing as pdt
+import pytest
+
+
+@pytest.fixture
+def events():
+    return pd.DataFrame(
+        {'event_location': ['event:chr2:500-900:+', 'event:chr1:100-400:-',
+                            'event:chr1:150-200:-', 'event:chr1:1000-2000:+',
+                            'event:chr2:100-200:+'],
+         'isoform1_gene_name': ['Snap25', 'Tpm1', 'Tpm1', 'Myl6,Atp5j',
+                                np.nan],
+         'isoform2_gene_name': ['Snap25', 'Tpm1', 'Tpm1', 'Myl6', np.nan]},
+        index=pd.Index(['e1', 'e2', 'e3', 'e4', 'e5'], name='event_id'))
+
+
+@pytest.fixture
+def psi(events):
+    return pd.DataFrame(
+        np.arange(10, dtype=np.float32).reshape(5, 2) / 10,
+        index=events.index,
+        columns=pd.Index(['s1', 's2'], name='sample_id'))
+
+
+@pytest.fixture
+def store(tmpdir, psi, events):
+    from outrigger.io.store import write_psi_store, PsiStore
+
+    folder = write_psi_store(psi, events,
+                             os.path.join(tmpdir.strpath, 'store'),
+                             chunk_size=2)
+    return PsiStore(folder)
+
+
+def test_psi_store_events(store):
+    assert len(store) == 5
+    assert os.path.exists(os.path.join(store.folder, 'psi_00002.npy'))
+    assert list(store.events.index) == ['e2', 'e3', 'e4', 'e5', 'e1']
+
+
+@pytest.mark.parametrize('region, true', [
+    (('chr1', 180, 300), ['e2', 'e3']),
+    (('chr1', 300, 1000), ['e2', 'e4']),
+    (('chr1', 201, 999), ['e2']),
+    (('chr1', 401, 999), []),
+    (('chr1', 100, 5000, '+'), ['e4']),
+    (('chr2', 1, 1000), ['e5', 'e1']),
+    (('chrX', 1, 1000), [])])
+def test_psi_store_region(store, psi, region, true):
+    test = store.region(*region)
+    pdt.assert_frame_equal(test, psi.loc[true])
+
+
+@pytest.mark.parametrize('gene, true', [
+    ('Tpm1', ['e2', 'e3']), ('Atp5j', ['e4']), ('Myl6', ['e4']),
+    ('Snap25', ['e1']), ('Actb', [])])
+def test_psi_store_gene(store, psi, gene, true):
+    test = store.gene(gene)
+    pdt.assert_frame_equal(test, psi.loc[true])
+
+
+def test_write_psi_store_duplicate_events(tmpdir, psi, events):
+    from outrigger.io.store import write_psi_store, PsiStore
+
+    # The same event on several rows of the events table
+    duplicated = pd.concat([events, events.iloc[[1, 3]]])
+    folder = write_psi_store(psi, duplicated,
+                             os.path.join(tmpdir.strpath, 'store'),
+                             chunk_size=2)
+    store = PsiStore(folder)
+
+    assert len(store) == 5
+    pdt.assert_frame_equal(store.gene('Tpm1'), psi.loc[['e2', 'e3']])
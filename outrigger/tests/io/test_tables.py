@@ -0,0 +1,146 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pandas.util.testing as pdt
+import pytest
+
+
+@pytest.fixture(params=['csv', 'parquet', 'feather', 'npz'])
+def output_format(request):
+    if request.param in ('parquet', 'feather'):
+        pytest.importorskip('pyarrow')
+    return request.param
+
+
+@pytest.fixture
+def table():
+    return pd.DataFrame(
+        {'sample_id': ['a', 'a', 'b', np.nan],
+         'reads': np.array([1, 2, 70000, 0], dtype=np.uint32),
+         'psi': [0.5, np.nan, 1.0, 0.25]},
+        columns=['sample_id', 'reads', 'psi'],
+        index=pd.Index(['e1', 'e2', 'e3', 'e4'], name='event_id'))
+
+
+@pytest.mark.parametrize('filename, true', [
+    ('reads.csv', 'csv'), ('reads.parquet', 'parquet'),
+    ('reads.feather', 'feather'), ('reads.npz', 'npz'),
+    ('reads.tab', 'csv')])
+def test_table_format(filename, true):
+    from outrigger.io.tables import table_format
+
+    assert table_format(filename) == true
+
+
+@pytest.mark.parametrize('filename, output_format, true', [
+    ('junctions/reads.csv', 'csv', 'junctions/reads.csv'),
+    ('junctions/reads.csv', 'parquet', 'junctions/reads.parquet'),
+    ('junctions/reads.npz', 'feather', 'junctions/reads.feather'),
+    ('junctions/reads.tab', 'npz', 'junctions/reads.tab.npz')])
+def test_table_filename(filename, output_format, true):
+    from outrigger.io.tables import table_filename
+
+    assert table_filename(filename, output_format) == true
+
+
+def test_find_table(tmpdir):
+    from outrigger.io.tables import find_table
+
+    csv = os.path.join(tmpdir.strpath, 'events.csv')
+    npz = os.path.join(tmpdir.strpath, 'events.npz')
+    assert find_table(csv, 'npz') == npz
+
+    open(npz, 'w').close()
+    assert find_table(csv) == npz
+    open(csv, 'w').close()
+    assert find_table(csv) == csv
+    assert find_table(csv, 'npz') == npz
+
+
+def test_resolve_format():
+    from outrigger.io.tables import resolve_format, HAS_PYARROW
+
+    assert resolve_format('csv') == 'csv'
+    assert resolve_format('parquet') == ('parquet' if HAS_PYARROW else 'npz')
+    with pytest.raises(ValueError):
+        resolve_format('xlsx')
+
+
+@pytest.mark.parametrize('index', [True, False])
+def test_write_read_table(tmpdir, table, output_format, index):
+    from outrigger.io.tables import write_table, read_table
+
+    filename = write_table(table, os.path.join(tmpdir.strpath, 'table.csv'),
+                           output_format, index=index)
+    assert filename.endswith('.' + output_format)
+
+    test = read_table(filename, index_col=0 if index else None)
+
+    true = table if index else table.reset_index(drop=True)
+    # Only the binary tables keep the types of the columns
+    pdt.assert_frame_equal(test, true, check_dtype=output_format != 'csv')
+
+
+def test_read_table_columns(tmpdir, table, output_format):
+    from outrigger.io.tables import write_table, read_table
+
+    filename = write_table(table, os.path.join(tmpdir.strpath, 'table.csv'),
+                           output_format, index=False)
+    test = read_table(filename, columns=['sample_id', 'psi'])
+
+    pdt.assert_frame_equal(test, table[['sample_id', 'psi']].reset_index(
+        drop=True))
+
+
+@pytest.fixture
+def psi():
+    return pd.DataFrame(
+        [[0.5, np.nan, 0.0], [np.nan, np.nan, 1.0], [0.25, 0.333, np.nan]],
+        index=pd.Index(['s1', 's2', 's3'], name='sample_id'),
+        columns=pd.Index(['e1', 'e2', 'e3'], name='event_id'),
+        dtype=np.float32)
+
+
+def test_sparse_psi_filename():
+    from outrigger.io.tables import sparse_psi_filename
+
+    assert sparse_psi_filename('psi/psi.csv') == 'psi/psi_sparse.npz'
+    assert sparse_psi_filename('psi/psi.parquet') == 'psi/psi_sparse.npz'
+    assert sparse_psi_filename('psi/psi_sparse.npz') == 'psi/psi_sparse.npz'
+
+
+@pytest.mark.parametrize('sparse', [False, True])
+def test_write_read_sparse_psi(tmpdir, psi, sparse):
+    from outrigger.io.tables import write_sparse_psi, read_sparse_psi
+
+    filename = write_sparse_psi(psi, os.path.join(tmpdir.strpath, 'psi.csv'))
+    assert filename.endswith('psi_sparse.npz')
+
+    # Only the observed Psi are stored, including the zero
+    with np.load(filename) as arrays:
+        assert arrays['data'].dtype == np.float32
+        assert len(arrays['data']) == 5
+
+    test = read_sparse_psi(filename, sparse=sparse)
+    if sparse:
+        assert all(isinstance(dtype, pd.SparseDtype) for dtype in test.dtypes)
+        test = test.sparse.to_dense()
+    pdt.assert_frame_equal(test, psi)
+
+
+def test_write_read_sparse_psi_quantized(tmpdir, psi):
+    from outrigger.io.tables import write_sparse_psi, read_sparse_psi
+
+    filename = write_sparse_psi(psi, os.path.join(tmpdir.strpath, 'psi.csv'),
+                                quantize=True)
+    with np.load(filename) as arrays:
+        assert arrays['data'].dtype == np.uint8
+        assert arrays['data'].max() <= 250
+
+    test = read_sparse_psi(filename)
+    pdt.assert_frame_equal(test.isnull(), psi.isnull())
+    # Half a step, e.g. Psi=0.25 is code 62.5, which rounds to 62, plus the
+    # rounding of the 32-bit floats
+    error = np.nanmax(np.abs(test.values - psi.values))
+    assert error <= 1 / 500. + np.finfo(np.float32).eps
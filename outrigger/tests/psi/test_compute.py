@@ -80,6 +80,31 @@ def test__single_isoform_maybe_reject(junction_reads_for_rejecting,
                                                        true_case=row['case']))
 
 
+def test__vectorized_maybe_reject(junction_reads_for_rejecting,
+                                  dummy_isoform1_junction_numbers,
+                                  dummy_isoform2_junction_numbers):
+    from outrigger.psi.compute import _single_isoform_maybe_reject, \
+        _vectorized_maybe_reject, _case_notes
+
+    n_junctions = len(dummy_isoform1_junction_numbers) \
+        + len(dummy_isoform2_junction_numbers)
+
+    isoform1 = junction_reads_for_rejecting[
+        dummy_isoform1_junction_numbers].values
+    isoform2 = junction_reads_for_rejecting[
+        dummy_isoform2_junction_numbers].values
+    cases = _vectorized_maybe_reject(isoform1, isoform2)
+    test = _case_notes()[cases]
+
+    for (i, row), test_case in zip(junction_reads_for_rejecting.iterrows(),
+                                   test):
+        isoform1, isoform2, true_case = _single_isoform_maybe_reject(
+            row[dummy_isoform1_junction_numbers],
+            row[dummy_isoform2_junction_numbers],
+            n_junctions=n_junctions)
+        assert test_case == true_case
+
+
 @pytest.fixture(params=[({'junction12': 1000, 'junction23': 20}, 'unequal'),
                         ({'junction12': 100, 'junction23': 20}, 'similar'),
                         ({'junction12': 20, 'junction23': 1000}, 'unequal'),
@@ -371,6 +396,39 @@ def test__single_event_psi(event_id, event_df_csv, reads2d,
     pdt.assert_frame_equal(test, true)
 
 
+def test__junction_positions(event_annotation, reads2d, isoform1_junctions,
+                             isoform2_junctions):
+    from outrigger.common import INCOMPATIBLE_JUNCTIONS
+    from outrigger.psi.compute import _junction_positions
+
+    junction_numbers = isoform1_junctions + isoform2_junctions
+    events = event_annotation.groupby(level=0).first()
+    missing_event = events.index[0]
+    missing_junction = events.loc[missing_event, isoform2_junctions[-1]]
+    junctions = reads2d.columns.drop(missing_junction)
+
+    event_ids, positions, incompatible_positions, incompatible_mask = \
+        _junction_positions(event_annotation, junctions, isoform1_junctions,
+                            isoform2_junctions)
+
+    has_missing = (events[junction_numbers] == missing_junction).any(axis=1)
+    pdt.assert_numpy_array_equal(event_ids,
+                                 events.index[~has_missing].values)
+    assert missing_event not in event_ids
+
+    for i, event_id in enumerate(event_ids):
+        true = events.loc[event_id, junction_numbers].tolist()
+        assert junctions[positions[i]].tolist() == true
+
+        incompatible = events.loc[event_id, INCOMPATIBLE_JUNCTIONS]
+        test = junctions[incompatible_positions[i][incompatible_mask[i]]]
+        if isinstance(incompatible, float):
+            assert len(test) == 0
+        else:
+            true = junctions.intersection(incompatible.split('|'))
+            assert test.tolist() == true.tolist()
+
+
 @pytest.fixture
 def psi_csv(splice_type, tasic2016_outrigger_output_psi):
     return os.path.join(tasic2016_outrigger_output_psi, splice_type, 'psi.csv')
@@ -401,7 +459,11 @@ def test__maybe_parallelize_psi(event_annotation, reads2d,
                                    isoform1_junctions, isoform2_junctions,
                                    n_jobs=n_jobs)
     tests = [t for t in tests if t is not None]
+
+    # When parallelized, the events come in chunks, so split them back up
+    tests = [df for name, df in pd.concat(tests).groupby('event_id')]
     trues = [df for name, df in summary_df.groupby('event_id')]
+    assert len(tests) == len(trues)
 
     out, err = capsys.readouterr()
 
@@ -420,6 +482,30 @@ def test__maybe_parallelize_psi(event_annotation, reads2d,
         pdt.assert_frame_equal(test, true)
 
 
+@pytest.mark.parametrize('n_chunks', [1, 2, 3, 100])
+def test__balanced_chunks(n_chunks):
+    from outrigger.psi.compute import _balanced_chunks
+
+    costs = np.array([1, 1, 1, 10, 1, 1, 1, 1], dtype=float)
+    chunks = _balanced_chunks(costs, n_chunks)
+
+    # Every event is in exactly one chunk, in the original order
+    positions = np.concatenate([np.arange(len(costs))[c] for c in chunks])
+    assert (positions == np.arange(len(costs))).all()
+    assert len(chunks) <= min(n_chunks, len(costs))
+    assert all(chunk.stop > chunk.start for chunk in chunks)
+
+    # No chunk costs much more than an equal share, plus one event
+    totals = [costs[chunk].sum() for chunk in chunks]
+    assert max(totals) <= costs.sum() / len(chunks) + costs.max()
+
+
+def test__balanced_chunks_empty():
+    from outrigger.psi.compute import _balanced_chunks
+
+    assert _balanced_chunks(np.array([]), 4) == []
+
+
 def test_calculate_psi(event_annotation, reads2d,
                        isoform1_junctions, isoform2_junctions,
                        psi_df, summary_df):
@@ -434,5 +520,346 @@ def test_calculate_psi(event_annotation, reads2d,
     # When psi is written to CSV, only the index name is preserved, not the
     # column names so need to get rid of it for these comparisons
     test_psi.columns.name = None
+    pdt.assert_frame_equal(test_psi, true_psi.astype(np.float32))
+    pdt.assert_frame_equal(test_summary, true_summary)
+
+
+@pytest.fixture(params=['numpy', 'batched'])
+def engine(request):
+    return request.param
+
+
+def test_calculate_psi_engine(event_annotation, reads2d, isoform1_junctions,
+                              isoform2_junctions, engine):
+    from outrigger.psi.compute import calculate_psi
+
+    true_psi, true_summary = calculate_psi(event_annotation, reads2d,
+                                           isoform1_junctions,
+                                           isoform2_junctions, n_jobs=1)
+    test_psi, test_summary = calculate_psi(event_annotation, reads2d,
+                                           isoform1_junctions,
+                                           isoform2_junctions, n_jobs=1,
+                                           engine=engine, batch_size=3)
+    pdt.assert_frame_equal(test_psi, true_psi)
+    pdt.assert_frame_equal(test_summary, true_summary)
+
+
+@pytest.mark.parametrize('sparse_engine', ['pandas', 'numpy', 'batched'])
+def test_calculate_psi_sparse(event_annotation, reads2d, isoform1_junctions,
+                              isoform2_junctions, sparse_engine):
+    from scipy import sparse
+    from outrigger.psi.compute import calculate_psi
+
+    true_psi, true_summary = calculate_psi(event_annotation, reads2d,
+                                           isoform1_junctions,
+                                           isoform2_junctions, n_jobs=1,
+                                           engine=sparse_engine)
+    test_psi, test_summary = calculate_psi(
+        event_annotation, sparse.csr_matrix(reads2d.values),
+        isoform1_junctions, isoform2_junctions, n_jobs=1,
+        engine=sparse_engine, samples=reads2d.index,
+        junctions=reads2d.columns)
     pdt.assert_frame_equal(test_psi, true_psi)
     pdt.assert_frame_equal(test_summary, true_summary)
+
+
+def test_index_junctions(event_annotation, reads2d, isoform1_junctions,
+                         isoform2_junctions):
+    from outrigger.psi.compute import calculate_psi, index_junctions
+
+    junctions = index_junctions(event_annotation, isoform1_junctions,
+                                isoform2_junctions)
+    assert junctions.is_monotonic_increasing
+    assert junctions.is_unique
+    for junction_id in event_annotation[isoform1_junctions
+                                        + isoform2_junctions].values.ravel():
+        assert junction_id in junctions
+
+    # Only the junctions of the index are needed for the same Psi
+    used = reads2d.reindex(columns=junctions, fill_value=0)
+    used = used.loc[:, reads2d.columns.intersection(junctions)]
+    true_psi, true_summary = calculate_psi(event_annotation, reads2d,
+                                           isoform1_junctions,
+                                           isoform2_junctions, n_jobs=1)
+    test_psi, test_summary = calculate_psi(event_annotation, used,
+                                           isoform1_junctions,
+                                           isoform2_junctions, n_jobs=1)
+    pdt.assert_frame_equal(test_psi, true_psi)
+    pdt.assert_frame_equal(test_summary, true_summary)
+
+
+def test__reads_matrix_sparse_no_ids(reads2d):
+    from scipy import sparse
+    from outrigger.psi.compute import _reads_matrix
+
+    reads = sparse.csc_matrix(reads2d.values)
+    with pytest.raises(ValueError):
+        _reads_matrix(reads)
+    with pytest.raises(ValueError):
+        _reads_matrix(reads, reads2d.index[1:], reads2d.columns)
+
+
+@pytest.mark.parametrize('min_reads', [0, 10])
+def test_calculate_psi_pruned(event_annotation, reads2d, isoform1_junctions,
+                              isoform2_junctions, min_reads, engine):
+    from outrigger.psi.compute import calculate_psi, _single_event_psi
+
+    # Make some samples have no reads at all, and one event have no reads in
+    # any sample, so they are skipped
+    reads2d = reads2d.copy()
+    reads2d.iloc[::3] = 0
+    first = event_annotation.iloc[0]
+    junctions = first[isoform1_junctions + isoform2_junctions].tolist()
+    if isinstance(first['incompatible_junctions'], str):
+        junctions += first['incompatible_junctions'].split('|')
+    reads2d.loc[:, reads2d.columns.intersection(junctions)] = 0
+
+    # Reference of going through all the cases with all samples of each event
+    trues = [_single_event_psi(event_id, event_df, reads2d,
+                               isoform1_junctions, isoform2_junctions,
+                               min_reads=min_reads)
+             for event_id, event_df in event_annotation.groupby(level=0)]
+    true_summary = pd.concat(trues, ignore_index=True)
+
+    for n_jobs in (1, 2):
+        test_psi, test_summary = calculate_psi(
+            event_annotation, reads2d, isoform1_junctions,
+            isoform2_junctions, min_reads=min_reads, n_jobs=n_jobs,
+            engine=engine, batch_size=3)
+        pdt.assert_frame_equal(test_summary, true_summary)
+
+
+def test_calculate_psi_compact(event_annotation, reads2d, isoform1_junctions,
+                               isoform2_junctions, engine):
+    from outrigger.psi.compute import calculate_psi
+
+    reads2d = reads2d.copy()
+    reads2d.iloc[::2] = 0
+
+    true_psi, true_summary = calculate_psi(event_annotation, reads2d,
+                                           isoform1_junctions,
+                                           isoform2_junctions, n_jobs=1)
+    test_psi, test_summary = calculate_psi(
+        event_annotation, reads2d, isoform1_junctions, isoform2_junctions,
+        n_jobs=1, engine=engine, compact_summary=True)
+    test_zero_reads = test_summary.zero_reads
+
+    pdt.assert_frame_equal(test_psi, true_psi)
+
+    # Only samples with zero reads are left out, and they are all counted
+    assert len(test_summary) + test_zero_reads.sum() == len(true_summary)
+    n_summarized = test_summary.groupby('event_id').size()
+    n_summarized = n_summarized.reindex(test_zero_reads.index, fill_value=0)
+    assert (n_summarized + test_zero_reads == len(reads2d.index)).all()
+    index = ['sample_id', 'event_id']
+    true = true_summary.set_index(index).loc[test_summary.set_index(
+        index).index].reset_index()[test_summary.columns]
+    pdt.assert_frame_equal(test_summary, true, check_dtype=False,
+                           check_frame_type=False)
+    left_out = ~true_summary.set_index(index).index.isin(
+        test_summary.set_index(index).index)
+    assert true_summary.loc[left_out, 'notes'].str.startswith('Case 2').all()
+
+
+def test_calculate_psi_categorical(event_annotation, reads2d,
+                                   isoform1_junctions, isoform2_junctions,
+                                   engine):
+    from outrigger.psi.compute import calculate_psi
+
+    true_psi, true_summary = calculate_psi(event_annotation, reads2d,
+                                           isoform1_junctions,
+                                           isoform2_junctions, n_jobs=1)
+    test_psi, test_summary = calculate_psi(
+        event_annotation, reads2d, isoform1_junctions, isoform2_junctions,
+        n_jobs=1, engine=engine, categorical_summary=True)
+
+    pdt.assert_frame_equal(test_psi, true_psi)
+    for column in ('sample_id', 'event_id', 'notes'):
+        assert pd.api.types.is_categorical_dtype(test_summary[column])
+        test_summary[column] = test_summary[column].astype(object)
+    pdt.assert_frame_equal(test_summary, true_summary, check_dtype=False)
+
+
+def test_concat_summaries():
+    from outrigger.psi.compute import concat_summaries
+
+    summary1 = pd.DataFrame({'notes': pd.Categorical(['a', 'b']),
+                             'psi': [0.5, 1.0]})
+    summary2 = pd.DataFrame({'notes': pd.Categorical(['c', 'a']),
+                             'psi': [0.0, np.nan]})
+
+    test = concat_summaries([summary1, summary2])
+    assert pd.api.types.is_categorical_dtype(test['notes'])
+    true = pd.concat([summary1.astype(object), summary2.astype(object)],
+                     ignore_index=True)
+    pdt.assert_frame_equal(test.astype(object), true)
+
+
+def test_calculate_psi_no_summary(event_annotation, reads2d,
+                                  isoform1_junctions, isoform2_junctions,
+                                  n_jobs, engine):
+    from outrigger.psi.compute import calculate_psi
+
+    reads2d = reads2d.copy()
+    reads2d.iloc[::2] = 0
+
+    true_psi, true_summary = calculate_psi(event_annotation, reads2d,
+                                           isoform1_junctions,
+                                           isoform2_junctions, n_jobs=1)
+    test_psi, test_summary = calculate_psi(
+        event_annotation, reads2d, isoform1_junctions, isoform2_junctions,
+        n_jobs=n_jobs, engine=engine, summarize=False)
+
+    assert test_summary is None
+    assert test_psi.dtypes.eq(np.float32).all()
+    pdt.assert_frame_equal(test_psi, true_psi)
+    pivoted = true_summary.pivot(index='sample_id', columns='event_id',
+                                 values='psi')
+    pdt.assert_frame_equal(test_psi, pivoted.astype(np.float32))
+
+
+@pytest.mark.parametrize('sweep_engine', ['pandas', 'numpy', 'batched'])
+@pytest.mark.parametrize('compact_summary', [False, True])
+def test_calculate_psi_sweep(event_annotation, reads2d, isoform1_junctions,
+                             isoform2_junctions, n_jobs, sweep_engine,
+                             compact_summary):
+    from outrigger.psi.compute import calculate_psi, calculate_psi_sweep
+
+    reads2d = reads2d.copy()
+    reads2d.iloc[::2] = 0
+
+    min_reads = [0, 10]
+    method = ['mean', 'min']
+    uneven_coverage_multiplier = [2, 10]
+    test = calculate_psi_sweep(
+        event_annotation, reads2d, isoform1_junctions, isoform2_junctions,
+        min_reads=min_reads, method=method,
+        uneven_coverage_multiplier=uneven_coverage_multiplier,
+        n_jobs=n_jobs, engine=sweep_engine, batch_size=2,
+        compact_summary=compact_summary, categorical_summary=True)
+
+    assert len(test) == 8
+    for (x, y, z), (test_psi, test_summary) in test.items():
+        true_psi, true_summary = calculate_psi(
+            event_annotation, reads2d, isoform1_junctions,
+            isoform2_junctions, min_reads=x, method=y,
+            uneven_coverage_multiplier=z, n_jobs=1, engine=sweep_engine,
+            batch_size=2, compact_summary=compact_summary,
+            categorical_summary=True)
+        pdt.assert_frame_equal(test_psi, true_psi)
+        pdt.assert_frame_equal(test_summary, true_summary)
+        if compact_summary:
+            pdt.assert_series_equal(test_summary.zero_reads,
+                                    true_summary.zero_reads)
+
+
+def test_calculate_psi_list(event_annotation, reads2d, isoform1_junctions,
+                            isoform2_junctions):
+    from outrigger.psi.compute import calculate_psi
+
+    with pytest.raises(ValueError):
+        calculate_psi(event_annotation, reads2d, isoform1_junctions,
+                      isoform2_junctions, min_reads=[0, 10])
+
+
+def test__shared_reads(reads2d):
+    from outrigger.psi.compute import _shared_reads
+
+    reads = reads2d.values
+    with _shared_reads(reads) as shared:
+        assert isinstance(shared, np.memmap)
+        assert not shared.flags.writeable
+        filename = shared.filename
+        pdt.assert_numpy_array_equal(np.asarray(shared), reads)
+    assert not os.path.exists(filename)
+
+
+def test__shared_reads_sparse(reads2d):
+    from scipy import sparse
+    from outrigger.psi.compute import _shared_reads
+
+    reads = sparse.csc_matrix(reads2d.values)
+    with _shared_reads(reads) as shared:
+        assert sparse.isspmatrix_csc(shared)
+        assert isinstance(shared.data, np.memmap)
+        pdt.assert_numpy_array_equal(shared.toarray(), reads2d.values)
+
+
+@pytest.mark.parametrize('as_sparse', [False, True])
+def test_group_junction_reads(reads2d, as_sparse):
+    from scipy import sparse
+    from outrigger.psi.compute import group_junction_reads
+
+    # Leave out the last sample, which isn't in any group
+    groups = pd.Series(['a', 'b', 'c'] * (len(reads2d.index) // 3),
+                       index=reads2d.index[:len(reads2d.index) // 3 * 3])
+    true = reads2d.loc[groups.index].groupby(groups).sum()
+
+    reads = sparse.csc_matrix(reads2d.values) if as_sparse \
+        else reads2d.values
+    test, group_ids, junctions = group_junction_reads(
+        reads, groups, samples=reads2d.index, junctions=reads2d.columns)
+
+    assert sparse.issparse(test) == as_sparse
+    if as_sparse:
+        test = test.toarray()
+    pdt.assert_index_equal(group_ids, pd.Index(true.index.values,
+                                               name=reads2d.index.name))
+    pdt.assert_index_equal(junctions, reads2d.columns)
+    pdt.assert_numpy_array_equal(test, true.values)
+
+
+def test_group_junction_reads_bootstraps(reads2d):
+    from outrigger.psi.compute import group_junction_reads
+
+    # A group of one sample always resamples that same sample
+    groups = pd.Series(['a', 'b', 'b'], index=reads2d.index[:3])
+    n_bootstraps = 5
+
+    test, group_ids, junctions = group_junction_reads(
+        reads2d, groups, n_bootstraps=n_bootstraps, random_state=0)
+    same, same_ids, same_junctions = group_junction_reads(
+        reads2d, groups, n_bootstraps=n_bootstraps, random_state=0)
+
+    assert test.shape == (2 + 2 * n_bootstraps, reads2d.shape[1])
+    assert list(group_ids) == ['a', 'b'] + [
+        '{}_bootstrap{}'.format(name, i) for name in 'ab'
+        for i in range(1, n_bootstraps + 1)]
+    pdt.assert_numpy_array_equal(test, same)
+    for i in range(2, 2 + n_bootstraps):
+        pdt.assert_numpy_array_equal(test[i], reads2d.values[0])
+    # Every bootstrap of b has two of its samples, so the reads are any of
+    # twice the first sample, twice the second, or both of them
+    b = reads2d.values[1:3]
+    options = [2 * b[0], 2 * b[1], b[0] + b[1]]
+    for i in range(2 + n_bootstraps, 2 + 2 * n_bootstraps):
+        assert any((test[i] == x).all() for x in options)
+
+
+def test_group_junction_reads_no_groups(reads2d):
+    from outrigger.psi.compute import group_junction_reads
+
+    groups = pd.Series(['a'], index=['not_a_sample'])
+    with pytest.raises(ValueError):
+        group_junction_reads(reads2d, groups)
+
+
+@pytest.mark.parametrize('compact_engine', ['pandas', 'numpy', 'batched'])
+@pytest.mark.parametrize('method', ['mean', 'min'])
+def test_calculate_psi_compact_counts(event_annotation, reads2d,
+                                      isoform1_junctions, isoform2_junctions,
+                                      compact_engine, method):
+    from outrigger.psi.compute import calculate_psi
+
+    # Big enough that adding or multiplying them overflows 16 bits
+    reads = np.minimum(reads2d * 1000, 65535).astype(np.int64)
+
+    true_psi, true_summary = calculate_psi(
+        event_annotation, reads, isoform1_junctions, isoform2_junctions,
+        method=method, n_jobs=1, engine=compact_engine)
+    test_psi, test_summary = calculate_psi(
+        event_annotation, reads.astype(np.uint16), isoform1_junctions,
+        isoform2_junctions, method=method, n_jobs=1, engine=compact_engine)
+
+    pdt.assert_frame_equal(test_psi, true_psi)
+    pdt.assert_frame_equal(test_summary, true_summary, check_dtype=False)
@@ -1,6 +1,7 @@
 
 import filecmp
 import os
+import shutil
 
 import pandas as pd
 import pandas.util.testing as pdt
@@ -289,6 +290,292 @@ class TestCommandLine(object):
         dir2 = tasic2016_outrigger_output
         assert_directories_equal(dir1, dir2, ignore=['.DS_Store'])
 
+    def test_main_psi_stream(self, tmpdir, tasic2016_unprocessed,
+                             tasic2016_outrigger_output, sj_filenames):
+        from outrigger.commandline import CommandLine
+
+        output_folder = tmpdir.strpath
+
+        gtf = os.path.join(tasic2016_unprocessed, 'gtf',
+                           'gencode.vM10.annotation.subset.gtf')
+        arguments = ['index', '--sj-out-tab']
+        arguments.extend(sj_filenames)
+        arguments.extend(['--gtf', gtf, '--output', output_folder])
+        CommandLine(arguments)
+
+        args = ['psi', '--output', output_folder, '--n-jobs', '1',
+                '--stream', '--samples-per-batch', '10']
+        CommandLine(args)
+
+        dir1 = output_folder
+        dir2 = tasic2016_outrigger_output
+        assert_directories_equal(
+            dir1, dir2, ignore=['.DS_Store', 'outrigger_summary.csv'])
+
+        # The samples are summarized a batch at a time, so only the row
+        # numbers are different
+        filename = os.path.join('psi', 'outrigger_summary.csv')
+        df1 = pd.read_csv(os.path.join(dir1, filename),
+                          index_col=0).sort_index(axis=1)
+        df2 = pd.read_csv(os.path.join(dir2, filename),
+                          index_col=0).sort_index(axis=1)
+        df1 = df1.sort_values(df1.columns.tolist()).reset_index(drop=True)
+        df2 = df2.sort_values(df2.columns.tolist()).reset_index(drop=True)
+        pdt.assert_frame_equal(df1, df2)
+
+    def test_main_psi_by_chromosome(self, tmpdir, tasic2016_unprocessed,
+                                    tasic2016_outrigger_output,
+                                    sj_filenames, n_jobs):
+        from outrigger.commandline import CommandLine
+
+        output_folder = tmpdir.strpath
+
+        gtf = os.path.join(tasic2016_unprocessed, 'gtf',
+                           'gencode.vM10.annotation.subset.gtf')
+        arguments = ['index', '--sj-out-tab']
+        arguments.extend(sj_filenames)
+        arguments.extend(['--gtf', gtf, '--output', output_folder])
+        CommandLine(arguments)
+
+        # Tiny memory limit so the chromosomes are done a few at a time
+        args = ['psi', '--output', output_folder, '--n-jobs', str(n_jobs),
+                '--by-chromosome', '--max-memory', '0.0001']
+        CommandLine(args)
+
+        dir1 = output_folder
+        dir2 = tasic2016_outrigger_output
+        assert_directories_equal(dir1, dir2, ignore=['.DS_Store'])
+
+    def test_main_psi_sweep(self, tmpdir, tasic2016_unprocessed,
+                            sj_filenames):
+        from outrigger.commandline import CommandLine
+
+        output_folder = tmpdir.strpath
+
+        gtf = os.path.join(tasic2016_unprocessed, 'gtf',
+                           'gencode.vM10.annotation.subset.gtf')
+        arguments = ['index', '--sj-out-tab']
+        arguments.extend(sj_filenames)
+        arguments.extend(['--gtf', gtf, '--output', output_folder])
+        CommandLine(arguments)
+
+        args = ['psi', '--output', output_folder, '--n-jobs', '1',
+                '--min-reads', '10,20', '--method', 'mean,min']
+        CommandLine(args)
+
+        folders = sorted(os.listdir(os.path.join(output_folder, 'psi')))
+        assert folders == [
+            'min_reads={}_method={}_uneven_coverage_multiplier=10'.format(
+                min_reads, method)
+            for min_reads in (10, 20) for method in ('mean', 'min')]
+
+        # The default setting gives the same Psi as calculating it alone
+        dir1 = os.path.join(tmpdir.strpath, 'sweep_default')
+        shutil.move(os.path.join(
+            output_folder, 'psi',
+            'min_reads=10_method=mean_uneven_coverage_multiplier=10'), dir1)
+        shutil.rmtree(os.path.join(output_folder, 'psi'))
+        args = ['psi', '--output', output_folder, '--n-jobs', '1']
+        CommandLine(args)
+        dir2 = os.path.join(output_folder, 'psi')
+        assert_directories_equal(dir1, dir2, ignore=['.DS_Store'])
+        for filename in ('outrigger_psi.csv', 'outrigger_summary.csv'):
+            df1 = pd.read_csv(os.path.join(dir1, filename), index_col=0)
+            df2 = pd.read_csv(os.path.join(dir2, filename), index_col=0)
+            pdt.assert_frame_equal(df1, df2)
+
+    def test_main_psi_groups(self, tmpdir, tasic2016_unprocessed,
+                             sj_filenames):
+        from outrigger.commandline import CommandLine
+
+        output_folder = tmpdir.strpath
+
+        gtf = os.path.join(tasic2016_unprocessed, 'gtf',
+                           'gencode.vM10.annotation.subset.gtf')
+        arguments = ['index', '--sj-out-tab']
+        arguments.extend(sj_filenames)
+        arguments.extend(['--gtf', gtf, '--output', output_folder])
+        CommandLine(arguments)
+
+        junction_reads = pd.read_csv(
+            os.path.join(output_folder, 'junctions', 'reads.csv'))
+        samples = sorted(junction_reads['sample_id'].unique())
+        groups = pd.DataFrame({'sample_id': samples,
+                               'group': ['odd', 'even'] * (len(samples) // 2)
+                               + ['odd'] * (len(samples) % 2)})
+        groups_csv = os.path.join(output_folder, 'groups.csv')
+        groups.to_csv(groups_csv, index=False)
+
+        args = ['psi', '--output', output_folder, '--n-jobs', '1',
+                '--groups', groups_csv, '--n-bootstraps', '2', '--seed', '0']
+        CommandLine(args)
+
+        # Psi is written events x samples, so the groups are the columns
+        psi = pd.read_csv(os.path.join(output_folder, 'psi',
+                                       'outrigger_psi.csv'), index_col=0)
+        assert list(psi.columns) == [
+            'even', 'odd', 'even_bootstrap1', 'even_bootstrap2',
+            'odd_bootstrap1', 'odd_bootstrap2']
+
+        # The Psi of each group is the Psi of the sum of its samples' reads
+        shutil.rmtree(os.path.join(output_folder, 'psi'))
+        junction_reads['sample_id'] = junction_reads['sample_id'].map(
+            groups.set_index('sample_id')['group'])
+        summed = junction_reads.groupby(
+            ['sample_id', 'junction_id'])['reads'].sum().reset_index()
+        summed.to_csv(os.path.join(output_folder, 'junctions', 'reads.csv'),
+                      index=False)
+        args = ['psi', '--output', output_folder, '--n-jobs', '1']
+        CommandLine(args)
+        true = pd.read_csv(os.path.join(output_folder, 'psi',
+                                        'outrigger_psi.csv'), index_col=0)
+        pdt.assert_frame_equal(psi[['even', 'odd']],
+                               true.loc[psi.index, ['even', 'odd']],
+                               check_names=False)
+
+    def test_main_psi_output_format(self, tmpdir, tasic2016_unprocessed,
+                                    tasic2016_outrigger_output,
+                                    sj_filenames):
+        from outrigger.commandline import CommandLine
+        from outrigger.io.tables import read_table
+
+        output_folder = tmpdir.strpath
+
+        gtf = os.path.join(tasic2016_unprocessed, 'gtf',
+                           'gencode.vM10.annotation.subset.gtf')
+        arguments = ['index', '--sj-out-tab']
+        arguments.extend(sj_filenames)
+        arguments.extend(['--gtf', gtf, '--output', output_folder,
+                          '--output-format', 'npz'])
+        CommandLine(arguments)
+        assert os.path.exists(os.path.join(output_folder, 'junctions',
+                                           'reads.npz'))
+        assert os.path.exists(os.path.join(output_folder, 'index', 'se',
+                                           'events.npz'))
+
+        # Psi reads the npz tables of the index without being told to
+        args = ['psi', '--output', output_folder, '--n-jobs', '1',
+                '--output-format', 'npz']
+        CommandLine(args)
+
+        for name in ('outrigger_psi', 'outrigger_summary'):
+            test = read_table(os.path.join(output_folder, 'psi',
+                                           name + '.npz'), index_col=0)
+            true = pd.read_csv(os.path.join(tasic2016_outrigger_output,
+                                            'psi', name + '.csv'),
+                               index_col=0)
+            pdt.assert_frame_equal(test, true, check_dtype=False)
+
+    def test_main_psi_sparse(self, tmpdir, tasic2016_unprocessed,
+                             tasic2016_outrigger_output, sj_filenames):
+        from outrigger.commandline import CommandLine
+        from outrigger.io.tables import read_sparse_psi
+
+        output_folder = tmpdir.strpath
+
+        gtf = os.path.join(tasic2016_unprocessed, 'gtf',
+                           'gencode.vM10.annotation.subset.gtf')
+        arguments = ['index', '--sj-out-tab']
+        arguments.extend(sj_filenames)
+        arguments.extend(['--gtf', gtf, '--output', output_folder])
+        CommandLine(arguments)
+
+        args = ['psi', '--output', output_folder, '--n-jobs', '1',
+                '--sparse-psi']
+        CommandLine(args)
+
+        filename = os.path.join(output_folder, 'psi',
+                                'outrigger_psi_sparse.npz')
+        test = read_sparse_psi(filename)
+        true = pd.read_csv(os.path.join(tasic2016_outrigger_output, 'psi',
+                                        'outrigger_psi.csv'), index_col=0)
+        pdt.assert_frame_equal(test, true, check_dtype=False,
+                               check_names=False)
+        assert os.path.exists(os.path.join(output_folder, 'psi', 'se',
+                                           'psi_sparse.npz'))
+
+    def test_main_psi_store(self, tmpdir, tasic2016_unprocessed,
+                            tasic2016_outrigger_output, sj_filenames):
+        from outrigger.commandline import CommandLine
+        from outrigger.io.store import PsiStore
+
+        output_folder = tmpdir.strpath
+
+        gtf = os.path.join(tasic2016_unprocessed, 'gtf',
+                           'gencode.vM10.annotation.subset.gtf')
+        arguments = ['index', '--sj-out-tab']
+        arguments.extend(sj_filenames)
+        arguments.extend(['--gtf', gtf, '--output', output_folder])
+        CommandLine(arguments)
+
+        args = ['psi', '--output', output_folder, '--n-jobs', '1',
+                '--psi-store']
+        CommandLine(args)
+
+        store = PsiStore(os.path.join(output_folder, 'psi',
+                                      'outrigger_psi_store'))
+        true = pd.read_csv(os.path.join(tasic2016_outrigger_output, 'psi',
+                                        'outrigger_psi.csv'), index_col=0)
+        assert len(store) == len(true)
+
+        test = store.gene('Snap25')
+        assert len(test) > 0
+        pdt.assert_frame_equal(test, true.loc[test.index], check_dtype=False,
+                               check_names=False)
+
+    def test_main_psi_checkpoint_resume(self, tmpdir, monkeypatch,
+                                        tasic2016_unprocessed,
+                                        tasic2016_outrigger_output,
+                                        sj_filenames):
+        from outrigger.commandline import CommandLine, Psi
+        from outrigger.psi import compute
+
+        output_folder = tmpdir.strpath
+
+        gtf = os.path.join(tasic2016_unprocessed, 'gtf',
+                           'gencode.vM10.annotation.subset.gtf')
+        arguments = ['index', '--sj-out-tab']
+        arguments.extend(sj_filenames)
+        arguments.extend(['--gtf', gtf, '--output', output_folder])
+        CommandLine(arguments)
+
+        # Stop the run after all the chunks are calculated
+        def interrupt(*args, **kwargs):
+            raise KeyboardInterrupt
+        args = ['psi', '--output', output_folder, '--n-jobs', '1',
+                '--checkpoint-size', '5']
+        with monkeypatch.context() as m:
+            m.setattr(Psi, 'write_psi', interrupt)
+            with pytest.raises(KeyboardInterrupt):
+                CommandLine(args)
+        checkpoints = os.path.join(output_folder, 'psi', 'checkpoints')
+        assert os.path.exists(os.path.join(checkpoints, 'se', 'chunk00000'))
+
+        # Chunks made with other settings can't be mixed in
+        for other in (['--checkpoint-size', '7'], ['--min-reads', '20']):
+            with pytest.raises(ValueError):
+                CommandLine(args + other + ['--resume'])
+        assert os.path.exists(os.path.join(checkpoints, 'se', 'chunk00000'))
+
+        # Resuming reads every chunk instead of calculating it again
+        def calculate_psi(*args, **kwargs):
+            raise AssertionError('Finished chunks were calculated again')
+        monkeypatch.setattr(compute, 'calculate_psi', calculate_psi)
+        CommandLine(args + ['--resume'])
+        assert not os.path.exists(checkpoints)
+
+        dir1 = output_folder
+        dir2 = tasic2016_outrigger_output
+        assert_directories_equal(
+            dir1, dir2, ignore=['.DS_Store', 'outrigger_summary.csv',
+                                'summary.csv'])
+        filename = os.path.join('psi', 'outrigger_summary.csv')
+        df1 = pd.read_csv(os.path.join(dir1, filename), index_col=0)
+        df2 = pd.read_csv(os.path.join(dir2, filename), index_col=0)
+        df1 = df1.sort_values(df1.columns.tolist()).reset_index(drop=True)
+        df2 = df2.sort_values(df2.columns.tolist()).reset_index(drop=True)
+        pdt.assert_frame_equal(df1, df2)
+
     def test_main_psi_bam(self, tmpdir, tasic2016_outrigger_output_index,
                           tasic2016_outrigger_output_bam, bam_filenames):
         from outrigger.commandline import CommandLine
@@ -304,3 +591,42 @@ class TestCommandLine(object):
         dir1 = output_folder
         dir2 = tasic2016_outrigger_output_bam
         assert_directories_equal(dir1, dir2, ignore=['.DS_Store', 'index'])
+
+    def test_main_psi_bam_targeted(self, tmpdir,
+                                   tasic2016_outrigger_output_index,
+                                   tasic2016_outrigger_output_bam,
+                                   bam_filenames):
+        from outrigger.commandline import CommandLine
+
+        output_folder = tmpdir.strpath
+
+        args = ['psi', '--output', output_folder, '--n-jobs', '1',
+                '--index', tasic2016_outrigger_output_index, '--targeted',
+                '--bam']
+        args.extend(bam_filenames)
+        CommandLine(args)
+
+        # Only the reads of the index's junctions are counted, so there is
+        # no junction reads file, but the Psi is the same
+        assert not os.path.exists(os.path.join(output_folder, 'junctions',
+                                               'reads.csv'))
+        dir1 = os.path.join(output_folder, 'psi')
+        dir2 = os.path.join(tasic2016_outrigger_output_bam, 'psi')
+        assert_directories_equal(dir1, dir2, ignore=['.DS_Store'])
+
+
+@pytest.mark.parametrize('max_memory', [None, 1, 5, 10, 100])
+def test__memory_waves(max_memory):
+    from outrigger.commandline import _memory_waves
+
+    memory = {'chr1': 6, 'chr2': 4, 'chr3': 3, 'chrX': 2, 'chrY': 1}
+    waves = _memory_waves(memory, max_memory)
+
+    chroms = [chrom for wave in waves for chrom in wave]
+    assert sorted(chroms) == sorted(memory)
+    if max_memory is None:
+        assert len(waves) == 1
+    else:
+        for wave in waves:
+            total = sum(memory[chrom] for chrom in wave)
+            assert total <= max_memory or len(wave) == 1